@@ -10,7 +10,7 @@ from models.route_optimizer import optimize_routes
 from models.time_predictor import predict_travel_time
 from models.clustering import cluster_locations
 from utils.geocoding import geocode_address
-from utils.distance_matrix import calculate_distance_matrix
+from utils.location_matrix import location_distance_matrix, register_location_listeners
 from utils.data_processing import process_csv_data
 from models.traffic_optimizer import optimize_routes_with_traffic
 from models.traffic_data import get_overpass_traffic_data
@@ -102,6 +102,18 @@ class Location(db.Model):
     time_window_end = db.Column(db.Time, nullable=True)
     created_at = db.Column(db.DateTime, default=datetime.utcnow)
 
+# Keep the maintained distance matrix in sync with the Location table
+register_location_listeners(Location)
+
+def location_matrix_for(locations):
+    """
+    Get the distance matrix for a list of location dicts from the maintained
+    Location matrix, loading it from the database on first use.
+    """
+    if not location_distance_matrix.loaded:
+        location_distance_matrix.load((loc.id, loc.latitude, loc.longitude) for loc in Location.query.all())
+    return location_distance_matrix.matrix_for((loc['id'], loc['latitude'], loc['longitude']) for loc in locations)
+
 class Route(db.Model):
     id = db.Column(db.Integer, primary_key=True)
     name = db.Column(db.String(100), nullable=False)
@@ -430,7 +442,7 @@ def optimize_route():
     
     # Calculate distance matrix
     coordinates = [{'lat': loc['latitude'], 'lng': loc['longitude']} for loc in [depot] + delivery_locations]
-    distance_matrix = calculate_distance_matrix(coordinates)
+    distance_matrix = location_matrix_for([depot] + delivery_locations)
     
     # Enhanced: Generate vehicle data for each vehicle
     vehicle_data = []
@@ -1234,7 +1246,7 @@ def optimize_route_fuel_efficient():
         
         # Calculate distance matrix
         coordinates = [{'lat': loc['latitude'], 'lng': loc['longitude']} for loc in [depot] + delivery_locations]
-        distance_matrix = calculate_distance_matrix(coordinates)
+        distance_matrix = location_matrix_for([depot] + delivery_locations)
         
         # Get traffic data if enabled
         use_traffic = request.form.get('use_traffic', default='on') == 'on'
@@ -1400,8 +1412,9 @@ def complete_route(current_driver, route_id):
         )
         
         if success:
-            # Try to retrain the model if we have enough data
-            collector.retrain_model()
+            # Retrain in the background (debounced) once enough data is collected
+            from models.retraining_worker import retraining_worker
+            retraining_worker.request_retrain()
             
             # If there's a driver_route, update its status
             if driver_route and driver_route.status != 'completed':
@@ -1447,6 +1460,18 @@ def get_fuel_accuracy_metrics():
             'error': str(e)
         }), 200
 
+@app.route('/api/models/registry', methods=['GET'])
+def get_model_registry_stats():
+    """Get load counters for the models cached by this worker process, retraining status and the accuracy of a built lookup table."""
+    from models.model_registry import model_registry
+    from models.retraining_worker import retraining_worker
+    from models.time_predictor import TravelTimePredictor
+    
+    stats = model_registry.get_stats()
+    stats['retraining'] = retraining_worker.status()
+    stats['travel_time_lookup'] = TravelTimePredictor().lookup_table_report()
+    return jsonify(stats), 200
+
 @app.route('/api/drivers/efficiency', methods=['GET'])
 def get_driver_efficiency():
     """Get driver efficiency rankings based on actual fuel consumption."""
@@ -2183,5 +2208,8 @@ if __name__ == '__main__':
     
     with app.app_context():
         db.create_all()
+        
+        # Build the maintained distance matrix before the first optimize request
+        location_distance_matrix.load((loc.id, loc.latitude, loc.longitude) for loc in Location.query.all())
     
     app.run(debug=True)
\ No newline at end of file
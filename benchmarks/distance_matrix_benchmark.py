@@ -0,0 +1,73 @@
+"""
+Benchmark the vectorized haversine distance matrix against the original
+pure-Python double loop.
+
+Usage:
+    python -m benchmarks.distance_matrix_benchmark [--sizes 100 1000 5000]
+
+For large sizes the Python loop is timed on a sample of rows and
+extrapolated to the full matrix (marked with '~').
+"""
+import argparse
+import time
+
+import numpy as np
+
+from utils.distance_matrix import haversine_distance, haversine_matrix
+
+
+def python_distance_matrix(lats, lngs, rows=None):
+    """Original list-of-lists implementation, optionally limited to the first `rows` rows."""
+    n = len(lats)
+    rows = n if rows is None else min(rows, n)
+    matrix = [[0 for _ in range(n)] for _ in range(rows)]
+    for i in range(rows):
+        for j in range(n):
+            if i != j:
+                matrix[i][j] = haversine_distance(lats[i], lngs[i], lats[j], lngs[j])
+    return matrix
+
+
+def random_coordinates(n, seed=42):
+    """Random points spread over a metropolitan-sized area."""
+    rng = np.random.default_rng(seed)
+    lats = rng.uniform(30.60, 30.80, n)
+    lngs = rng.uniform(76.70, 76.90, n)
+    return lats, lngs
+
+
+def run(sizes, max_loop_rows=1000):
+    print(f"{'N':>6} {'python loop (s)':>16} {'float64 (s)':>12} {'float32 (s)':>12} {'speedup':>9}")
+    for n in sizes:
+        lats, lngs = random_coordinates(n)
+        lat_list, lng_list = lats.tolist(), lngs.tolist()
+        
+        sample_rows = min(n, max_loop_rows)
+        start = time.perf_counter()
+        python_distance_matrix(lat_list, lng_list, rows=sample_rows)
+        loop_time = (time.perf_counter() - start) * n / sample_rows
+        extrapolated = sample_rows < n
+        
+        start = time.perf_counter()
+        matrix64 = haversine_matrix(lats, lngs, dtype=np.float64)
+        vec64_time = time.perf_counter() - start
+        
+        start = time.perf_counter()
+        haversine_matrix(lats, lngs, dtype=np.float32)
+        vec32_time = time.perf_counter() - start
+        
+        # Spot-check correctness against the scalar implementation
+        expected = haversine_distance(lats[0], lngs[0], lats[-1], lngs[-1])
+        assert abs(matrix64[0, -1] - expected) < 1e-6
+        
+        loop_label = f"{'~' if extrapolated else ''}{loop_time:.3f}"
+        print(f"{n:>6} {loop_label:>16} {vec64_time:>12.4f} {vec32_time:>12.4f} {loop_time / vec64_time:>8.1f}x")
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--sizes', type=int, nargs='+', default=[100, 1000, 5000])
+    parser.add_argument('--max-loop-rows', type=int, default=1000,
+                        help='Rows of the Python loop to time before extrapolating')
+    args = parser.parse_args()
+    run(args.sizes, args.max_loop_rows)
@@ -0,0 +1,75 @@
+"""
+Benchmark fuel consumption inference: per-row predict(), sklearn batch and
+the compiled NumPy trees.
+
+Usage:
+    python -m benchmarks.fuel_inference_benchmark [--rows 1000 100000]
+
+A model is trained on synthetic data in a temporary directory. Per-row
+predict() is timed on a sample and extrapolated (marked with '~'). The
+batch paths report the best of --repeats runs; their crossover sets
+COMPILED_PREDICT_MAX_ROWS, and the last column shows which path
+predict_batch takes for that many rows.
+"""
+import argparse
+import os
+import tempfile
+import time
+
+import numpy as np
+import pandas as pd
+
+from models.fuel_consumption_model import COMPILED_PREDICT_MAX_ROWS, FuelConsumptionPredictor
+
+
+def route_segments(predictor, n):
+    """Random route segments as columns, in the format predict_batch expects."""
+    data = predictor.generate_synthetic_training_data(n).drop('fuel_consumption', axis=1)
+    return {name: data[name].to_numpy() for name in data.columns}
+
+
+def best_time(function, repeats):
+    """Shortest wall time of several calls, and the last result."""
+    best = float('inf')
+    for _ in range(repeats):
+        start = time.perf_counter()
+        result = function()
+        best = min(best, time.perf_counter() - start)
+    return best, result
+
+
+def run(row_counts, repeats=3, max_single_rows=2000):
+    with tempfile.TemporaryDirectory() as tmp:
+        predictor = FuelConsumptionPredictor(os.path.join(tmp, 'fuel_model.pkl'))
+        predictor.train(predictor.generate_synthetic_training_data(1000))
+        compiled = predictor.compiled_model
+        feature_names = list(predictor.model.feature_names_in_)
+        
+        print(f"{'rows':>8} {'predict() per row (s)':>22} {'sklearn batch (s)':>18} {'compiled (s)':>13} "
+              f"{'max diff':>9} {'predict_batch':>14}")
+        for n in row_counts:
+            segments = route_segments(predictor, n)
+            X = predictor._encode_features(segments, feature_names, 0, n)
+            
+            sample = min(n, max_single_rows)
+            start = time.perf_counter()
+            for i in range(sample):
+                predictor.predict({name: column[i] for name, column in segments.items()})
+            single_time = (time.perf_counter() - start) * n / sample
+            
+            sklearn_time, expected = best_time(
+                lambda: predictor.model.predict(pd.DataFrame(X, columns=feature_names)), repeats)
+            compiled_time, actual = best_time(lambda: compiled.predict(X), repeats)
+            
+            marker = '~' if sample < n else ' '
+            path = 'compiled' if n <= COMPILED_PREDICT_MAX_ROWS else 'sklearn'
+            print(f"{n:>8} {marker}{single_time:>21.3f} {sklearn_time:>18.4f} {compiled_time:>13.4f} "
+                  f"{np.abs(actual - expected).max():>9.1e} {path:>14}")
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--rows', type=int, nargs='+', default=[1000, 5000, 20000, 100000])
+    parser.add_argument('--repeats', type=int, default=3)
+    args = parser.parse_args()
+    run(args.rows, args.repeats)
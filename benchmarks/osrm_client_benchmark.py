@@ -0,0 +1,60 @@
+"""
+Benchmark the chunked OSRM table client against the bundled stub server.
+
+Usage:
+    python -m benchmarks.osrm_client_benchmark [--sizes 100 500 1000] [--latency-ms 20]
+
+The stub server is started in-process, so no OSRM instance or network
+access is needed.
+"""
+import argparse
+import time
+
+import numpy as np
+
+from benchmarks.osrm_stub_server import start_stub_server
+from utils.distance_matrix import haversine_matrix, osrm_distance_matrix
+
+
+def random_coordinates(n, seed=42):
+    """Random points spread over a metropolitan-sized area."""
+    rng = np.random.default_rng(seed)
+    return [{'lat': lat, 'lng': lng} for lat, lng in zip(rng.uniform(30.60, 30.80, n), rng.uniform(76.70, 76.90, n))]
+
+
+def run(sizes, latency_ms, block_size, workers):
+    server, url = start_stub_server(latency_ms=latency_ms, max_table_size=block_size)
+    try:
+        print(f"{'N':>6} {'blocks':>7} {'serial (s)':>11} {'concurrent (s)':>15} {'speedup':>9}")
+        for n in sizes:
+            coordinates = random_coordinates(n)
+            blocks = (-(-n // block_size)) ** 2
+            
+            start = time.perf_counter()
+            serial = osrm_distance_matrix(coordinates, url, block_size=block_size, max_workers=1)
+            serial_time = time.perf_counter() - start
+            
+            start = time.perf_counter()
+            concurrent = osrm_distance_matrix(coordinates, url, block_size=block_size, max_workers=workers)
+            concurrent_time = time.perf_counter() - start
+            
+            # The stub returns haversine * 1.3, rounded to 0.1 m
+            lats = np.array([c['lat'] for c in coordinates])
+            lngs = np.array([c['lng'] for c in coordinates])
+            assert np.allclose(concurrent, haversine_matrix(lats, lngs) * 1.3, atol=1e-3)
+            assert np.array_equal(serial, concurrent)
+            
+            print(f"{n:>6} {blocks:>7} {serial_time:>11.3f} {concurrent_time:>15.3f} {serial_time / concurrent_time:>8.1f}x")
+    finally:
+        server.shutdown()
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--sizes', type=int, nargs='+', default=[100, 500, 1000])
+    parser.add_argument('--latency-ms', type=float, default=20,
+                        help='Artificial per-request latency of the stub server')
+    parser.add_argument('--block-size', type=int, default=100)
+    parser.add_argument('--workers', type=int, default=8)
+    args = parser.parse_args()
+    run(args.sizes, args.latency_ms, args.block_size, args.workers)
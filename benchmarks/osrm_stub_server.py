@@ -0,0 +1,120 @@
+"""
+Local OSRM-compatible stub server for offline benchmarking.
+
+Implements the subset of the OSRM table service used by
+utils.distance_matrix.osrm_distance_matrix:
+
+    GET /table/v1/driving/{lng,lat;lng,lat;...}?annotations=distance&sources=..&destinations=..
+
+Distances are haversine distances times a road factor, in meters. Like a
+real OSRM instance it rejects tables larger than --max-table-size, and it
+can add artificial latency per request to mimic network round trips.
+
+Usage:
+    python -m benchmarks.osrm_stub_server [--port 5001] [--latency-ms 20]
+"""
+import argparse
+import json
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import parse_qs, urlsplit
+
+import numpy as np
+
+from utils.distance_matrix import haversine_distances
+
+TABLE_PREFIX = '/table/v1/driving/'
+
+
+class OSRMStubHandler(BaseHTTPRequestHandler):
+    """Request handler answering OSRM table requests."""
+    road_factor = 1.3
+    latency = 0.0
+    max_table_size = 100
+    
+    def do_GET(self):
+        parsed = urlsplit(self.path)
+        if not parsed.path.startswith(TABLE_PREFIX):
+            self._reply(400, {'code': 'InvalidUrl', 'message': 'Only the table service is supported'})
+            return
+        
+        try:
+            points = [tuple(map(float, pair.split(','))) for pair in parsed.path[len(TABLE_PREFIX):].split(';')]
+        except ValueError:
+            self._reply(400, {'code': 'InvalidQuery', 'message': 'Could not parse coordinates'})
+            return
+        
+        query = parse_qs(parsed.query)
+        sources = self._indices(query, 'sources', len(points))
+        destinations = self._indices(query, 'destinations', len(points))
+        
+        if len(sources) > self.max_table_size or len(destinations) > self.max_table_size:
+            self._reply(400, {'code': 'TooBig', 'message': 'Too many table coordinates'})
+            return
+        
+        if self.latency:
+            time.sleep(self.latency)
+        
+        lngs = np.array([p[0] for p in points])
+        lats = np.array([p[1] for p in points])
+        distances = haversine_distances(lats[sources], lngs[sources], lats[destinations], lngs[destinations])
+        distances = distances * 1000 * self.road_factor
+        
+        self._reply(200, {'code': 'Ok', 'distances': distances.round(1).tolist()})
+    
+    def _indices(self, query, name, count):
+        value = query.get(name, ['all'])[0]
+        if value == 'all':
+            return list(range(count))
+        return [int(i) for i in value.split(';')]
+    
+    def _reply(self, status, payload):
+        body = json.dumps(payload).encode()
+        self.send_response(status)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+    
+    def log_message(self, format, *args):
+        # Keep benchmark output readable
+        pass
+
+
+def start_stub_server(port=0, latency_ms=0, max_table_size=100):
+    """
+    Start the stub server in a background thread.
+    
+    Args:
+        port (int): Port to listen on (0 picks a free port)
+        latency_ms (float): Artificial latency added to each request
+        max_table_size (int): Maximum sources/destinations per request
+    
+    Returns:
+        tuple: (server, base_url); call server.shutdown() to stop it
+    """
+    handler = type('ConfiguredOSRMStubHandler', (OSRMStubHandler,), {
+        'latency': latency_ms / 1000.0,
+        'max_table_size': max_table_size,
+    })
+    server = ThreadingHTTPServer(('127.0.0.1', port), handler)
+    server.daemon_threads = True
+    thread = threading.Thread(target=server.serve_forever, daemon=True)
+    thread.start()
+    return server, f"http://127.0.0.1:{server.server_address[1]}"
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--port', type=int, default=5001)
+    parser.add_argument('--latency-ms', type=float, default=0)
+    parser.add_argument('--max-table-size', type=int, default=100)
+    args = parser.parse_args()
+    
+    server, url = start_stub_server(args.port, args.latency_ms, args.max_table_size)
+    print(f"OSRM stub listening on {url}")
+    try:
+        threading.Event().wait()
+    except KeyboardInterrupt:
+        server.shutdown()
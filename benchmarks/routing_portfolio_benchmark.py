@@ -0,0 +1,66 @@
+"""
+Race the routing strategy portfolio on random instances of several sizes
+and report which strategy wins, to pick per-instance-size defaults.
+
+Usage:
+    python -m benchmarks.routing_portfolio_benchmark [--sizes 20 100 500] [--vehicles 3] [--budget-ms 5000] [--workers 6]
+
+Each instance is a random set of points with a haversine distance matrix
+and a unit demand per stop, built with build_routing_model and solved with
+DeliveryRoutingModel.solve_portfolio. Every strategy's objective is printed
+(relative to the winner) along with the winning strategy. The winning
+routes are loaded back into the parent's model and checked to reproduce
+the winning objective. Run it on the target server: with fewer workers
+than strategies only the default strategy and, in turns, some of the
+others are raced on each instance, the rest are reported as skipped.
+"""
+import argparse
+from concurrent.futures import ProcessPoolExecutor
+
+import numpy as np
+
+from models.routing_model import PORTFOLIO_WORKERS, build_routing_model
+from utils.distance_matrix import haversine_matrix
+
+
+def run(sizes, vehicle_count, budget_ms, workers):
+    with ProcessPoolExecutor(max_workers=workers) as pool:
+        run_instances(pool, workers, sizes, vehicle_count, budget_ms)
+
+
+def run_instances(pool, workers, sizes, vehicle_count, budget_ms):
+    rng = np.random.default_rng(0)
+    
+    for n in sizes:
+        lats = rng.uniform(40.6, 40.9, n + 1)
+        lngs = rng.uniform(-74.1, -73.8, n + 1)
+        model = build_routing_model(haversine_matrix(lats, lngs), vehicle_count, speeds_kmh=[40],
+                                    demands=[0] + [1] * n, vehicle_capacities=[n] * vehicle_count)
+        
+        solution = model.solve_portfolio(budget_ms / 1000, pool=pool, workers=workers)
+        trace = model.trace.to_dict()
+        assert solution is not None, "no strategy found a solution"
+        
+        routes = model.route_indices(solution)
+        cost = sum(model.routing.GetArcCostForVehicle(previous, index, vehicle_id)
+                   for vehicle_id, route in enumerate(routes)
+                   for previous, index in zip([model.routing.Start(vehicle_id)] + route,
+                                              route + [model.routing.End(vehicle_id)]))
+        assert cost == trace['objective'], "loaded routes differ from the winning solution"
+        
+        print(f"\n{n} stops, {vehicle_count} vehicles, {budget_ms} ms budget: winner {trace['strategy']}")
+        print(f"{'strategy':>50} {'objective':>10} {'gap':>7} {'stop':>10} {'elapsed (ms)':>13}")
+        for result in trace['portfolio']:
+            gap = (result['objective'] / trace['objective'] - 1) if result['objective'] is not None else float('nan')
+            print(f"{result['strategy']:>50} {str(result['objective']):>10} {gap:>7.2%} {result['stop_reason']:>10} "
+                  f"{str(result['elapsed_ms']):>13}")
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--sizes', type=int, nargs='+', default=[20, 100, 500])
+    parser.add_argument('--vehicles', type=int, default=3)
+    parser.add_argument('--budget-ms', type=int, default=5000)
+    parser.add_argument('--workers', type=int, default=PORTFOLIO_WORKERS)
+    args = parser.parse_args()
+    run(args.sizes, args.vehicles, args.budget_ms, args.workers)
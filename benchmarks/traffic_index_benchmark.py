@@ -0,0 +1,93 @@
+"""
+Benchmark traffic factor lookups: linear scan, spatial index and batch matrix.
+
+Usage:
+    python -m benchmarks.traffic_index_benchmark [--stops 40] [--features 100 1000 10000]
+
+For a fixed set of stops, the number of traffic signals and congestion
+points is increased. The linear scan (check_traffic_signals /
+check_congestion_areas) grows with the number of features; the indexed
+lookup only visits features near each segment, and the batch matrix
+computation (TrafficFeatureIndex.factor_matrices) evaluates all segments
+as array operations. All results are checked to be identical.
+"""
+import argparse
+import random
+import time
+
+import numpy as np
+
+from models.traffic_data import build_traffic_index, check_congestion_areas, check_traffic_signals
+
+# Bounding box of the synthetic city (min_lat, min_lon, max_lat, max_lon)
+BOUNDS = (30.60, 76.70, 30.80, 76.90)
+
+
+def synthetic_traffic_data(feature_count, seed=42):
+    """Signals and congestion ways spread over BOUNDS, roughly half of each."""
+    rng = random.Random(seed)
+    min_lat, min_lon, max_lat, max_lon = BOUNDS
+    
+    signals = [{'lat': rng.uniform(min_lat, max_lat), 'lon': rng.uniform(min_lon, max_lon)}
+               for _ in range(feature_count // 2)]
+    
+    areas = []
+    points_per_area = 5
+    for i in range(max(1, feature_count // 2 // points_per_area)):
+        lat, lon = rng.uniform(min_lat, max_lat), rng.uniform(min_lon, max_lon)
+        coords = [{'lat': lat + rng.uniform(-0.002, 0.002), 'lon': lon + rng.uniform(-0.002, 0.002)}
+                  for _ in range(points_per_area)]
+        areas.append({'way_id': i, 'coords': coords, 'congestion_level': round(rng.uniform(0.2, 0.8), 2)})
+    
+    return {'traffic_signals': signals, 'road_speeds': {}, 'congestion_areas': areas}
+
+
+def synthetic_stops(n, seed=7):
+    rng = random.Random(seed)
+    min_lat, min_lon, max_lat, max_lon = BOUNDS
+    return [{'lat': rng.uniform(min_lat, max_lat), 'lng': rng.uniform(min_lon, max_lon)} for _ in range(n)]
+
+
+def run(stop_count, feature_counts):
+    stops = synthetic_stops(stop_count)
+    pairs = [(a, b) for i, a in enumerate(stops) for j, b in enumerate(stops) if i != j]
+    lats = np.array([s['lat'] for s in stops])
+    lngs = np.array([s['lng'] for s in stops])
+    off_diagonal = ~np.eye(stop_count, dtype=bool)
+    
+    # Warm up (imports sklearn) so it isn't counted in the first row
+    build_traffic_index(synthetic_traffic_data(10))
+    
+    print(f"{stop_count} stops, {len(pairs)} segments")
+    print(f"{'features':>9} {'linear scan (s)':>16} {'indexed (s)':>12} {'batch (s)':>10} {'speedup':>9}")
+    for feature_count in feature_counts:
+        traffic_data = synthetic_traffic_data(feature_count)
+        signals = traffic_data['traffic_signals']
+        areas = traffic_data['congestion_areas']
+        
+        start = time.perf_counter()
+        expected = [(check_traffic_signals(a, b, signals), check_congestion_areas(a, b, areas)) for a, b in pairs]
+        linear_time = time.perf_counter() - start
+        
+        start = time.perf_counter()
+        index = build_traffic_index(traffic_data)
+        actual = [(index.signal_factor(a, b), index.congestion_factor(a, b)) for a, b in pairs]
+        indexed_time = time.perf_counter() - start
+        
+        start = time.perf_counter()
+        signal_matrix, congestion_matrix = build_traffic_index(traffic_data).factor_matrices(lats, lngs)
+        batch = list(zip(signal_matrix[off_diagonal].tolist(), congestion_matrix[off_diagonal].tolist()))
+        batch_time = time.perf_counter() - start
+        
+        assert actual == expected, 'indexed lookup disagrees with the linear scan'
+        assert batch == expected, 'batch matrix disagrees with the linear scan'
+        print(f"{feature_count:>9} {linear_time:>16.3f} {indexed_time:>12.3f} {batch_time:>10.3f} "
+              f"{linear_time / batch_time:>8.1f}x")
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--stops', type=int, default=40)
+    parser.add_argument('--features', type=int, nargs='+', default=[100, 1000, 10000])
+    args = parser.parse_args()
+    run(args.stops, args.features)
@@ -0,0 +1,120 @@
+"""
+Benchmark travel time matrix prediction: flattened per-element features,
+TravelTimePredictor.predict_matrix on the model, and the lookup table.
+
+Usage:
+    python -m benchmarks.travel_time_benchmark [--sizes 200 500 2000] [--samples 300 5000]
+        [--times hourly uniform minutes]
+
+A RandomForest travel time model is trained on synthetic trips in a
+temporary directory for each training set size. The flattened path builds
+one feature row per matrix element in Python and runs the model on all of
+them (the previous implementation); predict_matrix broadcasts per-origin
+features and evaluates the model (a random forest tree by tree) once per
+group of trips that share split intervals and a time bucket. Both matrices
+are checked to be identical. The lookup table path interpolates precomputed
+predictions; its mean relative error versus the model is reported. The
+flattened path is skipped above --max-flat-size.
+
+Departure times are per origin: 'hourly' cycles origins through all 24 hour
+buckets (the dispatch case, N=2000 should stay well under a second),
+'uniform' gives every origin the same hour and 'minutes' spreads origins
+over distinct minutes so every origin has its own time feature.
+"""
+import argparse
+import os
+import tempfile
+import time
+
+import numpy as np
+
+from models.time_predictor import TravelTimePredictor
+
+
+def train_model(path, samples, seed=0):
+    rng = np.random.default_rng(seed)
+    distances = rng.uniform(0.5, 50, samples)
+    hours = rng.integers(0, 24, samples)
+    times = distances / 30 * (1 + 0.5 * np.exp(-((hours - 8) ** 2) / 4)) * rng.uniform(0.9, 1.1, samples)
+    
+    predictor = TravelTimePredictor(path)
+    predictor.train(distances.tolist(), times.tolist(),
+                    time_of_day=[f"{h}:00" for h in hours],
+                    day_of_week=rng.integers(0, 7, samples).tolist())
+    return predictor
+
+
+def flattened_prediction(predictor, distance_matrix, time_of_day, day_of_week):
+    """One Python-built feature row per off-diagonal element."""
+    n = len(distance_matrix)
+    distances, indices = [], []
+    for i in range(n):
+        for j in range(n):
+            if i != j:
+                distances.append(distance_matrix[i][j])
+                indices.append((i, j))
+    
+    times = [time_of_day[i] for i, _ in indices]
+    days = [day_of_week] * len(distances)
+    predicted = predictor.predict(distances, times, days)
+    
+    time_matrix = np.zeros((n, n))
+    for k, (i, j) in enumerate(indices):
+        time_matrix[i, j] = predicted[k]
+    return time_matrix
+
+
+def departure_times(kind, n):
+    """Per-origin time_of_day list for a benchmark case."""
+    if kind == 'uniform':
+        return ['8:00'] * n
+    if kind == 'minutes':
+        return [f"{(h // 60) % 24}:{h % 60:02d}" for h in range(n)]
+    return [f"{h % 24}:00" for h in range(n)]
+
+
+def run(sizes, sample_counts, max_flat_size, time_kinds):
+    rng = np.random.default_rng(1)
+    
+    with tempfile.TemporaryDirectory() as tmp:
+        print(f"{'samples':>8} {'times':>8} {'n':>6} {'flattened (s)':>14} {'matrix (s)':>11} {'table f32 (s)':>14} "
+              f"{'table error':>12}")
+        for samples in sample_counts:
+            predictor = train_model(os.path.join(tmp, f"time_model_{samples}.pkl"), samples)
+            
+            for kind, n in ((kind, n) for kind in time_kinds for n in sizes):
+                distance_matrix = rng.uniform(0.5, 50, (n, n))
+                time_of_day = departure_times(kind, n)
+                
+                start = time.perf_counter()
+                expected = predictor.predict_matrix(distance_matrix, time_of_day, 'monday', use_lookup=False)
+                matrix_time = time.perf_counter() - start
+                
+                start = time.perf_counter()
+                table = predictor.predict_matrix(distance_matrix, time_of_day, 'monday', dtype=np.float32,
+                                                 use_lookup=True)
+                table_time = time.perf_counter() - start
+                
+                off_diagonal = ~np.eye(n, dtype=bool)
+                table_error = np.mean(np.abs(table[off_diagonal] - expected[off_diagonal]) / expected[off_diagonal])
+                
+                flat_time = float('nan')
+                if n <= max_flat_size:
+                    start = time.perf_counter()
+                    flattened = flattened_prediction(predictor, distance_matrix.tolist(), time_of_day, 'monday')
+                    flat_time = time.perf_counter() - start
+                    assert np.array_equal(flattened, expected), "matrix prediction differs from flattened"
+                
+                print(f"{samples:>8} {kind:>8} {n:>6} {flat_time:>14.3f} {matrix_time:>11.3f} {table_time:>14.3f} "
+                      f"{table_error:>12.4f}")
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--sizes', type=int, nargs='+', default=[200, 500, 2000])
+    parser.add_argument('--samples', type=int, nargs='+', default=[300, 5000])
+    parser.add_argument('--max-flat-size', type=int, default=500)
+    parser.add_argument('--times', nargs='+', choices=['hourly', 'uniform', 'minutes'],
+                        default=['hourly', 'uniform'])
+    args = parser.parse_args()
+    run(args.sizes, args.samples, args.max_flat_size, args.times)
@@ -12,7 +12,8 @@ from models.route_optimizer import optimize_routes
 from models.time_predictor import predict_travel_time, TravelTimePredictor
 from models.clustering import cluster_locations
 from utils.geocoding import geocode_address, batch_geocode
-from utils.distance_matrix import calculate_distance_matrix
+from utils.distance_matrix import (calculate_distance_matrix, SPARSE_ROUTING_THRESHOLD, DEFAULT_NEIGHBOR_COUNT,
+                                   TILED_MATRIX_THRESHOLD)
 from utils.data_processing import process_csv_data
 from models.traffic_optimizer import optimize_routes_with_traffic
 from models.traffic_data import get_overpass_traffic_data
@@ -116,14 +117,26 @@ def distance_matrix_endpoint():
     if not all('lat' in coord and 'lng' in coord for coord in coordinates):
         return jsonify({'error': 'Invalid coordinates format. Each coordinate should have lat and lng keys'}), 400
     
+    # A dense JSON matrix above the tiled threshold would not fit in memory
+    if len(coordinates) > TILED_MATRIX_THRESHOLD:
+        return jsonify({'error': f'Too many coordinates, at most {TILED_MATRIX_THRESHOLD} are supported'}), 413
+    
     matrix = calculate_distance_matrix(coordinates)
     
     return jsonify({
-        'matrix': matrix,
+        'matrix': matrix.tolist(),
         'size': len(matrix),
         'unit': 'kilometers'
     })
 
+def dropped_location_fields(solve_trace):
+    """Response fields listing the locations left out of every route (only possible in sparse mode)."""
+    dropped = solve_trace.get('dropped_locations', [])
+    fields = {'dropped_locations': dropped}
+    if dropped:
+        fields['warning'] = f'{len(dropped)} locations could not be reached and are not in any route'
+    return fields
+
 @app.route('/api/optimize-route', methods=['POST'])
 def optimize_route_endpoint():
     """Optimize delivery routes"""
@@ -146,12 +159,43 @@ def optimize_route_endpoint():
     use_fuel_efficient = data.get('use_fuel_efficient', False)
     optimization_objective = data.get('optimization_objective', 'balanced')
     
+    # Solver time budget; scaled with the number of locations unless given
+    time_budget_ms = data.get('time_budget_ms')
+    if time_budget_ms is not None:
+        try:
+            time_budget_ms = float(time_budget_ms)
+        except (TypeError, ValueError):
+            return jsonify({'error': 'time_budget_ms must be a number'}), 400
+        if time_budget_ms <= 0:
+            return jsonify({'error': 'time_budget_ms must be positive'}), 400
+    solve_trace = {}
+    
+    # Race several solver strategies in parallel processes and keep the best
+    portfolio = data.get('portfolio', False)
+    if not isinstance(portfolio, bool):
+        return jsonify({'error': 'portfolio must be a boolean'}), 400
+    
     # Calculate distance matrix
     coordinates = [{'lat': depot['latitude'], 'lng': depot['longitude']}]
     for loc in locations:
         coordinates.append({'lat': loc['latitude'], 'lng': loc['longitude']})
     
-    distance_matrix = calculate_distance_matrix(coordinates)
+    # Large instances only offer the solver nearest-neighbour arcs
+    neighbor_count = data.get('neighbor_count', DEFAULT_NEIGHBOR_COUNT)
+    if isinstance(neighbor_count, bool):
+        return jsonify({'error': 'neighbor_count must be an integer'}), 400
+    try:
+        neighbor_count = int(neighbor_count)
+    except (TypeError, ValueError):
+        return jsonify({'error': 'neighbor_count must be an integer'}), 400
+    if neighbor_count < 1:
+        return jsonify({'error': 'neighbor_count must be positive'}), 400
+    
+    sparse_k = None
+    if len(coordinates) > SPARSE_ROUTING_THRESHOLD and not use_fuel_efficient:
+        sparse_k = min(neighbor_count, len(coordinates) - 1)
+    
+    distance_matrix = calculate_distance_matrix(coordinates, sparse_k=sparse_k)
     
     # Optional: Cluster locations if there are multiple vehicles
     clusters = None
@@ -189,7 +233,10 @@ def optimize_route_endpoint():
                 vehicle_count=vehicle_count,
                 max_distance=max_distance,
                 clusters=clusters,
-                optimization_objective=optimization_objective
+                optimization_objective=optimization_objective,
+                time_budget_ms=time_budget_ms,
+                solve_trace=solve_trace,
+                portfolio=portfolio
             )
             
             return jsonify({
@@ -197,6 +244,8 @@ def optimize_route_endpoint():
                 'optimization_type': 'fuel_efficient',
                 'vehicle_count': vehicle_count,
                 'total_locations': len(locations),
+                'solve_trace': solve_trace,
+                **dropped_location_fields(solve_trace),
                 'timestamp': datetime.now().isoformat()
             })
         except Exception as e:
@@ -212,7 +261,10 @@ def optimize_route_endpoint():
                 distance_matrix=distance_matrix,
                 vehicle_count=vehicle_count,
                 max_distance=max_distance,
-                clusters=clusters
+                clusters=clusters,
+                time_budget_ms=time_budget_ms,
+                solve_trace=solve_trace,
+                portfolio=portfolio
             )
             
             return jsonify({
@@ -221,6 +273,8 @@ def optimize_route_endpoint():
                 'optimization_type': 'traffic_aware',
                 'vehicle_count': vehicle_count,
                 'total_locations': len(locations),
+                'solve_trace': solve_trace,
+                **dropped_location_fields(solve_trace),
                 'timestamp': datetime.now().isoformat()
             })
         except Exception as e:
@@ -236,7 +290,10 @@ def optimize_route_endpoint():
                 distance_matrix=distance_matrix,
                 vehicle_count=vehicle_count,
                 max_distance=max_distance,
-                clusters=clusters
+                clusters=clusters,
+                time_budget_ms=time_budget_ms,
+                solve_trace=solve_trace,
+                portfolio=portfolio
             )
             
             return jsonify({
@@ -244,6 +301,8 @@ def optimize_route_endpoint():
                 'optimization_type': 'distance',
                 'vehicle_count': vehicle_count,
                 'total_locations': len(locations),
+                'solve_trace': solve_trace,
+                **dropped_location_fields(solve_trace),
                 'timestamp': datetime.now().isoformat()
             })
         except Exception as e:
@@ -0,0 +1,236 @@
+import numpy as np
+import logging
+
+# Set up logging
+logging.basicConfig(level=logging.INFO,
+                    format='%(asctime)s - %(name)s - %(levelname)s - %(message)s')
+logger = logging.getLogger(__name__)
+
+# (rows x trees) traversed at once; small enough for the working arrays to stay in cache
+TRAVERSAL_BLOCK_SIZE = 1 << 15
+
+# Maximum absolute difference from sklearn accepted by the parity check
+PARITY_TOLERANCE = 1e-9
+
+# Deepest trees that are compiled; padding to a complete tree costs 2^depth nodes per tree
+MAX_COMPILED_DEPTH = 12
+
+
+class CompiledGradientBoosting:
+    """
+    A fitted GradientBoostingRegressor flattened into plain NumPy arrays.
+    
+    Every tree is padded to a complete binary tree of the ensemble's
+    maximum depth and stored in heap order (children of node k are 2k + 1
+    and 2k + 2), so all trees live in a few (trees, nodes) arrays: the
+    feature and threshold of each split, and the value of each leaf. A
+    leaf above the bottom level becomes a split that always goes left.
+    A whole batch of rows then walks every tree at once in max_depth
+    vectorized steps, without pandas or sklearn's per-call validation.
+    """
+    def __init__(self, feature, threshold, value, max_depth, init, learning_rate, feature_names=None):
+        """
+        Initialize from heap-ordered tree arrays (see from_sklearn).
+        
+        Args:
+            feature (ndarray): (trees, 2^depth - 1) feature index of each split
+            threshold (ndarray): (trees, 2^depth - 1) threshold of each split
+            value (ndarray): (trees, 2^depth) output of each leaf
+            max_depth (int): Depth of the padded trees
+            init (float): Constant initial prediction
+            learning_rate (float): Shrinkage applied to each tree's output
+            feature_names (list, optional): Column order of the input matrix
+        """
+        self.feature = feature
+        self.threshold = threshold
+        self.value = value
+        self.max_depth = max_depth
+        self.init = init
+        self.learning_rate = learning_rate
+        self.feature_names = feature_names
+    
+    @classmethod
+    def from_sklearn(cls, model, max_depth=MAX_COMPILED_DEPTH):
+        """
+        Flatten a fitted GradientBoostingRegressor.
+        
+        Args:
+            model (GradientBoostingRegressor): Fitted model with a constant
+                (or 'zero') initial estimator
+            max_depth (int): Deepest tree that may be padded (memory grows as 2^depth)
+        
+        Returns:
+            CompiledGradientBoosting: The flattened model
+        """
+        if isinstance(model.init_, str) and model.init_ == 'zero':
+            init = 0.0
+        elif hasattr(model.init_, 'constant_'):
+            init = float(np.ravel(model.init_.constant_)[0])
+        else:
+            raise ValueError(f"Unsupported initial estimator: {model.init_!r}")
+        
+        trees = [estimator.tree_ for estimator in model.estimators_[:, 0]]
+        depth = max(tree.max_depth for tree in trees)
+        if depth > max_depth:
+            raise ValueError(f"Trees of depth {depth} are too deep to compile (limit {max_depth})")
+        
+        split_count = 2 ** depth - 1
+        feature = np.zeros((len(trees), split_count), dtype=np.int64)
+        threshold = np.full((len(trees), split_count), np.inf)
+        value = np.zeros((len(trees), 2 ** depth), dtype=np.float64)
+        
+        for t, tree in enumerate(trees):
+            # (original node, heap position) pairs, one level at a time
+            level = [(0, 0)]
+            for _ in range(depth):
+                next_level = []
+                for node, position in level:
+                    left, right = tree.children_left[node], tree.children_right[node]
+                    if left < 0:
+                        # Leaf above the bottom level: always go left (threshold stays +inf)
+                        next_level.append((node, 2 * position + 1))
+                        next_level.append((node, 2 * position + 2))
+                    else:
+                        feature[t, position] = tree.feature[node]
+                        threshold[t, position] = tree.threshold[node]
+                        next_level.append((left, 2 * position + 1))
+                        next_level.append((right, 2 * position + 2))
+                level = next_level
+            
+            for node, position in level:
+                value[t, position - split_count] = tree.value[node, 0, 0]
+        
+        feature_names = list(model.feature_names_in_) if hasattr(model, 'feature_names_in_') else None
+        
+        return cls(feature, threshold, value, depth, init, float(model.learning_rate), feature_names)
+    
+    @property
+    def n_trees(self):
+        return len(self.value)
+    
+    @property
+    def n_features(self):
+        return len(self.feature_names) if self.feature_names is not None else int(self.feature.max()) + 1
+    
+    def predict(self, X):
+        """
+        Predict for a batch of rows.
+        
+        Args:
+            X (ndarray): (n, n_features) matrix, columns in feature_names order
+        
+        Returns:
+            ndarray: (n,) predictions
+        """
+        # sklearn's trees compare float32 inputs against float64 thresholds
+        X = np.asarray(X, dtype=np.float32).astype(np.float64)
+        if X.ndim == 1:
+            X = X.reshape(1, -1)
+        
+        n, n_features = X.shape
+        split_count = self.feature.shape[1]
+        flat_feature = self.feature.ravel()
+        flat_threshold = self.threshold.ravel()
+        flat_value = self.value.ravel()
+        tree_splits = np.arange(self.n_trees, dtype=np.int64) * split_count
+        tree_leaves = np.arange(self.n_trees, dtype=np.int64) * (split_count + 1)
+        
+        predictions = np.empty(n, dtype=np.float64)
+        block_rows = max(1, TRAVERSAL_BLOCK_SIZE // self.n_trees)
+        
+        for start in range(0, n, block_rows):
+            block = X[start:start + block_rows]
+            flat_block = block.ravel()
+            row_offsets = (np.arange(len(block), dtype=np.int64) * n_features)[:, None]
+            
+            # Heap position of every (row, tree) pair
+            positions = np.zeros((len(block), self.n_trees), dtype=np.int64)
+            for _ in range(self.max_depth):
+                nodes = positions + tree_splits
+                go_right = flat_block[row_offsets + flat_feature[nodes]] > flat_threshold[nodes]
+                positions = 2 * positions + 1 + go_right
+            
+            leaves = flat_value[positions - split_count + tree_leaves]
+            predictions[start:start + len(block)] = self.init + self.learning_rate * leaves.sum(axis=1)
+        
+        return predictions
+    
+    def verify(self, model, X=None, sample_size=512, seed=0):
+        """
+        Check the compiled predictions against sklearn's.
+        
+        Args:
+            model (GradientBoostingRegressor): The model this was compiled from
+            X (ndarray, optional): Rows to compare on; defaults to random rows
+                spanning the split thresholds of every feature
+            sample_size (int): Number of random rows when X is not given
+            seed (int): Seed for the random rows
+        
+        Returns:
+            float: Maximum absolute difference between the two predictions
+        """
+        if X is None:
+            X = self._sample_inputs(sample_size, seed)
+        X = np.asarray(X, dtype=np.float64)
+        
+        if self.feature_names is not None:
+            import pandas as pd
+            expected = model.predict(pd.DataFrame(X, columns=self.feature_names))
+        else:
+            expected = model.predict(X)
+        
+        return float(np.max(np.abs(self.predict(X) - expected))) if len(X) else 0.0
+    
+    def _sample_inputs(self, sample_size, seed):
+        """Random rows covering both sides of the thresholds of every feature."""
+        rng = np.random.default_rng(seed)
+        X = np.zeros((sample_size, self.n_features), dtype=np.float64)
+        is_split = np.isfinite(self.threshold)
+        
+        for k in range(self.n_features):
+            thresholds = self.threshold[is_split & (self.feature == k)]
+            if not len(thresholds):
+                continue
+            low, high = thresholds.min(), thresholds.max()
+            margin = max(1.0, (high - low) * 0.1)
+            X[:, k] = rng.uniform(low - margin, high + margin, sample_size)
+            # Hit some thresholds exactly, where the comparison direction matters
+            exact = rng.random(sample_size) < 0.1
+            X[exact, k] = rng.choice(thresholds, exact.sum())
+        
+        return X
+
+
+def compile_gradient_boosting(model, X=None, tolerance=PARITY_TOLERANCE):
+    """
+    Compile a fitted model for fast batch inference, if it is supported and
+    its predictions match sklearn's.
+    
+    Args:
+        model: Fitted estimator
+        X (ndarray, optional): Rows for the parity check
+        tolerance (float): Maximum accepted absolute difference
+    
+    Returns:
+        CompiledGradientBoosting or None: None if the model can't be compiled
+            or fails the parity check (callers then use sklearn directly)
+    """
+    from sklearn.ensemble import GradientBoostingRegressor
+    
+    if not isinstance(model, GradientBoostingRegressor):
+        return None
+    
+    try:
+        compiled = CompiledGradientBoosting.from_sklearn(model)
+        difference = compiled.verify(model, X)
+    except Exception as e:
+        logger.warning(f"Could not compile gradient boosting model: {e}")
+        return None
+    
+    if difference > tolerance:
+        logger.warning(f"Compiled model differs from sklearn by {difference}, using sklearn for inference")
+        return None
+    
+    logger.info(f"Compiled gradient boosting model ({compiled.n_trees} trees of depth {compiled.max_depth}), "
+                f"parity check max difference {difference:.2e}")
+    return compiled
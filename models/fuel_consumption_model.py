@@ -1,3 +1,5 @@
+import copy
+import time
 import numpy as np
 from sklearn.ensemble import RandomForestRegressor, GradientBoostingRegressor
 import joblib
@@ -6,11 +8,45 @@ import pandas as pd
 import math
 import logging
 
+from models.compiled_gbr import compile_gradient_boosting
+from models.model_registry import atomic_dump, model_registry
+
 # Set up logging
 logging.basicConfig(level=logging.INFO, 
                     format='%(asctime)s - %(name)s - %(levelname)s - %(message)s')
 logger = logging.getLogger(__name__)
 
+# Categorical features, one-hot encoded with the first category dropped
+CATEGORICAL_FEATURES = ['vehicle_type', 'road_type']
+
+# Baseline fuel efficiency in L/100km based on vehicle type (empty vehicle)
+BASELINE_CONSUMPTION = {
+    'car': 7.0,
+    'van': 10.0,
+    'truck': 20.0,
+    'motorbike': 4.0
+}
+
+# Baseline adjustment for road type
+ROAD_TYPE_ADJUSTMENT = {
+    'highway': 0.8,  # Highways are more efficient
+    'urban': 1.3,    # Urban driving is less efficient
+    'mixed': 1.0     # Mixed is baseline
+}
+
+# Maximum rows encoded and passed to model.predict at once by predict_batch
+PREDICT_BATCH_ROWS = 200000
+
+# Largest batch predicted with the compiled trees; sklearn's Cython traversal is
+# as fast from about 5,000 rows up (see benchmarks/fuel_inference_benchmark.py)
+COMPILED_PREDICT_MAX_ROWS = 5000
+
+# Rows generated at a time when synthetic training data is streamed
+SYNTHETIC_CHUNK_ROWS = 1000000
+
+# Trees added to the ensemble by one incremental (warm start) update
+INCREMENTAL_ESTIMATORS = 20
+
 class FuelConsumptionPredictor:
     """
     A machine learning model to predict fuel consumption for delivery routes.
@@ -23,16 +59,19 @@ class FuelConsumptionPredictor:
             model_path (str, optional): Path to saved model file
         """
         self.model = None
+        self.compiled_model = None  # Flat NumPy form of self.model for fast batch inference
         self.model_path = model_path or 'models/fuel_consumption_model.pkl'
+        self.last_training_time = None  # Seconds taken by the last train() or update()
         
-        # Try to load existing model
+        # Try to load existing model (deserialized once per process, see models.model_registry)
         try:
-            if os.path.exists(self.model_path):
-                logger.info(f"Loading existing fuel consumption model from {self.model_path}")
-                self.model = joblib.load(self.model_path)
+            loaded = model_registry.get(self.model_path, load_fuel_model)
+            if loaded is not None:
+                self.model, self.compiled_model = loaded
         except Exception as e:
             logger.warning(f"Error loading model: {e}")
             self.model = None
+            self.compiled_model = None
     
     def train(self, training_data):
         """
@@ -59,6 +98,7 @@ class FuelConsumptionPredictor:
         if training_data is None or len(training_data) < 10:
             logger.warning("Insufficient training data, falling back to baseline model")
             self.model = None
+            self.compiled_model = None
             return self
             
         try:
@@ -67,10 +107,11 @@ class FuelConsumptionPredictor:
             y = training_data['fuel_consumption']
             
             # Convert categorical features to dummy variables
-            X = pd.get_dummies(X, columns=['vehicle_type', 'road_type'], drop_first=True)
+            X = pd.get_dummies(X, columns=CATEGORICAL_FEATURES, drop_first=True)
             
             # Train model - Gradient Boosting typically works well for this type of prediction
             logger.info("Training fuel consumption model with Gradient Boosting")
+            start = time.perf_counter()
             self.model = GradientBoostingRegressor(
                 n_estimators=100, 
                 learning_rate=0.1, 
@@ -78,19 +119,83 @@ class FuelConsumptionPredictor:
                 random_state=42
             )
             self.model.fit(X, y)
+            self.compiled_model = compile_gradient_boosting(self.model, X.to_numpy(dtype=np.float64))
+            self.last_training_time = time.perf_counter() - start
             
             # Save the model
-            os.makedirs(os.path.dirname(self.model_path), exist_ok=True)
-            joblib.dump(self.model, self.model_path)
-            logger.info(f"Fuel consumption model saved to {self.model_path}")
+            self._save()
             
             return self
         
         except Exception as e:
             logger.error(f"Error training fuel consumption model: {e}")
             self.model = None
+            self.compiled_model = None
             return self
     
+    def update(self, training_data, n_estimators=INCREMENTAL_ESTIMATORS):
+        """
+        Update the model with new records by adding trees to the existing
+        ensemble (warm start), instead of refitting on the full history.
+        
+        The added trees are fitted to the current ensemble's residuals on
+        the new records. The update works on a copy, so the model in use
+        keeps serving predictions until the new one is saved.
+        
+        Args:
+            training_data (DataFrame): New records, with the columns train() expects
+            n_estimators (int): Number of trees to add
+        
+        Returns:
+            self: The updated model instance
+        """
+        if not isinstance(self.model, GradientBoostingRegressor):
+            return self.train(training_data)
+        
+        start = time.perf_counter()
+        feature_names = list(self.model.feature_names_in_)
+        columns = {name: training_data[name].to_numpy() for name in training_data.columns
+                   if name != 'fuel_consumption'}
+        X = pd.DataFrame(self._encode_features(columns, feature_names, 0, len(training_data)),
+                         columns=feature_names)
+        y = training_data['fuel_consumption'].to_numpy()
+        
+        model = copy.deepcopy(self.model)
+        model.set_params(warm_start=True, n_estimators=model.n_estimators_ + n_estimators)
+        model.fit(X, y)
+        model.set_params(warm_start=False)
+        
+        self.model = model
+        self.compiled_model = compile_gradient_boosting(model, X.to_numpy(dtype=np.float64))
+        self.last_training_time = time.perf_counter() - start
+        
+        self._save()
+        logger.info(f"Added {n_estimators} trees for {len(training_data)} new records "
+                    f"({model.n_estimators_} trees in total)")
+        
+        return self
+    
+    def prediction_error(self, training_data):
+        """
+        Mean absolute percentage error of the model on labelled records.
+        
+        Args:
+            training_data (DataFrame): Records with features and 'fuel_consumption'
+        
+        Returns:
+            float: Mean absolute error in percent of the actual consumption
+        """
+        actual = training_data['fuel_consumption'].to_numpy(dtype=np.float64)
+        predicted = self.predict_batch(training_data.drop('fuel_consumption', axis=1))
+        error_percent = np.where(actual > 0, np.abs(predicted - actual) / np.where(actual > 0, actual, 1) * 100, 0)
+        return float(error_percent.mean()) if len(error_percent) else 0.0
+    
+    def _save(self):
+        """Save the model atomically and register it for this process."""
+        atomic_dump(self.model_path, lambda f: joblib.dump(self.model, f))
+        model_registry.store(self.model_path, load_fuel_model, (self.model, self.compiled_model))
+        logger.info(f"Fuel consumption model saved to {self.model_path}")
+    
     def predict(self, route_data):
         """
         Predict fuel consumption for a route.
@@ -101,34 +206,126 @@ class FuelConsumptionPredictor:
         Returns:
             float: Predicted fuel consumption in liters
         """
-        # Convert dict to DataFrame if needed
-        if isinstance(route_data, dict):
-            route_data = pd.DataFrame([route_data])
-        
         # If no model is available, use baseline calculation
         if self.model is None:
+            if isinstance(route_data, dict):
+                route_data = pd.DataFrame([route_data])
             return self._baseline_prediction(route_data)
         
         try:
-            # Preprocess the data
-            X = pd.get_dummies(route_data, columns=['vehicle_type', 'road_type'], drop_first=True)
-            
-            # Add missing columns that might be in the training data but not in the input
-            for col in self.model.feature_names_in_:
-                if col not in X.columns:
-                    X[col] = 0
-            
-            # Select only the columns the model was trained on
-            X = X[self.model.feature_names_in_]
+            # A single route becomes one-element columns
+            if isinstance(route_data, dict):
+                route_data = {name: [value] for name, value in route_data.items()}
             
             # Make prediction
-            prediction = self.model.predict(X)
+            prediction = self.predict_batch(route_data)
             return prediction[0] if len(prediction) == 1 else prediction
         
         except Exception as e:
             logger.error(f"Error predicting fuel consumption: {e}")
             return self._baseline_prediction(route_data)
     
+    def predict_batch(self, route_data):
+        """
+        Predict fuel consumption for many route segments with one model call.
+        
+        Categorical features are encoded directly against the columns the
+        model was trained on, so each row gets the right dummy columns no
+        matter which categories appear in the batch. Batches of up to
+        COMPILED_PREDICT_MAX_ROWS rows go through the compiled trees, which
+        skip sklearn's per-call overhead; larger ones use sklearn.
+        
+        Args:
+            route_data (dict or DataFrame): Equal-length columns with the same
+                features used for training
+                
+        Returns:
+            ndarray: Predicted fuel consumption in liters, one value per row
+        """
+        columns = {name: np.asarray(route_data[name]) for name in route_data}
+        
+        if self.model is None:
+            return self._baseline_prediction_batch(columns)
+        
+        try:
+            feature_names = list(self.model.feature_names_in_)
+            n = len(columns['distance'])
+            predictions = np.empty(n, dtype=np.float64)
+            
+            for start in range(0, n, PREDICT_BATCH_ROWS):
+                stop = min(start + PREDICT_BATCH_ROWS, n)
+                X = self._encode_features(columns, feature_names, start, stop)
+                if self.compiled_model is not None and stop - start <= COMPILED_PREDICT_MAX_ROWS:
+                    predictions[start:stop] = self.compiled_model.predict(X)
+                else:
+                    predictions[start:stop] = self.model.predict(pd.DataFrame(X, columns=feature_names))
+            
+            return predictions
+        
+        except Exception as e:
+            logger.error(f"Error predicting fuel consumption: {e}")
+            return self._baseline_prediction_batch(columns)
+    
+    def _encode_features(self, columns, feature_names, start, stop):
+        """
+        Build the model's feature matrix for rows [start, stop).
+        
+        Args:
+            columns (dict): Column name -> ndarray
+            feature_names (list): Columns the model was trained on
+            start, stop (int): Row range
+        
+        Returns:
+            ndarray: (stop - start, len(feature_names)) float matrix
+        """
+        X = np.zeros((stop - start, len(feature_names)), dtype=np.float64)
+        
+        for k, name in enumerate(feature_names):
+            if name in columns:
+                X[:, k] = columns[name][start:stop]
+                continue
+            
+            # Dummy column such as 'vehicle_type_van'; features missing from the input stay 0
+            for feature in CATEGORICAL_FEATURES:
+                prefix = f"{feature}_"
+                if name.startswith(prefix) and feature in columns:
+                    X[:, k] = columns[feature][start:stop] == name[len(prefix):]
+                    break
+        
+        return X
+    
+    def _baseline_prediction_batch(self, columns):
+        """
+        Vectorized _baseline_prediction over columns of route data.
+        
+        Args:
+            columns (dict): Column name -> ndarray
+                
+        Returns:
+            ndarray: Estimated fuel consumption in liters
+        """
+        n = len(columns['distance'])
+        
+        def column(name, default):
+            return columns[name] if name in columns else np.full(n, default)
+        
+        distance = column('distance', 0).astype(np.float64)
+        vehicle_type = np.char.lower(column('vehicle_type', 'van').astype(str))
+        load_weight = column('load_weight', 0).astype(np.float64)
+        traffic_factor = column('traffic_factor', 1.0).astype(np.float64)
+        stop_frequency = column('stop_frequency', 0.1).astype(np.float64)
+        road_type = np.char.lower(column('road_type', 'mixed').astype(str))
+        
+        base_consumption = _lookup(vehicle_type, BASELINE_CONSUMPTION, 10.0)
+        weight_factor = 1.0 + (load_weight / 1000) * 0.1
+        traffic_adjustment = 0.5 + (traffic_factor * 0.5)
+        stop_adjustment = 1.0 + (stop_frequency * 0.5)
+        road_adjustment = _lookup(road_type, ROAD_TYPE_ADJUSTMENT, 1.0)
+        
+        fuel_consumption = (base_consumption / 100) * distance * weight_factor * traffic_adjustment * stop_adjustment * road_adjustment
+        
+        return np.maximum(0.1, fuel_consumption)
+    
     def _baseline_prediction(self, route_data):
         """
         Basic physics-based model for fuel consumption when ML model is not available.
@@ -154,12 +351,7 @@ class FuelConsumptionPredictor:
         road_type = data.get('road_type', 'mixed')
         
         # Baseline fuel efficiency in L/100km based on vehicle type (empty vehicle)
-        base_consumption = {
-            'car': 7.0,
-            'van': 10.0,
-            'truck': 20.0,
-            'motorbike': 4.0
-        }.get(vehicle_type.lower(), 10.0)
+        base_consumption = BASELINE_CONSUMPTION.get(vehicle_type.lower(), 10.0)
         
         # Adjust for load weight (each 100kg increases consumption by ~1%)
         weight_factor = 1.0 + (load_weight / 1000) * 0.1
@@ -172,74 +364,144 @@ class FuelConsumptionPredictor:
         stop_adjustment = 1.0 + (stop_frequency * 0.5)
         
         # Adjust for road type
-        road_adjustment = {
-            'highway': 0.8,  # Highways are more efficient
-            'urban': 1.3,    # Urban driving is less efficient
-            'mixed': 1.0     # Mixed is baseline
-        }.get(road_type.lower(), 1.0)
+        road_adjustment = ROAD_TYPE_ADJUSTMENT.get(road_type.lower(), 1.0)
         
         # Calculate fuel consumption in liters
         fuel_consumption = (base_consumption / 100) * distance * weight_factor * traffic_adjustment * stop_adjustment * road_adjustment
         
         return max(0.1, fuel_consumption)  # Ensure positive consumption
     
-    def generate_synthetic_training_data(self, num_samples=1000):
+    def generate_synthetic_training_data(self, num_samples=1000, seed=42):
         """
         Generate synthetic training data for the fuel consumption model.
         
         Args:
             num_samples (int): Number of samples to generate
+            seed (int): Random seed
             
         Returns:
             DataFrame: Synthetic training data
         """
-        np.random.seed(42)
-        
-        # Generate random features
-        data = {
-            'distance': np.random.uniform(5, 200, num_samples),  # 5-200 km
-            'vehicle_type': np.random.choice(['car', 'van', 'truck'], num_samples),
-            'vehicle_weight': np.random.uniform(1000, 10000, num_samples),  # 1-10 tons
-            'load_weight': np.random.uniform(0, 5000, num_samples),  # 0-5 tons
-            'avg_speed': np.random.uniform(20, 100, num_samples),  # 20-100 km/h
-            'traffic_factor': np.random.uniform(1.0, 3.0, num_samples),  # 1-3x traffic
-            'stop_frequency': np.random.uniform(0, 1, num_samples),  # 0-1 stops per km
-            'road_type': np.random.choice(['highway', 'urban', 'mixed'], num_samples),
-            'gradient': np.random.uniform(-5, 5, num_samples),  # -5% to +5%
-            'temperature': np.random.uniform(-10, 40, num_samples)  # -10°C to 40°C
-        }
-        
-        df = pd.DataFrame(data)
-        
-        # Calculate synthetic fuel consumption with some randomness
-        # This is a simplified physics-inspired model
-        base_consumption = {
-            'car': 7.0,
-            'van': 10.0,
-            'truck': 20.0
-        }
-        
-        fuel_consumption = []
-        for _, row in df.iterrows():
-            # Base consumption in L/100km
-            base = base_consumption[row['vehicle_type']]
-            
-            # Adjustments
-            weight_factor = 1.0 + ((row['vehicle_weight'] + row['load_weight']) / 10000) * 0.2
-            speed_factor = 1.0 + abs(row['avg_speed'] - 60) / 60  # Optimal speed around 60 km/h
-            traffic_factor = 0.8 + (row['traffic_factor'] * 0.2)
-            stop_factor = 1.0 + (row['stop_frequency'] * 0.3)
-            road_factor = 1.2 if row['road_type'] == 'urban' else (0.9 if row['road_type'] == 'highway' else 1.0)
-            gradient_factor = 1.0 + (abs(row['gradient']) * 0.05)
-            temp_factor = 1.0 + (abs(row['temperature'] - 20) / 100)  # Optimal temp around 20°C
+        return _synthetic_samples(np.random.RandomState(seed), num_samples)
+    
+    def iter_synthetic_training_data(self, num_samples, chunk_size=SYNTHETIC_CHUNK_ROWS, seed=42):
+        """
+        Generate synthetic training data in chunks, for sample counts that
+        don't fit in memory at once.
+        
+        The chunks are drawn from one random stream, so a seed always gives
+        the same data; with a single chunk it is exactly the data
+        generate_synthetic_training_data returns.
+        
+        Args:
+            num_samples (int): Total number of samples
+            chunk_size (int): Samples per chunk
+            seed (int): Random seed
+        
+        Yields:
+            DataFrame: Chunks of synthetic training data
+        """
+        rng = np.random.RandomState(seed)
+        for start in range(0, num_samples, chunk_size):
+            yield _synthetic_samples(rng, min(chunk_size, num_samples - start))
+    
+    def write_synthetic_training_data(self, path, num_samples, chunk_size=SYNTHETIC_CHUNK_ROWS, seed=42):
+        """
+        Stream synthetic training data to a CSV file chunk by chunk.
             
-            # Calculate consumption in liters
-            consumption = (base / 100) * row['distance'] * weight_factor * speed_factor * traffic_factor * stop_factor * road_factor * gradient_factor * temp_factor
+        Args:
+            path (str): Destination CSV file (overwritten)
+            num_samples (int): Total number of samples
+            chunk_size (int): Samples generated and written at a time
+            seed (int): Random seed
             
-            # Add some random noise (±10%)
-            noise = np.random.uniform(0.9, 1.1)
-            fuel_consumption.append(consumption * noise)
+        Returns:
+            int: Number of samples written
+        """
+        os.makedirs(os.path.dirname(path) or '.', exist_ok=True)
         
-        df['fuel_consumption'] = fuel_consumption
+        written = 0
+        with open(path, 'w', newline='') as f:
+            for chunk in self.iter_synthetic_training_data(num_samples, chunk_size, seed):
+                chunk.to_csv(f, header=written == 0, index=False)
+                written += len(chunk)
         
-        return df
\ No newline at end of file
+        logger.info(f"Wrote {written} synthetic fuel samples to {path}")
+        return written
+
+
+def load_fuel_model(path):
+    """
+    Load a saved fuel consumption model and compile it for batch inference.
+    
+    Args:
+        path (str): Path to the joblib file
+    
+    Returns:
+        tuple: (model, compiled_model or None)
+    """
+    logger.info(f"Loading existing fuel consumption model from {path}")
+    model = joblib.load(path)
+    return model, compile_gradient_boosting(model)
+
+def _synthetic_samples(rng, num_samples):
+    """
+    Draw synthetic samples: random features and a physics-inspired fuel
+    consumption target with +-10% noise.
+    
+    Args:
+        rng (RandomState): Random state to draw from
+        num_samples (int): Number of samples
+    
+    Returns:
+        DataFrame: Features and 'fuel_consumption'
+    """
+    # Generate random features
+    data = {
+        'distance': rng.uniform(5, 200, num_samples),  # 5-200 km
+        'vehicle_type': rng.choice(['car', 'van', 'truck'], num_samples),
+        'vehicle_weight': rng.uniform(1000, 10000, num_samples),  # 1-10 tons
+        'load_weight': rng.uniform(0, 5000, num_samples),  # 0-5 tons
+        'avg_speed': rng.uniform(20, 100, num_samples),  # 20-100 km/h
+        'traffic_factor': rng.uniform(1.0, 3.0, num_samples),  # 1-3x traffic
+        'stop_frequency': rng.uniform(0, 1, num_samples),  # 0-1 stops per km
+        'road_type': rng.choice(['highway', 'urban', 'mixed'], num_samples),
+        'gradient': rng.uniform(-5, 5, num_samples),  # -5% to +5%
+        'temperature': rng.uniform(-10, 40, num_samples)  # -10°C to 40°C
+    }
+    
+    # Calculate synthetic fuel consumption with some randomness
+    # This is a simplified physics-inspired model
+    base_consumption = {
+        'car': 7.0,
+        'van': 10.0,
+        'truck': 20.0
+    }
+    
+    # Base consumption in L/100km
+    base = _lookup(data['vehicle_type'], base_consumption, 0.0)
+    
+    # Adjustments
+    weight_factor = 1.0 + ((data['vehicle_weight'] + data['load_weight']) / 10000) * 0.2
+    speed_factor = 1.0 + np.abs(data['avg_speed'] - 60) / 60  # Optimal speed around 60 km/h
+    traffic_factor = 0.8 + (data['traffic_factor'] * 0.2)
+    stop_factor = 1.0 + (data['stop_frequency'] * 0.3)
+    road_factor = np.where(data['road_type'] == 'urban', 1.2, np.where(data['road_type'] == 'highway', 0.9, 1.0))
+    gradient_factor = 1.0 + (np.abs(data['gradient']) * 0.05)
+    temp_factor = 1.0 + (np.abs(data['temperature'] - 20) / 100)  # Optimal temp around 20°C
+    
+    # Calculate consumption in liters
+    consumption = (base / 100) * data['distance'] * weight_factor * speed_factor * traffic_factor * stop_factor * road_factor * gradient_factor * temp_factor
+    
+    # Add some random noise (+-10%), drawn after the features as one value per sample
+    noise = rng.uniform(0.9, 1.1, num_samples)
+    
+    df = pd.DataFrame(data)
+    df['fuel_consumption'] = consumption * noise
+    
+    return df
+
+def _lookup(values, mapping, default):
+    """Map an array of category strings through a dict, with a default for unknown keys."""
+    unique, inverse = np.unique(values, return_inverse=True)
+    return np.array([mapping.get(value, default) for value in unique], dtype=np.float64)[inverse]
\ No newline at end of file
@@ -3,15 +3,48 @@ import numpy as np
 import json
 import logging
 import os
+import time
 from datetime import datetime, timedelta
 import joblib
 from sqlalchemy import text
 
+from models.fuel_training_store import get_training_store
+from models.model_registry import atomic_dump
+
 # Setup logging
 logging.basicConfig(level=logging.INFO, 
                     format='%(asctime)s - %(name)s - %(levelname)s - %(message)s')
 logger = logging.getLogger(__name__)
 
+# Columns of a collected record used as model features
+TRAINING_FEATURES = [
+    'distance', 'vehicle_type', 'vehicle_weight', 'load_weight',
+    'avg_speed', 'traffic_factor', 'stop_frequency',
+    'road_type', 'gradient', 'temperature'
+]
+
+# Categorical features checked for values the model has never seen
+CATEGORICAL_TRAINING_FEATURES = ['vehicle_type', 'road_type']
+
+# A full refit is done when the model's error on new records exceeds this
+# multiple of its running reference error
+DRIFT_TOLERANCE = 1.5
+
+# Floor of the reference error (in %), so a near perfect fit doesn't flag every update as drift
+MIN_REFERENCE_ERROR = 1.0
+
+# Weight of the newest records in the running reference error
+REFERENCE_ERROR_SMOOTHING = 0.3
+
+# Full refit once incremental updates grew the ensemble beyond this many trees
+MAX_ENSEMBLE_TREES = 500
+
+# Training runs kept in the training state file
+TRAINING_HISTORY_SIZE = 50
+
+# Fewest records a full refit trains on, and fewest new records an update waits for
+MIN_TRAINING_RECORDS = 10
+
 class FuelDataCollector:
     """
     Collects and processes actual fuel consumption data to improve prediction models.
@@ -26,7 +59,9 @@ class FuelDataCollector:
         """
         self.db = db
         self.model_path = model_path or 'models/fuel_consumption_model.pkl'
-        self.training_data_path = 'data/fuel_training_data.csv'
+        self.training_data_path = 'data/fuel_training_data.db'
+        # Records collected before the SQLite store, imported on first use
+        self.legacy_training_data_path = 'data/fuel_training_data.csv'
     
     def _execute_query(self, query_str, params=None):
         """
@@ -129,14 +164,8 @@ class FuelDataCollector:
                 'driver_efficiency_rating': route_metadata.get('driver_efficiency', 1.0) if route_metadata else 1.0
             }
             
-            # Get existing fuel data records or create new DataFrame
-            df = self._load_training_data()
-            
-            # Add new record
-            df = pd.concat([df, pd.DataFrame([new_record])], ignore_index=True)
-            
-            # Save to CSV
-            self._save_training_data(df)
+            # Append the record to the training data store
+            self._append_training_record(new_record)
             
             # Update route with actual fuel consumption
             route.actual_fuel = actual_fuel
@@ -156,35 +185,104 @@ class FuelDataCollector:
             logger.error(f"Error recording actual fuel consumption: {e}")
             return False
     
-    def retrain_model(self, force=False):
+    def retrain_model(self, force=False, full_refit=False):
         """
         Retrain the fuel consumption prediction model with collected data.
         
+        Once a model exists, only the records collected since the last run
+        are used, to add trees to the existing ensemble (warm start). New
+        records accumulate until there are MIN_TRAINING_RECORDS of them, so
+        a few trips cannot pull the whole ensemble towards them. A full
+        refit on all records happens when the new records contain categories
+        the model has never seen, when the model's error on them drifted
+        past DRIFT_TOLERANCE times its running reference error, or when the
+        ensemble grew beyond MAX_ENSEMBLE_TREES. Every run is recorded with
+        its training time in the training state file next to the model.
+        
         Args:
-            force (bool): Force retraining even if minimal data
+            force (bool): Force retraining even with fewer than MIN_TRAINING_RECORDS (new) records
+            full_refit (bool): Refit on all records even if an update would do
             
         Returns:
             bool: Success status
         """
         try:
             # Import here to avoid circular imports
-            from models.fuel_consumption_model import FuelConsumptionPredictor
-            
-            # Load training data
-            df = self._load_training_data()
+            from models.fuel_consumption_model import FuelConsumptionPredictor, INCREMENTAL_ESTIMATORS
             
-            # Check if we have enough data
-            if len(df) < 10 and not force:
-                logger.info("Not enough training data (minimum 10 records). Skipping retraining.")
-                return False
+            started = time.perf_counter()
             
             # Initialize model
             predictor = FuelConsumptionPredictor(self.model_path)
-            
-            # Train the model
-            predictor.train(df)
-            
-            logger.info(f"Successfully retrained fuel consumption model with {len(df)} records")
+            state = load_training_state(self.model_path)
+            
+            reason = 'requested' if full_refit else None
+            if reason is None and (predictor.model is None or 'last_record_id' not in state):
+                reason = 'no trained model'
+            
+            error_before = None
+            if reason is None:
+                df = self._load_training_data(['id'] + TRAINING_FEATURES + ['actual_fuel'],
+                                              after_id=state['last_record_id'])
+                if len(df) == 0:
+                    logger.info("No new training records since the last run. Skipping retraining.")
+                    return False
+                if len(df) < MIN_TRAINING_RECORDS and not force:
+                    logger.info(f"Only {len(df)} new training records since the last run, waiting for "
+                                f"{MIN_TRAINING_RECORDS}. Skipping retraining.")
+                    return False
+                
+                training_data = _training_frame(df)
+                error_before = predictor.prediction_error(training_data)
+                reason = _full_refit_reason(predictor, state, training_data, error_before,
+                                            INCREMENTAL_ESTIMATORS)
+            
+            if reason is None:
+                # Warm start: add trees fitted to the new records only
+                predictor.update(training_data)
+                reference = state.get('reference_error')
+                state['reference_error'] = error_before if reference is None else (
+                    (1 - REFERENCE_ERROR_SMOOTHING) * reference + REFERENCE_ERROR_SMOOTHING * error_before)
+                mode = 'incremental'
+            else:
+                # Load training data
+                df = self._load_training_data(['id'] + TRAINING_FEATURES + ['actual_fuel'])
+            
+                # Check if we have enough data
+                if len(df) < MIN_TRAINING_RECORDS and not force:
+                    logger.info(f"Not enough training data (minimum {MIN_TRAINING_RECORDS} records). "
+                                f"Skipping retraining.")
+                    return False
+            
+                # Train the model on the recorded features, with the actual fuel as target
+                training_data = _training_frame(df)
+                predictor.train(training_data)
+            
+                if predictor.model is None:
+                    return False
+            
+                # The reference error is re-established on the next new records
+                state['reference_error'] = None
+                state['categories'] = {feature: sorted(training_data[feature].astype(str).unique())
+                                       for feature in CATEGORICAL_TRAINING_FEATURES}
+                mode = 'full'
+            
+            state['last_record_id'] = int(df['id'].max())
+            state['runs'] = (state.get('runs', []) + [{
+                'mode': mode,
+                'reason': reason,
+                'records': int(len(df)),
+                'trees': int(predictor.model.n_estimators_),
+                'error_before': error_before,
+                'training_seconds': predictor.last_training_time,
+                'total_seconds': time.perf_counter() - started,
+                'finished_at': datetime.now().strftime('%Y-%m-%d %H:%M:%S')
+            }])[-TRAINING_HISTORY_SIZE:]
+            save_training_state(self.model_path, state)
+            
+            logger.info(f"Successfully retrained fuel consumption model ({mode}"
+                        f"{', ' + reason if reason else ''}) with {len(df)} records "
+                        f"in {predictor.last_training_time:.2f}s")
             return True
             
         except Exception as e:
@@ -200,10 +298,11 @@ class FuelDataCollector:
             dict: Accuracy metrics or empty data if no records are found
         """
         try:
-            # Load training data
-            df = self._load_training_data()
+            # Aggregates maintained by the store as records are written
+            aggregates = self._training_store().accuracy_aggregates()
+            overall = aggregates['all'].get('')
             
-            if len(df) < 1:
+            if not overall or overall['count'] < 1:
                 return {
                     'record_count': 0,
                     'mean_absolute_error': None,
@@ -220,61 +319,36 @@ class FuelDataCollector:
                     'no_data': True  # Flag to indicate no data
                 }
             
-            # Check if prediction_error column exists
-            if 'prediction_error' not in df.columns:
-                # Create it if it doesn't
-                df['prediction_error'] = df['actual_fuel'] - df['predicted_fuel']
-            
-            # Check if error_percent column exists
-            if 'error_percent' not in df.columns:
-                # Create it and handle divide by zero
-                df['error_percent'] = np.where(
-                    df['actual_fuel'] > 0,
-                    (df['prediction_error'] / df['actual_fuel']) * 100,
-                    0
-                )
+            count = overall['count']
+            mean_error_percent = overall['sum_abs_error_percent'] / count
             
             metrics = {
-                'record_count': len(df),
-                'mean_absolute_error': float(df['prediction_error'].abs().mean()),
-                'mean_error_percent': float(df['error_percent'].abs().mean()),
-                'accuracy': float(100 - df['error_percent'].abs().mean()),
-                'overestimation_rate': float((df['prediction_error'] > 0).mean() * 100),
-                'underestimation_rate': float((df['prediction_error'] < 0).mean() * 100),
+                'record_count': int(count),
+                'mean_absolute_error': float(overall['sum_abs_error'] / count),
+                'mean_error_percent': float(mean_error_percent),
+                'accuracy': float(100 - mean_error_percent),
+                'overestimation_rate': float(overall['over_count'] / count * 100),
+                'underestimation_rate': float(overall['under_count'] / count * 100),
                 'by_vehicle_type': {},
                 'by_road_type': {},
                 'recent_trend': {},
                 'no_data': False
             }
             
-            # Calculate metrics by vehicle type
-            for vehicle_type in df['vehicle_type'].unique():
-                type_df = df[df['vehicle_type'] == vehicle_type]
-                metrics['by_vehicle_type'][vehicle_type] = {
-                    'count': int(len(type_df)),
-                    'accuracy': float(100 - type_df['error_percent'].abs().mean())
-                }
-            
-            # Calculate metrics by road type
-            for road_type in df['road_type'].unique():
-                type_df = df[df['road_type'] == road_type]
-                metrics['by_road_type'][road_type] = {
-                    'count': int(len(type_df)),
-                    'accuracy': float(100 - type_df['error_percent'].abs().mean())
-                }
+            # Calculate metrics by vehicle type and road type
+            for dimension, key in [('vehicle_type', 'by_vehicle_type'), ('road_type', 'by_road_type')]:
+                for group_value, group in aggregates[dimension].items():
+                    metrics[key][group_value] = {
+                        'count': int(group['count']),
+                        'accuracy': float(100 - group['sum_abs_error_percent'] / group['count'])
+                    }
             
-            # Calculate recent trend (last 10 records)
-            if 'date_recorded' in df.columns:
-                recent_df = df.sort_values('date_recorded', ascending=False).head(10)
-                metrics['recent_trend'] = {
-                    'count': int(len(recent_df)),
-                    'accuracy': float(100 - recent_df['error_percent'].abs().mean() if len(recent_df) > 0 else None)
-                }
-            else:
-                metrics['recent_trend'] = {
-                    'count': 0,
-                    'accuracy': None
-                }
+            # Calculate recent trend (last records, from the store's ring buffer)
+            recent = aggregates['recent']
+            metrics['recent_trend'] = {
+                'count': len(recent),
+                'accuracy': float(100 - sum(recent) / len(recent)) if recent else None
+            }
             
             return metrics
             
@@ -321,7 +395,7 @@ class FuelDataCollector:
                 return []
             
             # Check if we have any actual data in the training dataset
-            df = self._load_training_data()
+            df = self._load_training_data(['driver_id', 'predicted_fuel', 'actual_fuel'])
             
             if len(df) < 1:
                 # No training data, so we can't calculate real efficiency
@@ -369,37 +443,30 @@ class FuelDataCollector:
             # Return empty list instead of sample data
             return []
     
-    def _load_training_data(self):
-        """Load training data from CSV or create empty DataFrame."""
+    def _training_store(self):
+        """Get the (process-wide) store holding the collected training records."""
+        return get_training_store(self.training_data_path, self.legacy_training_data_path)
+    
+    def _load_training_data(self, columns=None, after_id=None):
+        """
+        Load training records from the store.
+        
+        Args:
+            columns (list, optional): Columns to read; defaults to all of them
+            after_id (int, optional): Only load records stored after this id
+        
+        Returns:
+            DataFrame: Training records (empty if none were collected)
+        """
         try:
-            if os.path.exists(self.training_data_path):
-                return pd.read_csv(self.training_data_path)
-            else:
-                # Create empty DataFrame with required columns
-                columns = [
-                    'route_id', 'vehicle_id', 'driver_id', 
-                    'predicted_fuel', 'actual_fuel', 'prediction_error',
-                    'distance', 'vehicle_type', 'vehicle_weight', 'load_weight',
-                    'avg_speed', 'traffic_factor', 'stop_frequency',
-                    'road_type', 'gradient', 'temperature',
-                    'date_recorded', 'driver_efficiency_rating'
-                ]
-                return pd.DataFrame(columns=columns)
+            return self._training_store().load(columns, after_id)
         except Exception as e:
             logger.error(f"Error loading training data: {e}")
-            return pd.DataFrame()
+            return pd.DataFrame(columns=columns)
     
-    def _save_training_data(self, df):
-        """Save training data to CSV."""
-        try:
-            # Create directory if it doesn't exist
-            os.makedirs(os.path.dirname(self.training_data_path), exist_ok=True)
-            
-            # Save to CSV
-            df.to_csv(self.training_data_path, index=False)
-            
-        except Exception as e:
-            logger.error(f"Error saving training data: {e}")
+    def _append_training_record(self, record):
+        """Append one record to the training data store."""
+        self._training_store().append(record)
     
     def _update_driver_efficiency(self, driver, record):
         """Update driver's fuel efficiency rating."""
@@ -426,4 +493,61 @@ class FuelDataCollector:
             driver.fuel_saved = driver.fuel_saved + fuel_saved if driver.fuel_saved else fuel_saved
             
         except Exception as e:
-            logger.error(f"Error updating driver efficiency: {e}")
\ No newline at end of file
+            logger.error(f"Error updating driver efficiency: {e}")
+
+
+def _training_frame(df):
+    """Model training data from collected records: the features, with the actual fuel as target."""
+    training_data = df[TRAINING_FEATURES].copy()
+    training_data['fuel_consumption'] = df['actual_fuel']
+    return training_data
+
+def _full_refit_reason(predictor, state, training_data, error, incremental_estimators):
+    """
+    Decide whether new records need a full refit instead of a warm start update.
+    
+    Args:
+        predictor (FuelConsumptionPredictor): Current model
+        state (dict): Training state of the current model
+        training_data (DataFrame): The new records
+        error (float): Current model's error on the new records (%)
+        incremental_estimators (int): Trees an update would add
+    
+    Returns:
+        str or None: Why a full refit is needed, or None if an update will do
+    """
+    for feature in CATEGORICAL_TRAINING_FEATURES:
+        unseen = set(training_data[feature].astype(str)) - set(state.get('categories', {}).get(feature, []))
+        if unseen:
+            return f"unseen {feature} values {sorted(unseen)}"
+    
+    if predictor.model.n_estimators_ + incremental_estimators > MAX_ENSEMBLE_TREES:
+        return f"ensemble reached {predictor.model.n_estimators_} trees"
+    
+    reference = state.get('reference_error')
+    if reference is not None and error > DRIFT_TOLERANCE * max(reference, MIN_REFERENCE_ERROR):
+        return f"drift: error {error:.1f}% vs reference {reference:.1f}%"
+    
+    return None
+
+def training_state_path(model_path):
+    """Path of the training state file kept next to a model."""
+    return f"{os.path.splitext(model_path)[0]}_training_state.json"
+
+def load_training_state(model_path):
+    """
+    Load the training state of a model: the last record it was trained on,
+    its reference error, the categories seen and the recent training runs.
+    
+    Returns:
+        dict: The state, empty if the model has none
+    """
+    try:
+        with open(training_state_path(model_path)) as f:
+            return json.load(f)
+    except (OSError, ValueError):
+        return {}
+
+def save_training_state(model_path, state):
+    """Write the training state of a model atomically."""
+    atomic_dump(training_state_path(model_path), lambda f: f.write(json.dumps(state, indent=2).encode()))
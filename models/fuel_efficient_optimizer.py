@@ -1,22 +1,26 @@
-from ortools.constraint_solver import routing_enums_pb2
-from ortools.constraint_solver import pywrapcp
 import numpy as np
 import math
 import logging
 import json
 from datetime import datetime
+from functools import partial
 
 # Import our fuel consumption model
 from models.fuel_consumption_model import FuelConsumptionPredictor
+from models.routing_model import build_routing_model
+from utils.distance_matrix import TILED_MATRIX_THRESHOLD, coordinate_arrays, haversine_matrix
 
 # Set up logging
 logging.basicConfig(level=logging.INFO, 
                     format='%(asctime)s - %(name)s - %(levelname)s - %(message)s')
 logger = logging.getLogger(__name__)
 
+# Average speed without traffic (km/h)
+BASE_SPEED_KMH = 30.0
+
 def optimize_routes_fuel_efficient(depot, locations, distance_matrix, vehicle_data, traffic_data=None, 
                                   vehicle_count=1, max_distance=None, clusters=None, 
-                                  optimization_objective='balanced'):
+                                  optimization_objective='balanced', time_budget_ms=None, solve_trace=None, portfolio=False):
     """
     Optimize delivery routes with emphasis on fuel efficiency.
     
@@ -33,10 +37,24 @@ def optimize_routes_fuel_efficient(depot, locations, distance_matrix, vehicle_da
             - 'time': Optimize for fastest delivery time
             - 'fuel': Optimize for minimum fuel consumption
             - 'balanced': Balance time and fuel consumption (default)
+        time_budget_ms (float, optional): Solver time budget, scaled with the
+            number of locations by default
+        solve_trace (dict, optional): Filled with the solver's trace (budget,
+            stop reason and timestamped improving solutions)
+        portfolio (bool): Race several search strategies in parallel processes
+            and keep the best result; the trace reports the winning strategy
     
     Returns:
         list: Optimized routes with fuel consumption estimates
+    
+    Raises:
+        ValueError: If distance_matrix is a TiledDistanceMatrix; fuel and
+            travel time matrices are dense, one entry per pair of stops
     """
+    if hasattr(distance_matrix, 'iter_rows'):
+        raise ValueError(f"Fuel-efficient routing needs the full distance matrix, "
+                         f"at most {TILED_MATRIX_THRESHOLD} stops are supported")
+    
     # Initialize fuel consumption predictor
     fuel_predictor = FuelConsumptionPredictor()
     
@@ -63,7 +81,6 @@ def optimize_routes_fuel_efficient(depot, locations, distance_matrix, vehicle_da
     
     # Create travel time matrix based on distances and traffic
     travel_time_matrix = [[0 for _ in range(len(distance_matrix))] for _ in range(len(distance_matrix))]
-    fuel_matrix = [[0 for _ in range(len(distance_matrix))] for _ in range(len(distance_matrix))]
     traffic_factors = [[1.0 for _ in range(len(distance_matrix))] for _ in range(len(distance_matrix))]
     
     # If we have traffic data, apply it to distances
@@ -90,184 +107,26 @@ def optimize_routes_fuel_efficient(depot, locations, distance_matrix, vehicle_da
                 if i != j:
                     travel_time_matrix[i][j] = distance_matrix[i][j] / 30.0  # Assuming 30 km/h average speed
     
-    # Calculate fuel consumption for each segment
+    # Calculate fuel consumption for each segment and each distinct vehicle profile
     road_types = estimate_road_types(coordinates, distance_matrix)
-    
-    for i in range(len(distance_matrix)):
-        for j in range(len(distance_matrix)):
-            if i != j:
-                # For each vehicle, calculate approximate fuel consumption
-                for v_idx, vehicle in enumerate(vehicle_data[:vehicle_count]):
-                    # Prepare data for fuel prediction
-                    route_segment = {
-                        'distance': distance_matrix[i][j],
-                        'vehicle_type': vehicle.get('type', 'van'),
-                        'vehicle_weight': vehicle.get('weight', 2000),
-                        'load_weight': vehicle.get('load', 500),
-                        'avg_speed': 30 / traffic_factors[i][j],  # Adjust speed for traffic
-                        'traffic_factor': traffic_factors[i][j],
-                        'stop_frequency': 1 / max(1, distance_matrix[i][j]),  # At least one stop per segment
-                        'road_type': road_types[i][j],
-                        'gradient': 0  # Assuming flat terrain for simplicity
-                    }
-                    
-                    # Predict fuel consumption
-                    fuel_consumption = fuel_predictor.predict(route_segment)
-                    
-                    # Store in fuel matrix (we'll use the first vehicle for now)
-                    if v_idx == 0:
-                        fuel_matrix[i][j] = fuel_consumption
+    fuel_matrices, vehicle_profiles = predict_fuel_matrices(
+        fuel_predictor, distance_matrix, traffic_factors, road_types, vehicle_data[:vehicle_count])
     
     logger.info(f"Optimizing routes with {optimization_objective} objective")
     
-    # Create the routing index manager
-    manager = pywrapcp.RoutingIndexManager(len(distance_matrix), 
-                                          vehicle_count, 
-                                          0)  # 0 is the depot index
-    
-    # Create Routing Model
-    routing = pywrapcp.RoutingModel(manager)
-    
-    # Create and register transit callbacks for different metrics
-    def distance_callback(from_index, to_index):
-        """Returns the distance between the two nodes."""
-        from_node = manager.IndexToNode(from_index)
-        to_node = manager.IndexToNode(to_index)
-        return int(distance_matrix[from_node][to_node] * 1000)  # Convert to meters
-    
-    def time_callback(from_index, to_index):
-        """Returns the travel time between the two nodes."""
-        from_node = manager.IndexToNode(from_index)
-        to_node = manager.IndexToNode(to_index)
-        return int(travel_time_matrix[from_node][to_node] * 3600)  # Convert to seconds
-    
-    def fuel_callback(from_index, to_index):
-        """Returns the fuel consumption between the two nodes."""
-        from_node = manager.IndexToNode(from_index)
-        to_node = manager.IndexToNode(to_index)
-        return int(fuel_matrix[from_node][to_node] * 1000)  # Convert to milliliters for integer math
-    
-    distance_callback_index = routing.RegisterTransitCallback(distance_callback)
-    time_callback_index = routing.RegisterTransitCallback(time_callback)
-    fuel_callback_index = routing.RegisterTransitCallback(fuel_callback)
-    
-    # Set the cost function based on optimization objective
-    if optimization_objective == 'time':
-        logger.info("Using TIME as the primary optimization objective")
-        routing.SetArcCostEvaluatorOfAllVehicles(time_callback_index)
-    elif optimization_objective == 'fuel':
-        logger.info("Using FUEL as the primary optimization objective")
-        routing.SetArcCostEvaluatorOfAllVehicles(fuel_callback_index)
-    else:  # balanced (default)
-        logger.info("Using BALANCED optimization (time and fuel)")
-        # Create a combined cost function that balances time and fuel
-        def combined_callback(from_index, to_index):
-            from_node = manager.IndexToNode(from_index)
-            to_node = manager.IndexToNode(to_index)
-            
-            # Normalize time and fuel to similar scales
-            time_cost = travel_time_matrix[from_node][to_node] * 3600  # seconds
-            fuel_cost = fuel_matrix[from_node][to_node] * 1000  # milliliters
-            
-            # Calculate typical values to normalize
-            avg_time = 1800  # 30 minutes in seconds
-            avg_fuel = 2000  # 2 liters in milliliters
-            
-            # Normalize to make both factors comparable
-            normalized_time = time_cost / avg_time
-            normalized_fuel = fuel_cost / avg_fuel
-            
-            # Weight time vs. fuel (adjust these weights to change the balance)
-            time_weight = 0.5
-            fuel_weight = 0.5
-            
-            # Return weighted combination
-            return int((time_weight * normalized_time + fuel_weight * normalized_fuel) * 10000)
-        
-        combined_callback_index = routing.RegisterTransitCallback(combined_callback)
-        routing.SetArcCostEvaluatorOfAllVehicles(combined_callback_index)
-    
-    # Add Distance dimension
-    routing.AddDimension(
-        distance_callback_index,
-        0,  # no slack
-        int(max_distance * 1000) if max_distance else 1000000000,  # vehicle maximum travel distance
-        True,  # start cumul to zero
-        'Distance')
-    
-    # Add Time dimension
-    routing.AddDimension(
-        time_callback_index,
-        60 * 60,  # Allow waiting time of up to 60 minutes
-        24 * 60 * 60,  # Maximum time per vehicle (24 hours in seconds)
-        False,  # Don't force start cumul to zero
-        'Time')
-    
-    # Add Fuel dimension
-    routing.AddDimension(
-        fuel_callback_index,
-        0,  # no slack
-        1000000,  # maximum fuel consumption (in milliliters)
-        True,  # start cumul to zero
-        'Fuel')
-    
-    # Add time window constraints if present
-    time_dimension = routing.GetDimensionOrDie('Time')
-    depot_start_time = datetime.strptime("8:00", "%H:%M")  # 8:00 AM start
-    
-    has_time_windows = any(loc.get('time_window_start') for loc in locations)
-    if has_time_windows:
-        logger.info("Setting up time window constraints")
-        
-        # Set time window for depot
-        index = manager.NodeToIndex(0)
-        time_dimension.CumulVar(index).SetRange(0, 24 * 60 * 60)  # Depot available 24 hours
-        
-        # Add time window for each location
-        for location_idx, location in enumerate(locations):
-            # Convert to routing index (add 1 to skip depot)
-            routing_idx = location_idx + 1
-            
-            if location.get('time_window_start') and location.get('time_window_end'):
-                try:
-                    # Convert string/time to datetime for calculations
-                    if isinstance(location['time_window_start'], str):
-                        start_time = datetime.strptime(location['time_window_start'], "%H:%M")
-                        end_time = datetime.strptime(location['time_window_end'], "%H:%M")
-                    else:
-                        # Assume it's a time object
-                        start_time = datetime.combine(datetime.today(), location['time_window_start'])
-                        end_time = datetime.combine(datetime.today(), location['time_window_end'])
-                    
-                    # Convert time to seconds from depot start time
-                    start_seconds = int((start_time - depot_start_time).total_seconds())
-                    end_seconds = int((end_time - depot_start_time).total_seconds())
-                    
-                    # Ensure start_seconds is non-negative
-                    start_seconds = max(0, start_seconds)
-                    
-                    # If end time is before start time (e.g., crosses midnight), add 24 hours
-                    if end_seconds < start_seconds:
-                        end_seconds += 24 * 60 * 60
-                    
-                    # Set time window for this location
-                    index = manager.NodeToIndex(routing_idx)
-                    time_dimension.CumulVar(index).SetRange(start_seconds, end_seconds)
-                except Exception as e:
-                    logger.error(f"Error setting time window for {location['name']}: {e}")
-    
-    # Set first solution heuristic
-    search_parameters = pywrapcp.DefaultRoutingSearchParameters()
-    search_parameters.first_solution_strategy = (
-        routing_enums_pb2.FirstSolutionStrategy.PATH_CHEAPEST_ARC)
-    
-    # Add metaheuristics for better solutions
-    search_parameters.local_search_metaheuristic = (
-        routing_enums_pb2.LocalSearchMetaheuristic.GUIDED_LOCAL_SEARCH)
-    search_parameters.time_limit.seconds = 30  # Increase time limit for better solutions
+    # Build the model with the arc costs of the optimization objective
+    model = build_routing_model(
+        distance_matrix, vehicle_count,
+        time_matrices=[travel_time_matrix],
+        max_distance=max_distance,
+        locations=locations,
+        objective=fuel_objective(optimization_objective, travel_time_matrix, fuel_matrices, vehicle_profiles))
+    routing, manager = model.routing, model.manager
     
     # Solve the problem
-    solution = routing.SolveWithParameters(search_parameters)
+    solution = model.solve(time_budget_ms=time_budget_ms, portfolio=portfolio)
+    if solve_trace is not None:
+        solve_trace.update(model.trace.to_dict())
     
     # Extract solution
     if solution:
@@ -275,6 +134,7 @@ def optimize_routes_fuel_efficient(depot, locations, distance_matrix, vehicle_da
         routes = []
         for vehicle_id in range(vehicle_count):
             vehicle_info = vehicle_data[vehicle_id] if vehicle_id < len(vehicle_data) else vehicle_data[0]
+            fuel_matrix = fuel_matrices[vehicle_profiles[vehicle_id]]
             
             route = {
                 'vehicle_id': vehicle_id,
@@ -309,7 +169,7 @@ def optimize_routes_fuel_efficient(depot, locations, distance_matrix, vehicle_da
                 
                 # Add distance, time, and fuel info for this leg
                 if node_index != next_node_index:
-                    distance = distance_matrix[node_index][next_node_index]
+                    distance = float(distance_matrix[node_index][next_node_index])
                     time = travel_time_matrix[node_index][next_node_index]
                     fuel = fuel_matrix[node_index][next_node_index]
                     
@@ -355,7 +215,7 @@ def optimize_routes_fuel_efficient(depot, locations, distance_matrix, vehicle_da
             
             # Add final leg back to depot
             last_node = manager.IndexToNode(index)
-            final_distance = distance_matrix[last_node][0]  # 0 is depot index
+            final_distance = float(distance_matrix[last_node][0])  # 0 is depot index
             final_time = travel_time_matrix[last_node][0]
             final_fuel = fuel_matrix[last_node][0]
             
@@ -383,7 +243,7 @@ def optimize_routes_fuel_efficient(depot, locations, distance_matrix, vehicle_da
     
     # If no solution found, create a simple route manually
     logger.warning("No solution found. Creating a manual route.")
-    return create_manual_route(depot, locations, distance_matrix, vehicle_data[0], fuel_matrix)
+    return create_manual_route(depot, locations, distance_matrix, vehicle_data[0], fuel_matrices[vehicle_profiles[0]])
 
 def is_near_congestion(coord1, coord2, congestion_area):
     """Check if a route segment is near a congestion area"""
@@ -418,31 +278,155 @@ def calculate_distance(coord1, coord2):
 
 def estimate_road_types(coordinates, distance_matrix):
     """Estimate road types based on distances and coordinates"""
-    n = len(coordinates)
-    road_types = [['mixed' for _ in range(n)] for _ in range(n)]
-    
-    for i in range(n):
-        for j in range(n):
-            if i != j:
-                distance = distance_matrix[i][j]
-                straight_line = calculate_distance(coordinates[i], coordinates[j])
+    distances = np.asarray(distance_matrix, dtype=np.float64)
+    lats, lngs = coordinate_arrays(coordinates)
+    straight_line = haversine_matrix(lats, lngs)
                 
-                # Calculate ratio of actual distance to straight line distance
-                # Higher ratio suggests more urban roads with turns
-                ratio = distance / straight_line if straight_line > 0 else 1
+    # Calculate ratio of actual distance to straight line distance
+    # Higher ratio suggests more urban roads with turns
+    ratio = np.ones_like(distances)
+    np.divide(distances, straight_line, out=ratio, where=straight_line > 0)
                 
-                if distance > 20 and ratio < 1.2:
-                    # Long distances with direct routes are likely highways
-                    road_types[i][j] = 'highway'
-                elif distance < 5 or ratio > 1.4:
-                    # Short distances or indirect routes are likely urban
-                    road_types[i][j] = 'urban'
-                else:
-                    # Otherwise mixed
-                    road_types[i][j] = 'mixed'
+    road_types = np.select(
+        [
+            (distances > 20) & (ratio < 1.2),  # Long distances with direct routes are likely highways
+            (distances < 5) | (ratio > 1.4)    # Short distances or indirect routes are likely urban
+        ],
+        ['highway', 'urban'],
+        default='mixed'  # Otherwise mixed
+    ).astype(object)
+    np.fill_diagonal(road_types, 'mixed')
     
     return road_types
 
+def vehicle_fuel_profile(vehicle):
+    """Key of the vehicle attributes that the fuel prediction depends on"""
+    return (vehicle.get('type', 'van'), vehicle.get('weight', 2000), vehicle.get('load', 500))
+
+def predict_fuel_matrices(fuel_predictor, distance_matrix, traffic_factors, road_types, vehicles):
+    """
+    Predict fuel consumption for every segment and every distinct vehicle profile.
+    
+    One feature table covering all segments of all distinct profiles is
+    built and passed to the predictor in a single batch, instead of one
+    DataFrame per segment and vehicle.
+    
+    Args:
+        distance_matrix: (n, n) distances in km
+        traffic_factors: (n, n) traffic factors
+        road_types: (n, n) road types from estimate_road_types
+        vehicles (list): Vehicle information dicts, one per vehicle
+    
+    Returns:
+        tuple: (fuel_matrices, vehicle_profiles) where fuel_matrices is a
+            (profiles, n, n) ndarray in liters and vehicle_profiles[v] is
+            the index into fuel_matrices for vehicle v
+    """
+    profiles = []
+    vehicle_profiles = []
+    for vehicle in vehicles:
+        profile = vehicle_fuel_profile(vehicle)
+        if profile not in profiles:
+            profiles.append(profile)
+        vehicle_profiles.append(profiles.index(profile))
+    
+    distances = np.asarray(distance_matrix, dtype=np.float64)
+    factors = np.asarray(traffic_factors, dtype=np.float64)
+    n = len(distances)
+    
+    # All segments i != j, repeated once per profile
+    rows, cols = np.nonzero(~np.eye(n, dtype=bool))
+    segment_count = len(rows)
+    profile_count = len(profiles)
+    segment_distances = distances[rows, cols]
+    segment_factors = factors[rows, cols]
+    
+    route_segments = {
+        'distance': np.tile(segment_distances, profile_count),
+        'vehicle_type': np.repeat([p[0] for p in profiles], segment_count),
+        'vehicle_weight': np.repeat([p[1] for p in profiles], segment_count),
+        'load_weight': np.repeat([p[2] for p in profiles], segment_count),
+        'avg_speed': np.tile(BASE_SPEED_KMH / segment_factors, profile_count),  # Adjust speed for traffic
+        'traffic_factor': np.tile(segment_factors, profile_count),
+        'stop_frequency': np.tile(1 / np.maximum(1, segment_distances), profile_count),  # At least one stop per segment
+        'road_type': np.tile(np.asarray(road_types)[rows, cols], profile_count),
+        'gradient': np.zeros(segment_count * profile_count)  # Assuming flat terrain for simplicity
+    }
+    
+    predictions = fuel_predictor.predict_batch(route_segments).reshape(profile_count, segment_count)
+    
+    fuel_matrices = np.zeros((profile_count, n, n), dtype=np.float64)
+    fuel_matrices[:, rows, cols] = predictions
+    
+    return fuel_matrices, vehicle_profiles
+
+def fuel_objective(optimization_objective, travel_time_matrix, fuel_matrices, vehicle_profiles):
+    """
+    Objective hook for build_routing_model.
+    
+    Sets the arc costs of the optimization objective and adds a Fuel
+    dimension in which each vehicle accumulates its own profile's consumption.
+    
+    Args:
+        optimization_objective (str): 'time', 'fuel' or 'balanced'
+        travel_time_matrix: (n, n) travel times in hours
+        fuel_matrices: (profiles, n, n) fuel consumption in liters
+        vehicle_profiles (list): Index into fuel_matrices of each vehicle
+    
+    Returns:
+        callable: objective(model), picklable so portfolio workers can rebuild the model
+    """
+    return partial(apply_fuel_objective, optimization_objective, travel_time_matrix, fuel_matrices, vehicle_profiles)
+
+def apply_fuel_objective(optimization_objective, travel_time_matrix, fuel_matrices, vehicle_profiles, model):
+    """Set the fuel optimizer's arc costs and Fuel dimension on a model (see fuel_objective)."""
+    # One fuel matrix per distinct vehicle profile, shared by the vehicles with that profile
+    fuel_costs = [(fuel * 1000).astype(np.int64) for fuel in fuel_matrices]  # Milliliters for integer math
+    profile_fuel_callbacks = [model.register_matrix(costs) for costs in fuel_costs]
+    vehicle_fuel_callbacks = [profile_fuel_callbacks[vehicle_profiles[v]] for v in range(model.vehicle_count)]
+        
+    # Set the cost function based on optimization objective
+    if optimization_objective == 'time':
+        logger.info("Using TIME as the primary optimization objective")
+        model.set_arc_costs(model.time_transits)
+    elif optimization_objective == 'fuel':
+        logger.info("Using FUEL as the primary optimization objective")
+        model.set_arc_costs(vehicle_fuel_callbacks)
+    else:  # balanced (default)
+        logger.info("Using BALANCED optimization (time and fuel)")
+        # Create a combined cost that balances time and fuel, per vehicle profile
+        time_cost = np.asarray(travel_time_matrix, dtype=np.float64) * 3600  # seconds
+            
+        # Calculate typical values to normalize
+        avg_time = 1800  # 30 minutes in seconds
+        avg_fuel = 2000  # 2 liters in milliliters
+            
+        # Weight time vs. fuel (adjust these weights to change the balance)
+        time_weight = 0.5
+        fuel_weight = 0.5
+            
+        # Normalize to make both factors comparable
+        normalized_time = time_cost / avg_time
+            
+        profile_combined_callbacks = []
+        for fuel in fuel_matrices:
+            fuel_cost = fuel * 1000  # milliliters
+            normalized_fuel = fuel_cost / avg_fuel
+                
+            # Weighted combination
+            combined_costs = ((time_weight * normalized_time + fuel_weight * normalized_fuel) * 10000).astype(np.int64)
+            profile_combined_callbacks.append(model.register_matrix(combined_costs))
+            
+        model.set_arc_costs([profile_combined_callbacks[vehicle_profiles[v]] for v in range(model.vehicle_count)])
+        
+    # Add Fuel dimension, each vehicle accumulating its own profile's consumption
+    model.add_dimension(
+        'Fuel',
+        vehicle_fuel_callbacks,
+        0,  # no slack
+        1000000,  # maximum fuel consumption (in milliliters)
+        True)  # start cumul to zero
+
 def create_manual_route(depot, locations, distance_matrix, vehicle_data, fuel_matrix):
     """Create a fallback route if optimization fails"""
     manual_route = {
@@ -496,7 +480,7 @@ def create_manual_route(depot, locations, distance_matrix, vehicle_data, fuel_ma
         
         if from_idx < len(distance_matrix) and to_idx < len(distance_matrix):
             # Add distance
-            distance = distance_matrix[from_idx][to_idx]
+            distance = float(distance_matrix[from_idx][to_idx])
             total_distance += distance
             
             # Add time (assuming 30 km/h average speed)
@@ -0,0 +1,304 @@
+import os
+import logging
+import sqlite3
+import threading
+from contextlib import closing
+
+import pandas as pd
+
+# Set up logging
+logging.basicConfig(level=logging.INFO,
+                    format='%(asctime)s - %(name)s - %(levelname)s - %(message)s')
+logger = logging.getLogger(__name__)
+
+# Columns of a fuel consumption record and their SQLite types
+RECORD_COLUMNS = [
+    ('route_id', 'INTEGER'),
+    ('vehicle_id', 'INTEGER'),
+    ('driver_id', 'INTEGER'),
+    ('predicted_fuel', 'REAL'),
+    ('actual_fuel', 'REAL'),
+    ('prediction_error', 'REAL'),
+    ('distance', 'REAL'),
+    ('vehicle_type', 'TEXT'),
+    ('vehicle_weight', 'REAL'),
+    ('load_weight', 'REAL'),
+    ('avg_speed', 'REAL'),
+    ('traffic_factor', 'REAL'),
+    ('stop_frequency', 'REAL'),
+    ('road_type', 'TEXT'),
+    ('gradient', 'REAL'),
+    ('temperature', 'REAL'),
+    ('date_recorded', 'TEXT'),
+    ('driver_efficiency_rating', 'REAL')
+]
+
+COLUMN_NAMES = [name for name, _ in RECORD_COLUMNS]
+
+# Seconds a writer waits for another process holding the write lock
+BUSY_TIMEOUT_SECONDS = 30
+
+# Columns prediction accuracy is broken down by
+ACCURACY_GROUPS = ['vehicle_type', 'road_type']
+
+# Number of most recent records in the accuracy trend (size of the ring buffer)
+RECENT_TREND_SIZE = 10
+
+# Prediction error and absolute error percentage of a record, as SQL expressions
+ERROR_SQL = "COALESCE(prediction_error, actual_fuel - predicted_fuel)"
+ERROR_PERCENT_SQL = f"CASE WHEN actual_fuel > 0 THEN ABS({ERROR_SQL}) / actual_fuel * 100 ELSE 0 END"
+
+
+class FuelTrainingStore:
+    """
+    Append-only store of actual fuel consumption records in SQLite.
+    
+    Each record is a single INSERT, so writing costs the same no matter how
+    many records exist, and SQLite's locking makes concurrent writes from
+    several web workers safe (WAL mode lets readers continue meanwhile).
+    Loads select only the requested columns. A legacy CSV file is imported
+    once when the store is created.
+    
+    Prediction accuracy aggregates (counts and error sums, overall and per
+    group) and a ring buffer of the most recent errors are updated in the
+    same transaction as each insert, so accuracy metrics are read in
+    O(groups) without scanning the records.
+    """
+    def __init__(self, path='data/fuel_training_data.db', legacy_csv_path=None):
+        """
+        Initialize the store.
+        
+        Args:
+            path (str): Path of the SQLite database file
+            legacy_csv_path (str, optional): CSV of previously collected records
+                to import when the store is first created
+        """
+        self.path = path
+        self.legacy_csv_path = legacy_csv_path
+        self._initialized = False
+    
+    def append(self, record):
+        """
+        Append one record.
+        
+        Args:
+            record (dict): Record values by column name; unknown keys are ignored
+        """
+        with closing(self._connect()) as conn, conn:
+            record_id = conn.execute(
+                f"INSERT INTO fuel_records ({', '.join(COLUMN_NAMES)}) "
+                f"VALUES ({', '.join('?' * len(COLUMN_NAMES))})",
+                [_sql_value(record.get(name)) for name in COLUMN_NAMES]
+            ).lastrowid
+            self._accumulate(conn, record_id, record_id)
+            
+            total = conn.execute(
+                "SELECT count FROM fuel_accuracy_aggregates WHERE dimension = 'all'"
+            ).fetchone()[0]
+            conn.execute(
+                f"INSERT OR REPLACE INTO fuel_recent_errors (slot, record_id, abs_error_percent) "
+                f"SELECT ?, id, {ERROR_PERCENT_SQL} FROM fuel_records WHERE id = ?",
+                ((total - 1) % RECENT_TREND_SIZE, record_id)
+            )
+    
+    def load(self, columns=None, after_id=None):
+        """
+        Load records in insertion order.
+        
+        Args:
+            columns (list, optional): Columns to read; defaults to all of them.
+                'id' gives each record's position in the store
+            after_id (int, optional): Only load records appended after this id
+        
+        Returns:
+            DataFrame: One row per record
+        """
+        columns = list(columns or COLUMN_NAMES)
+        unknown = set(columns) - set(COLUMN_NAMES) - {'id'}
+        if unknown:
+            raise ValueError(f"Unknown fuel record columns: {sorted(unknown)}")
+        
+        with closing(self._connect()) as conn:
+            return pd.read_sql_query(
+                f"SELECT {', '.join(columns)} FROM fuel_records WHERE id > ? ORDER BY id",
+                conn, params=(after_id or 0,)
+            )
+    
+    def count(self):
+        """Number of stored records."""
+        with closing(self._connect()) as conn:
+            return conn.execute("SELECT COUNT(*) FROM fuel_records").fetchone()[0]
+    
+    def accuracy_aggregates(self):
+        """
+        Get the maintained prediction accuracy aggregates.
+        
+        Returns:
+            dict: 'all' and one entry per ACCURACY_GROUPS column mapping group
+                values to {count, sum_abs_error, sum_abs_error_percent,
+                over_count, under_count}, plus 'recent': absolute error
+                percentages of the last RECENT_TREND_SIZE records
+        """
+        with closing(self._connect()) as conn:
+            rows = conn.execute(
+                "SELECT dimension, group_value, count, sum_abs_error, sum_abs_error_percent, "
+                "over_count, under_count FROM fuel_accuracy_aggregates"
+            ).fetchall()
+            recent = conn.execute("SELECT abs_error_percent FROM fuel_recent_errors").fetchall()
+        
+        aggregates = {dimension: {} for dimension in ['all'] + ACCURACY_GROUPS}
+        for dimension, group_value, count, sum_abs_error, sum_abs_error_percent, over, under in rows:
+            aggregates[dimension][group_value] = {
+                'count': count,
+                'sum_abs_error': sum_abs_error or 0.0,
+                'sum_abs_error_percent': sum_abs_error_percent or 0.0,
+                'over_count': over or 0,
+                'under_count': under or 0
+            }
+        aggregates['recent'] = [value for value, in recent if value is not None]
+        return aggregates
+    
+    def snapshot(self, destination):
+        """
+        Copy a consistent snapshot of the store to another database file.
+        
+        Args:
+            destination (str): Path of the copy (overwritten if it exists)
+        """
+        if os.path.exists(destination):
+            os.remove(destination)
+        with closing(self._connect()) as conn, closing(sqlite3.connect(destination)) as target:
+            conn.backup(target)
+    
+    def _connect(self):
+        """Open a connection, creating the table (and importing legacy data) on first use."""
+        os.makedirs(os.path.dirname(self.path) or '.', exist_ok=True)
+        conn = sqlite3.connect(self.path, timeout=BUSY_TIMEOUT_SECONDS)
+        if not self._initialized:
+            try:
+                self._initialize(conn)
+            except Exception:
+                conn.close()
+                raise
+            self._initialized = True
+        return conn
+    
+    def _initialize(self, conn):
+        # Existing stores are already in WAL mode and complete, readers must not take the write lock
+        tables = {name for name, in conn.execute(
+            "SELECT name FROM sqlite_master WHERE type = 'table' "
+            "AND name IN ('fuel_records', 'fuel_accuracy_aggregates')")}
+        if len(tables) == 2:
+            return
+        
+        conn.execute("PRAGMA journal_mode=WAL")
+        # Take the write lock first, so only one worker creates the table and imports
+        conn.execute("BEGIN IMMEDIATE")
+        try:
+            exists = conn.execute(
+                "SELECT 1 FROM sqlite_master WHERE type = 'table' AND name = 'fuel_records'"
+            ).fetchone()
+            if not exists:
+                columns = ', '.join(f"{name} {sql_type}" for name, sql_type in RECORD_COLUMNS)
+                conn.execute(f"CREATE TABLE fuel_records (id INTEGER PRIMARY KEY AUTOINCREMENT, {columns})")
+                self._import_legacy_csv(conn)
+            
+            exists = conn.execute(
+                "SELECT 1 FROM sqlite_master WHERE type = 'table' AND name = 'fuel_accuracy_aggregates'"
+            ).fetchone()
+            if not exists:
+                self._create_aggregates(conn)
+            conn.execute("COMMIT")
+        except Exception:
+            conn.execute("ROLLBACK")
+            raise
+    
+    def _import_legacy_csv(self, conn):
+        if not self.legacy_csv_path or not os.path.exists(self.legacy_csv_path):
+            return
+        
+        df = pd.read_csv(self.legacy_csv_path)
+        df = df.reindex(columns=COLUMN_NAMES)
+        rows = [[_sql_value(value) for value in row] for row in df.itertuples(index=False)]
+        conn.executemany(
+            f"INSERT INTO fuel_records ({', '.join(COLUMN_NAMES)}) "
+            f"VALUES ({', '.join('?' * len(COLUMN_NAMES))})",
+            rows
+        )
+        logger.info(f"Imported {len(rows)} fuel records from {self.legacy_csv_path}")
+
+    def _create_aggregates(self, conn):
+        """Create the accuracy aggregate tables and fill them from the existing records."""
+        conn.execute(
+            "CREATE TABLE fuel_accuracy_aggregates (dimension TEXT, group_value TEXT, count INTEGER, "
+            "sum_abs_error REAL, sum_abs_error_percent REAL, over_count INTEGER, under_count INTEGER, "
+            "PRIMARY KEY (dimension, group_value))"
+        )
+        conn.execute("CREATE TABLE fuel_recent_errors (slot INTEGER PRIMARY KEY, record_id INTEGER, abs_error_percent REAL)")
+        
+        last_id = conn.execute("SELECT MAX(id) FROM fuel_records").fetchone()[0]
+        if last_id is None:
+            return
+        self._accumulate(conn, 0, last_id)
+        
+        recent = conn.execute(
+            f"SELECT id, {ERROR_PERCENT_SQL} FROM fuel_records ORDER BY id DESC LIMIT ?", (RECENT_TREND_SIZE,)
+        ).fetchall()[::-1]
+        total = conn.execute("SELECT COUNT(*) FROM fuel_records").fetchone()[0]
+        conn.executemany(
+            "INSERT INTO fuel_recent_errors (slot, record_id, abs_error_percent) VALUES (?, ?, ?)",
+            [((total - len(recent) + k) % RECENT_TREND_SIZE, record_id, percent)
+             for k, (record_id, percent) in enumerate(recent)]
+        )
+    
+    def _accumulate(self, conn, first_id, last_id):
+        """Add the records with ids in [first_id, last_id] to the accuracy aggregates."""
+        for dimension, group_sql in [('all', "''")] + [(g, f"COALESCE({g}, 'unknown')") for g in ACCURACY_GROUPS]:
+            conn.execute(
+                f"INSERT INTO fuel_accuracy_aggregates (dimension, group_value, count, sum_abs_error, "
+                f"sum_abs_error_percent, over_count, under_count) "
+                f"SELECT ?, {group_sql}, COUNT(*), TOTAL(ABS({ERROR_SQL})), TOTAL({ERROR_PERCENT_SQL}), "
+                f"TOTAL({ERROR_SQL} > 0), TOTAL({ERROR_SQL} < 0) "
+                f"FROM fuel_records WHERE id BETWEEN ? AND ? GROUP BY {group_sql} "
+                f"ON CONFLICT (dimension, group_value) DO UPDATE SET "
+                f"count = count + excluded.count, "
+                f"sum_abs_error = sum_abs_error + excluded.sum_abs_error, "
+                f"sum_abs_error_percent = sum_abs_error_percent + excluded.sum_abs_error_percent, "
+                f"over_count = over_count + excluded.over_count, "
+                f"under_count = under_count + excluded.under_count",
+                (dimension, first_id, last_id)
+            )
+
+
+def _sql_value(value):
+    """Convert NumPy scalars and NaN to values SQLite stores."""
+    if value is None:
+        return None
+    if hasattr(value, 'item'):
+        value = value.item()
+    if isinstance(value, float) and value != value:
+        return None
+    return value
+
+
+# Stores by database path, shared by all collectors of this process
+_stores = {}
+_stores_lock = threading.Lock()
+
+def get_training_store(path='data/fuel_training_data.db', legacy_csv_path=None):
+    """
+    Get the process-wide store of a database file, so it is initialised only once.
+    
+    Args:
+        path (str): Path of the SQLite database file
+        legacy_csv_path (str, optional): CSV imported when the store is first created
+    
+    Returns:
+        FuelTrainingStore: The shared store
+    """
+    key = (os.path.abspath(path), legacy_csv_path)
+    with _stores_lock:
+        store = _stores.get(key)
+        if store is None:
+            store = _stores[key] = FuelTrainingStore(path, legacy_csv_path)
+        return store
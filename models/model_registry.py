@@ -0,0 +1,201 @@
+import os
+import time
+import hashlib
+import logging
+import threading
+
+# Set up logging
+logging.basicConfig(level=logging.INFO,
+                    format='%(asctime)s - %(name)s - %(levelname)s - %(message)s')
+logger = logging.getLogger(__name__)
+
+
+class _RegistryEntry:
+    """A loaded model together with the file state it was loaded from."""
+    def __init__(self, value, stat_key, digest, load_time):
+        self.value = value
+        self.stat_key = stat_key  # (mtime_ns, size) of the file when loaded
+        self.digest = digest
+        self.load_time = load_time
+        self.loaded_at = time.time()
+
+
+class ModelRegistry:
+    """
+    Process-wide cache of deserialized models, keyed by file path.
+    
+    Each model file is loaded once per process. Every lookup stats the
+    file; if its mtime or size changed, the content hash is compared and
+    the model is reloaded only if the content actually changed. A reload
+    builds the new entry first and then swaps it in, so concurrent callers
+    see either the old or the new model, never a partial one.
+    """
+    def __init__(self):
+        self._entries = {}  # (path, loader) -> _RegistryEntry
+        self._lock = threading.Lock()
+        self._load_locks = {}
+        self.stats = {'hits': 0, 'misses': 0, 'reloads': 0, 'load_time': 0.0}
+    
+    def get(self, path, loader):
+        """
+        Get the model stored at a path, loading it if needed.
+        
+        Args:
+            path (str): Path of the model file
+            loader (callable): Function taking the path and returning the
+                object to cache (e.g. joblib.load)
+        
+        Returns:
+            object: The loaded object, or None if the file doesn't exist
+        """
+        key = (os.path.abspath(path), loader)
+        stat_key = _stat_key(path)
+        if stat_key is None:
+            return None
+        
+        entry = self._entries.get(key)
+        if entry is not None and entry.stat_key == stat_key:
+            self._count('hits')
+            return entry.value
+        
+        # Only one thread per model loads it; the others wait and reuse the result
+        with self._lock:
+            load_lock = self._load_locks.setdefault(key, threading.Lock())
+        
+        with load_lock:
+            entry = self._entries.get(key)
+            stat_key = _stat_key(path)
+            if stat_key is None:
+                return None
+            if entry is not None and entry.stat_key == stat_key:
+                self._count('hits')
+                return entry.value
+            
+            digest = _file_digest(path)
+            if entry is not None and entry.digest == digest:
+                # Touched but unchanged, keep the loaded model
+                entry.stat_key = stat_key
+                self._count('hits')
+                return entry.value
+            
+            start = time.perf_counter()
+            value = loader(path)
+            load_time = time.perf_counter() - start
+            
+            self._entries[key] = _RegistryEntry(value, stat_key, digest, load_time)
+            with self._lock:
+                self.stats['misses'] += 1
+                self.stats['load_time'] += load_time
+                if entry is not None:
+                    self.stats['reloads'] += 1
+            
+            logger.info(f"{'Reloaded' if entry is not None else 'Loaded'} model {path} in {load_time:.3f}s")
+            return value
+    
+    def peek(self, path, loader):
+        """
+        Get the object cached for a path without loading it.
+        
+        Args:
+            path (str): Path of the model file
+            loader (callable): Loader used with get() for this path
+        
+        Returns:
+            object: The cached object, or None if it isn't loaded or the
+                file changed since
+        """
+        entry = self._entries.get((os.path.abspath(path), loader))
+        if entry is None or entry.stat_key != _stat_key(path):
+            return None
+        return entry.value
+    
+    def store(self, path, loader, value):
+        """
+        Register an object that was just written to a path (e.g. after
+        training), so the next get() doesn't load it back from disk.
+        
+        Args:
+            path (str): Path the model was saved to
+            loader (callable): Loader used with get() for this path
+            value (object): The object get() should return
+        """
+        stat_key = _stat_key(path)
+        if stat_key is None:
+            return
+        key = (os.path.abspath(path), loader)
+        self._entries[key] = _RegistryEntry(value, stat_key, _file_digest(path), 0.0)
+    
+    def invalidate(self, path=None):
+        """Drop the cached models for a path, or all of them."""
+        with self._lock:
+            if path is None:
+                self._entries.clear()
+            else:
+                path = os.path.abspath(path)
+                for key in [k for k in self._entries if k[0] == path]:
+                    del self._entries[key]
+    
+    def get_stats(self):
+        """
+        Get the registry counters and the loaded models.
+        
+        Returns:
+            dict: hits, misses, reloads, total load time and per-model details
+        """
+        with self._lock:
+            stats = dict(self.stats)
+        stats['models'] = [
+            {
+                'path': path,
+                'loader': getattr(loader, '__name__', str(loader)),
+                'load_time': entry.load_time,
+                'loaded_at': entry.loaded_at,
+                'digest': entry.digest
+            }
+            for (path, loader), entry in list(self._entries.items())
+        ]
+        return stats
+    
+    def _count(self, name):
+        with self._lock:
+            self.stats[name] += 1
+
+
+def _stat_key(path):
+    """(mtime_ns, size) of a file, or None if it doesn't exist."""
+    try:
+        stat = os.stat(path)
+    except OSError:
+        return None
+    return stat.st_mtime_ns, stat.st_size
+
+def _file_digest(path):
+    """SHA-1 of a file's content."""
+    digest = hashlib.sha1()
+    with open(path, 'rb') as f:
+        for chunk in iter(lambda: f.read(1 << 20), b''):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+def atomic_dump(path, dump):
+    """
+    Write a model file atomically: dump(file_object) writes to a temporary
+    file which then replaces path, so readers never load a partial file.
+    
+    Args:
+        path (str): Destination path
+        dump (callable): Function writing the model to an open binary file
+    """
+    os.makedirs(os.path.dirname(path) or '.', exist_ok=True)
+    tmp_path = f"{path}.{os.getpid()}.{threading.get_ident()}.tmp"
+    try:
+        with open(tmp_path, 'wb') as f:
+            dump(f)
+        os.replace(tmp_path, path)
+    finally:
+        if os.path.exists(tmp_path):
+            os.remove(tmp_path)
+
+
+# Process-wide registry instance
+model_registry = ModelRegistry()
@@ -0,0 +1,191 @@
+import os
+import sys
+import time
+import logging
+import argparse
+import threading
+import subprocess
+from contextlib import contextmanager
+
+from models.fuel_training_store import get_training_store
+
+try:
+    import fcntl
+except ImportError:  # Windows
+    fcntl = None
+
+# Set up logging
+logging.basicConfig(level=logging.INFO,
+                    format='%(asctime)s - %(name)s - %(levelname)s - %(message)s')
+logger = logging.getLogger(__name__)
+
+# Seconds without new completed routes before a retrain starts
+RETRAIN_DEBOUNCE_SECONDS = 30
+
+# Repository root, the working directory of the retraining process
+PROJECT_ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+
+class RetrainingWorker:
+    """
+    Retrains the fuel consumption model in the background.
+    
+    Requests are debounced: a burst of completed routes results in a single
+    retrain once no new request arrived for debounce_seconds. The training
+    store is copied to a snapshot and the model is fitted on it in a
+    separate Python process, so neither the request thread nor the web
+    worker's CPU is tied up. The model file is replaced atomically when
+    training finishes, and every worker picks it up through the model
+    registry's reload check. At most one retrain runs per worker; requests
+    arriving meanwhile trigger one more run afterwards.
+    """
+    def __init__(self, model_path='models/fuel_consumption_model.pkl',
+                 training_store=None, debounce_seconds=RETRAIN_DEBOUNCE_SECONDS):
+        """
+        Initialize the worker.
+        
+        Args:
+            model_path (str): Path of the fuel consumption model
+            training_store (FuelTrainingStore, optional): Store of the collected
+                training data, defaults to the one FuelDataCollector writes to
+            debounce_seconds (float): Quiet period before a retrain starts
+        """
+        self.model_path = model_path
+        self.training_store = training_store or get_training_store(
+            'data/fuel_training_data.db', 'data/fuel_training_data.csv')
+        self.debounce_seconds = debounce_seconds
+        self._lock = threading.Lock()
+        self._timer = None
+        self._process = None
+        self._pending = False
+        self.stats = {
+            'requested': 0,
+            'started': 0,
+            'succeeded': 0,
+            'not_retrained': 0,
+            'last_started': None,
+            'last_duration': None
+        }
+    
+    def request_retrain(self):
+        """
+        Schedule a retrain and return immediately.
+        
+        Returns:
+            str: 'scheduled', or 'queued' if a retrain is already running
+        """
+        with self._lock:
+            self.stats['requested'] += 1
+            if self._timer is not None:
+                self._timer.cancel()
+            self._timer = threading.Timer(self.debounce_seconds, self._start)
+            self._timer.daemon = True
+            self._timer.start()
+            return 'queued' if self._process is not None else 'scheduled'
+    
+    def status(self):
+        """Get the worker's counters, whether a retrain is running and the latest training runs."""
+        from models.fuel_data_collector import load_training_state
+        
+        with self._lock:
+            status = dict(self.stats)
+            status['running'] = self._process is not None
+            status['scheduled'] = self._timer is not None
+        status['recent_runs'] = load_training_state(self.model_path).get('runs', [])[-5:]
+        return status
+    
+    def _start(self):
+        """Snapshot the training data and start the retraining process."""
+        with self._lock:
+            self._timer = None
+            if self._process is not None:
+                # Run again once the current retrain finishes
+                self._pending = True
+                return
+            
+            snapshot_path = f"{self.training_store.path}.{os.getpid()}.snapshot"
+            try:
+                self.training_store.snapshot(snapshot_path)
+                self._process = subprocess.Popen(
+                    [sys.executable, '-m', 'models.retraining_worker',
+                     os.path.abspath(snapshot_path), os.path.abspath(self.model_path)],
+                    cwd=PROJECT_ROOT
+                )
+            except Exception as e:
+                logger.error(f"Error starting fuel model retraining: {e}")
+                _remove(snapshot_path)
+                return
+            
+            self.stats['started'] += 1
+            self.stats['last_started'] = time.time()
+            process = self._process
+        
+        threading.Thread(target=self._wait, args=(process, snapshot_path), daemon=True).start()
+    
+    def _wait(self, process, snapshot_path):
+        """Wait for the retraining process, then clean up and run pending requests."""
+        started = time.perf_counter()
+        returncode = process.wait()
+        _remove(snapshot_path)
+        
+        with self._lock:
+            self._process = None
+            self.stats['last_duration'] = time.perf_counter() - started
+            self.stats['succeeded' if returncode == 0 else 'not_retrained'] += 1
+            pending, self._pending = self._pending, False
+        
+        logger.info(f"Fuel model retraining finished with exit code {returncode} "
+                    f"in {self.stats['last_duration']:.1f}s")
+        if pending:
+            self._start()
+
+
+def _remove(path):
+    try:
+        os.remove(path)
+    except OSError:
+        pass
+
+@contextmanager
+def _exclusive_lock(path):
+    """Hold an exclusive file lock, so retrains from different web workers run one at a time."""
+    if fcntl is None:
+        yield
+        return
+    with open(path, 'a') as f:
+        fcntl.flock(f, fcntl.LOCK_EX)
+        try:
+            yield
+        finally:
+            fcntl.flock(f, fcntl.LOCK_UN)
+
+def retrain_from_snapshot(snapshot_path, model_path):
+    """
+    Retrain the fuel model from a training data snapshot (runs in the child process).
+    
+    Args:
+        snapshot_path (str): Copy of the training data store
+        model_path (str): Where the new model is saved (atomically)
+    
+    Returns:
+        bool: Whether a new model was trained
+    """
+    from models.fuel_data_collector import FuelDataCollector
+    
+    collector = FuelDataCollector(None, model_path)
+    collector.training_data_path = snapshot_path
+    with _exclusive_lock(f"{model_path}.lock"):
+        return collector.retrain_model()
+
+
+# Process-wide worker instance
+retraining_worker = RetrainingWorker()
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Retrain the fuel consumption model from a data snapshot')
+    parser.add_argument('snapshot_path')
+    parser.add_argument('model_path')
+    args = parser.parse_args()
+    
+    sys.exit(0 if retrain_from_snapshot(args.snapshot_path, args.model_path) else 1)
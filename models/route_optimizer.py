@@ -1,15 +1,23 @@
 import numpy as np
-from ortools.constraint_solver import routing_enums_pb2
-from ortools.constraint_solver import pywrapcp
 from datetime import datetime, timedelta
 import math
 
+from models.routing_model import build_routing_model
+
+# Average speed by vehicle type (km/h); other types drive at the car speed
+VEHICLE_SPEEDS_KMH = {'truck': 35, 'van': 40, 'car': 45}
+
+def vehicle_speed(vehicle):
+    """Average speed in km/h of a vehicle, from its type (vans by default)."""
+    return VEHICLE_SPEEDS_KMH.get(vehicle.get('type', 'van'), VEHICLE_SPEEDS_KMH['car'])
+
 # Modified optimize_routes function to ensure vehicle_count is properly used
 
 # Enhanced route_optimizer.py function
 # Replace the optimize_routes function with this implementation
 
-def optimize_routes(depot, locations, distance_matrix, vehicle_count=1, max_distance=None, clusters=None, vehicle_data=None):
+def optimize_routes(depot, locations, distance_matrix, vehicle_count=1, max_distance=None, clusters=None, vehicle_data=None,
+                    time_budget_ms=None, solve_trace=None, portfolio=False):
     """
     Optimize delivery routes using Google OR-Tools.
     Enhanced to properly handle multiple vehicles with different vehicle types.
@@ -17,11 +25,19 @@ def optimize_routes(depot, locations, distance_matrix, vehicle_count=1, max_dist
     Args:
         depot (dict): Depot location
         locations (list): List of delivery locations
-        distance_matrix (list): 2D matrix of distances
+        distance_matrix (list): 2D matrix of distances, or a KNNDistanceGraph
+            to only consider nearest-neighbour arcs
         vehicle_count (int): Number of vehicles
         max_distance (float, optional): Maximum distance per vehicle
         clusters (list, optional): List of location clusters by vehicle
         vehicle_data (list, optional): Data about each vehicle
+        time_budget_ms (float, optional): Solver time budget, scaled with the
+            number of locations by default
+        solve_trace (dict, optional): Filled with the solver's trace (budget,
+            stop reason and timestamped improving solutions) and the
+            dropped_locations the routes leave out in sparse mode
+        portfolio (bool): Race several search strategies in parallel processes
+            and keep the best result; the trace reports the winning strategy
         
     Returns:
         list: Optimized routes
@@ -45,164 +61,37 @@ def optimize_routes(depot, locations, distance_matrix, vehicle_count=1, max_dist
     # Check if using pre-assigned clusters
     using_clusters = clusters is not None and len(clusters) == vehicle_count
     
-    # Create the routing index manager
-    manager = pywrapcp.RoutingIndexManager(len(distance_matrix), 
-                                          vehicle_count, 
-                                          0)  # 0 is the depot index
-    
-    # Create Routing Model
-    routing = pywrapcp.RoutingModel(manager)
-    
-    # Create and register a transit callback
-    def distance_callback(from_index, to_index):
-        # Convert from routing variable Index to distance matrix NodeIndex
-        from_node = manager.IndexToNode(from_index)
-        to_node = manager.IndexToNode(to_index)
-        return int(distance_matrix[from_node][to_node] * 1000)  # Convert to integers for OR-Tools
-    
-    transit_callback_index = routing.RegisterTransitCallback(distance_callback)
-    
-    # Define cost of each arc
-    routing.SetArcCostEvaluatorOfAllVehicles(transit_callback_index)
-    
-    # Add Distance constraint
-    if max_distance:
-        max_distance_meters = int(max_distance * 1000)  # Convert to meters
-        dimension_name = 'Distance'
-        routing.AddDimension(
-            transit_callback_index,
-            0,  # no slack
-            max_distance_meters,  # vehicle maximum travel distance
-            True,  # start cumul to zero
-            dimension_name)
-        distance_dimension = routing.GetDimensionOrDie(dimension_name)
-        distance_dimension.SetGlobalSpanCostCoefficient(100)
-    
-    # Add time constraint for different vehicle speeds
-    def time_callback(from_index, to_index):
-        # Convert from routing variable Index to distance matrix NodeIndex
-        from_node = manager.IndexToNode(from_index)
-        to_node = manager.IndexToNode(to_index)
-        
-        # Calculate time based on distance and vehicle speed
-        vehicle_idx = routing.VehicleIndex(from_index)
-        if vehicle_idx < len(vehicle_data):
-            vehicle_type = vehicle_data[vehicle_idx].get('type', 'van')
-            # Adjust speed based on vehicle type (km/h)
-            speed = 35 if vehicle_type == 'truck' else 40 if vehicle_type == 'van' else 45  # car
-        else:
-            speed = 40  # Default speed
-            
-        # Convert to seconds (speed in km/h, distance in km)
-        return int((distance_matrix[from_node][to_node] / speed) * 3600)
-    
-    time_callback_index = routing.RegisterTransitCallback(time_callback)
-    
-    # Add Time dimension
-    routing.AddDimension(
-        time_callback_index,
-        60 * 60,  # Allow waiting time of up to 60 minutes
-        24 * 60 * 60,  # Maximum time per vehicle (24 hours in seconds)
-        False,  # Don't force start cumul to zero
-        'Time')
-    
-    time_dimension = routing.GetDimensionOrDie('Time')
-    
-    # Add time window constraints if present
-    has_time_windows = any(loc.get('time_window_start') for loc in locations)
-    
-    if has_time_windows:
-        # Use 8:00 AM as the start time for the depot
-        depot_start_time = datetime.strptime("8:00", "%H:%M")
-        
-        # Set time window for depot
-        depot_index = manager.NodeToIndex(0)
-        time_dimension.CumulVar(depot_index).SetRange(0, 24 * 60 * 60)  # Depot available 24 hours
-        
-        # Add time window constraints for each location
-        for location_idx, location in enumerate(locations):
-            # Convert to routing index (add 1 to skip depot)
-            routing_idx = location_idx + 1
-            
-            if location.get('time_window_start') and location.get('time_window_end'):
-                try:
-                    # Convert string/time to datetime for calculations
-                    if isinstance(location['time_window_start'], str):
-                        start_time = datetime.strptime(location['time_window_start'], "%H:%M")
-                        end_time = datetime.strptime(location['time_window_end'], "%H:%M")
-                    else:
-                        # Assume it's a time object
-                        start_time = datetime.combine(datetime.today(), location['time_window_start'])
-                        end_time = datetime.combine(datetime.today(), location['time_window_end'])
-                    
-                    # Convert time to seconds from depot start time
-                    start_seconds = int((start_time - depot_start_time).total_seconds())
-                    end_seconds = int((end_time - depot_start_time).total_seconds())
-                    
-                    # Ensure start_seconds is non-negative
-                    start_seconds = max(0, start_seconds)
-                    
-                    # If end time is before start time (e.g., crosses midnight), add 24 hours
-                    if end_seconds < start_seconds:
-                        end_seconds += 24 * 60 * 60
-                    
-                    # Set time window for this location
-                    index = manager.NodeToIndex(routing_idx)
-                    time_dimension.CumulVar(index).SetRange(start_seconds, end_seconds)
-                    print(f"Setting time window for {location['name']}: {start_time.strftime('%H:%M')}-{end_time.strftime('%H:%M')}")
-                except Exception as e:
-                    print(f"Error setting time window for {location['name']}: {e}")
-    
-    # Add vehicle capacity constraints
-    def demand_callback(from_index):
-        """Returns the demand of the node."""
-        # The depot has no demand (0)
-        from_node = manager.IndexToNode(from_index)
-        return 1 if from_node > 0 else 0  # Each location has demand of 1 (simplification)
-    
-    demand_callback_index = routing.RegisterUnaryTransitCallback(demand_callback)
-    
-    routing.AddDimensionWithVehicleCapacity(
-        demand_callback_index,
-        0,  # null capacity slack
-        [vd.get('capacity', 100) for vd in vehicle_data],  # vehicle maximum capacities
-        True,  # start cumul to zero
-        'Capacity')
-    
-    # Apply clustering constraints if provided
-    if using_clusters:
-        # For each vehicle, only allow it to visit nodes in its cluster
-        for vehicle_id in range(vehicle_count):
-            # Get this vehicle's cluster
-            vehicle_cluster = clusters[vehicle_id]
-            
-            # For all nodes
-            for node_idx in range(len(distance_matrix)):
-                # Skip depot
-                if node_idx == 0:
-                    continue
-                    
-                # If this node is not in this vehicle's cluster, disallow it
-                if (node_idx not in vehicle_cluster) and vehicle_cluster:
-                    index = manager.NodeToIndex(node_idx)
-                    routing.VehicleVar(index).RemoveValue(vehicle_id)
-    
-    # Setting first solution heuristic
-    search_parameters = pywrapcp.DefaultRoutingSearchParameters()
-    search_parameters.first_solution_strategy = (
-        routing_enums_pb2.FirstSolutionStrategy.PATH_CHEAPEST_ARC)
-    
-    # Add metaheuristics for better solutions
-    search_parameters.local_search_metaheuristic = (
-        routing_enums_pb2.LocalSearchMetaheuristic.GUIDED_LOCAL_SEARCH)
-    search_parameters.time_limit.seconds = 30  # Increase time limit for better solutions
+    # Build the model: distance arc costs, and one precomputed time matrix per
+    # speed class shared by the vehicles of that class
+    vehicle_speeds = [vehicle_speed(vehicle_data[vehicle_id]) if vehicle_id < len(vehicle_data) else vehicle_speed({})
+                      for vehicle_id in range(vehicle_count)]
+    speed_classes = sorted(set(vehicle_speeds))
+    model = build_routing_model(
+        distance_matrix, vehicle_count,
+        speeds_kmh=speed_classes,
+        vehicle_time_classes=[speed_classes.index(speed) for speed in vehicle_speeds],
+        demands=[0] + [1] * (len(distance_matrix) - 1),  # Each location has demand of 1 (simplification)
+        vehicle_capacities=[vd.get('capacity', 100) for vd in vehicle_data],
+        max_distance=max_distance,
+        distance_span_cost=100,
+        locations=locations,
+        clusters=clusters if using_clusters else None)
+    routing, manager = model.routing, model.manager
     
     # Solve the problem
-    solution = routing.SolveWithParameters(search_parameters)
+    solution = model.solve(time_budget_ms=time_budget_ms, portfolio=portfolio)
+    if solve_trace is not None:
+        solve_trace.update(model.trace.to_dict())
     
     # Extract solution
     if solution:
         print("Solution found!")
+        dropped = model.dropped_locations(solution, locations)
+        if dropped:
+            print(f"Warning: {len(dropped)} locations could not be reached over neighbour arcs: "
+                  f"{[loc['id'] for loc in dropped]}")
+        if solve_trace is not None:
+            solve_trace['dropped_locations'] = dropped
         routes = []
         for vehicle_id in range(vehicle_count):
             # Get vehicle data
@@ -239,13 +128,11 @@ def optimize_routes(depot, locations, distance_matrix, vehicle_count=1, max_dist
                 
                 # Add distance between previous and current stops
                 if node_index != next_node_index:
-                    distance = distance_matrix[node_index][next_node_index]
+                    distance = float(distance_matrix[node_index][next_node_index])
                     route_distance += distance
                     
                     # Calculate time based on vehicle speed
-                    vehicle_type = v_data.get('type', 'van')
-                    speed = 35 if vehicle_type == 'truck' else 40 if vehicle_type == 'van' else 45  # car
-                    time_hours = distance / speed
+                    time_hours = distance / vehicle_speed(v_data)
                     route_time += time_hours
                 
                 # Move to next stop
@@ -400,13 +287,11 @@ def optimize_routes(depot, locations, distance_matrix, vehicle_count=1, max_dist
                             break
                 
                 # Add distance for this leg
-                leg_distance = distance_matrix[prev_idx][current_idx]
+                leg_distance = float(distance_matrix[prev_idx][current_idx])
                 total_distance += leg_distance
                 
                 # Calculate time based on vehicle speed
-                vehicle_type = v_data.get('type', 'van')
-                speed = 35 if vehicle_type == 'truck' else 40 if vehicle_type == 'van' else 45  # car
-                leg_time = leg_distance / speed
+                leg_time = leg_distance / vehicle_speed(v_data)
                 total_time += leg_time
                 
                 # Store leg details in the stop
@@ -498,13 +383,11 @@ def optimize_routes(depot, locations, distance_matrix, vehicle_count=1, max_dist
             
             # Add distance and time
             if from_idx < len(distance_matrix) and to_idx < len(distance_matrix):
-                distance = distance_matrix[from_idx][to_idx]
+                distance = float(distance_matrix[from_idx][to_idx])
                 total_distance += distance
                 
                 # Calculate time based on vehicle type
-                vehicle_type = v_data.get('type', 'van')
-                speed = 35 if vehicle_type == 'truck' else 40 if vehicle_type == 'van' else 45  # car
-                time = distance / speed
+                time = distance / vehicle_speed(v_data)
                 total_time += time
                 
                 # Add leg info to stop
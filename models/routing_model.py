@@ -0,0 +1,922 @@
+from concurrent.futures import ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+from datetime import datetime
+from functools import lru_cache, partial
+import os
+import threading
+import time
+import logging
+
+import numpy as np
+from ortools.constraint_solver import routing_enums_pb2
+from ortools.constraint_solver import pywrapcp
+
+from utils.distance_matrix import TILED_MATRIX_THRESHOLD
+
+# Set up logging
+logging.basicConfig(level=logging.INFO,
+                    format='%(asctime)s - %(name)s - %(levelname)s - %(message)s')
+logger = logging.getLogger(__name__)
+
+# Penalty for leaving a node unvisited when routing over a sparse neighbour graph
+SPARSE_DROP_PENALTY = 10**9
+
+# Waiting time allowed at a stop (seconds)
+MAX_WAITING_SECONDS = 60 * 60
+
+# Maximum duration of a route (seconds)
+MAX_ROUTE_SECONDS = 24 * 60 * 60
+
+# Start of the working day at the depot; time windows are measured from it
+DEPOT_START_TIME = "8:00"
+
+# Capacity of vehicles without capacity data
+DEFAULT_VEHICLE_CAPACITY = 100
+
+# Search time budget per delivery stop, and its bounds (seconds)
+TIME_BUDGET_SECONDS_PER_STOP = 0.05
+MIN_TIME_BUDGET_SECONDS = 1
+MAX_TIME_BUDGET_SECONDS = 120
+
+# The search stops once the best solution has not improved for this share of
+# the time budget (but at least PLATEAU_MIN_SECONDS)
+PLATEAU_FRACTION = 0.2
+PLATEAU_MIN_SECONDS = 0.5
+
+# Default search strategy: (first solution strategy, local search metaheuristic)
+DEFAULT_STRATEGY = ('PATH_CHEAPEST_ARC', 'GUIDED_LOCAL_SEARCH')
+
+# Strategies raced in portfolio mode; with fewer free worker processes than
+# strategies the default one and the others in turns are raced (see portfolio_strategies)
+PORTFOLIO_STRATEGIES = [
+    DEFAULT_STRATEGY,
+    ('SAVINGS', 'GUIDED_LOCAL_SEARCH'),
+    ('PARALLEL_CHEAPEST_INSERTION', 'GUIDED_LOCAL_SEARCH'),
+    ('CHRISTOFIDES', 'GUIDED_LOCAL_SEARCH'),
+    ('PATH_CHEAPEST_ARC', 'SIMULATED_ANNEALING'),
+    ('PATH_CHEAPEST_ARC', 'TABU_SEARCH')
+]
+
+# Processes of the pool shared by all portfolio searches of this process (one per CPU, at most one
+# per strategy by default); concurrent requests share them instead of forking their own
+PORTFOLIO_WORKERS = max(1, int(os.getenv('ROUTING_PORTFOLIO_WORKERS',
+                                         min(os.cpu_count() or 1, len(PORTFOLIO_STRATEGIES)))))
+
+# Rows of a matrix too large to precompute that are kept as integer transits (see register_transit_rows)
+TRANSIT_ROW_CACHE_SIZE = 512
+
+_portfolio_pool = None
+_portfolio_pool_lock = threading.Lock()
+_portfolio_busy = 0
+_portfolio_rotation = 0
+
+def portfolio_pool():
+    """Return the process pool shared by portfolio searches, creating it on first use."""
+    global _portfolio_pool
+    with _portfolio_pool_lock:
+        if _portfolio_pool is None:
+            _portfolio_pool = ProcessPoolExecutor(max_workers=PORTFOLIO_WORKERS)
+        return _portfolio_pool
+
+def discard_portfolio_pool(pool):
+    """Drop a broken shared pool so the next portfolio search starts a new one."""
+    global _portfolio_pool
+    with _portfolio_pool_lock:
+        if _portfolio_pool is pool:
+            _portfolio_pool = None
+    pool.shutdown(wait=False)
+
+def reserve_portfolio_workers(count):
+    """
+    Reserve up to count free processes of the shared pool.
+    
+    Returns:
+        int: Number of processes reserved (0 when all are busy), to release with release_portfolio_workers
+    """
+    global _portfolio_busy
+    with _portfolio_pool_lock:
+        reserved = max(0, min(count, PORTFOLIO_WORKERS - _portfolio_busy))
+        _portfolio_busy += reserved
+        return reserved
+
+def release_portfolio_workers(count):
+    """Release processes reserved with reserve_portfolio_workers."""
+    global _portfolio_busy
+    with _portfolio_pool_lock:
+        _portfolio_busy -= count
+
+def portfolio_strategies(count):
+    """
+    Choose the strategies to race on count workers.
+    
+    The default strategy is always raced; the other slots go to the
+    remaining strategies in turns, so that successive searches cover all
+    of PORTFOLIO_STRATEGIES.
+    
+    Args:
+        count (int): Number of strategies that can run at once
+    
+    Returns:
+        list: Strategies to race, the default strategy first
+    """
+    global _portfolio_rotation
+    if count >= len(PORTFOLIO_STRATEGIES):
+        return list(PORTFOLIO_STRATEGIES)
+    
+    others = [strategy for strategy in PORTFOLIO_STRATEGIES if strategy != DEFAULT_STRATEGY]
+    with _portfolio_pool_lock:
+        start = _portfolio_rotation
+        _portfolio_rotation = (start + count - 1) % len(others)
+    return [DEFAULT_STRATEGY] + [others[(start + k) % len(others)] for k in range(count - 1)]
+
+def restrict_to_neighbor_arcs(routing, manager, distance_matrix, vehicle_count):
+    """
+    Only offer the solver the arcs of a sparse neighbour graph.
+    
+    When distance_matrix is a KNNDistanceGraph (see utils.distance_matrix),
+    each delivery node may only be followed by one of its neighbours or by
+    the end of a route. The depot stays connected to every node. Nodes are
+    made optional with a penalty far above any route cost, so the first
+    solution heuristic cannot get stuck in a neighbourhood dead end; local
+    search then inserts them. For dense matrices this is a no-op.
+    
+    Args:
+        routing: OR-Tools RoutingModel
+        manager: OR-Tools RoutingIndexManager
+        distance_matrix: Dense matrix or KNNDistanceGraph (depot at node 0)
+        vehicle_count (int): Number of vehicles
+    """
+    if not hasattr(distance_matrix, 'neighbors'):
+        return
+    
+    end_indices = [routing.End(vehicle_id) for vehicle_id in range(vehicle_count)]
+    for node in range(1, len(distance_matrix)):
+        index = manager.NodeToIndex(node)
+        allowed = [manager.NodeToIndex(int(neighbor)) for neighbor in distance_matrix.neighbors(node) if neighbor != 0]
+        routing.NextVar(index).SetValues(allowed + end_indices + [index])
+        routing.AddDisjunction([index], SPARSE_DROP_PENALTY)
+
+def find_dropped_nodes(routing, manager, solution):
+    """Return the nodes left unvisited by a solution (only possible in sparse mode)."""
+    dropped = []
+    for index in range(routing.Size()):
+        if routing.IsStart(index) or routing.IsEnd(index):
+            continue
+        if solution.Value(routing.NextVar(index)) == index:
+            dropped.append(manager.IndexToNode(index))
+    return dropped
+
+def routing_index_nodes(routing, manager):
+    """Return the node of every routing index (including route ends) as a list."""
+    return [manager.IndexToNode(index) for index in range(routing.Size() + routing.vehicles())]
+
+def transit_values(matrix, scale=1):
+    """
+    Convert a node matrix into the integer transits OR-Tools works with.
+    
+    Values are scaled and truncated exactly like int(matrix[i][j] * scale).
+    
+    Args:
+        matrix: (n, n) nested list or ndarray indexed by node
+        scale (float): Factor applied before truncation (e.g. 1000 for km to m)
+    
+    Returns:
+        list: (n, n) nested list of ints
+    """
+    return scaled_transits(np.asarray(matrix), scale).tolist()
+
+def scaled_transits(values, scale=1):
+    """Scale and truncate an ndarray of transits to int64 (integer arrays at scale 1 are returned as is)."""
+    if scale != 1 or not np.issubdtype(values.dtype, np.integer):
+        values = (values.astype(np.float64) * scale).astype(np.int64)
+    return values
+
+def is_large_matrix(matrix):
+    """Whether a node matrix is disk-backed (a TiledDistanceMatrix) or too large to convert to nested lists."""
+    return hasattr(matrix, 'iter_rows') or len(matrix) > TILED_MATRIX_THRESHOLD
+
+def register_transit_rows(routing, manager, row_transits):
+    """
+    Register arc transits read from a matrix one row at a time.
+    
+    A row is converted to integers the first time the solver needs an arc
+    leaving its node, and the TRANSIT_ROW_CACHE_SIZE most recently used
+    rows are kept, so the matrix is never materialised.
+    
+    Args:
+        routing: OR-Tools RoutingModel
+        manager: OR-Tools RoutingIndexManager
+        row_transits (callable): row_transits(node) returns the integer
+            transits from node to every node as an ndarray
+    
+    Returns:
+        int: Transit callback index
+    """
+    nodes = routing_index_nodes(routing, manager)
+    row = lru_cache(maxsize=TRANSIT_ROW_CACHE_SIZE)(row_transits)
+    def row_callback(from_index, to_index):
+        return int(row(nodes[from_index])[nodes[to_index]])
+    return routing.RegisterTransitCallback(row_callback)
+
+def register_transit_matrix(routing, manager, matrix, scale=1):
+    """
+    Register arc transits precomputed from a node matrix.
+    
+    Dense matrices are converted to integers once and handed to OR-Tools
+    as a transit matrix, so the solver evaluates arcs in C++ without
+    calling back into Python. OR-Tools versions without RegisterTransitMatrix
+    get a callback reading the precomputed values. A KNNDistanceGraph is
+    too large to materialise and is looked up per arc; a TiledDistanceMatrix,
+    or any matrix above TILED_MATRIX_THRESHOLD nodes, is read row by row
+    (see register_transit_rows).
+    
+    Args:
+        routing: OR-Tools RoutingModel
+        manager: OR-Tools RoutingIndexManager
+        matrix: (n, n) nested list, ndarray, TiledDistanceMatrix or
+            KNNDistanceGraph indexed by node
+        scale (float): Factor applied before truncating to integers
+    
+    Returns:
+        int: Transit callback index
+    """
+    if hasattr(matrix, 'neighbors'):
+        nodes = routing_index_nodes(routing, manager)
+        def graph_callback(from_index, to_index):
+            return int(matrix.distance(nodes[from_index], nodes[to_index]) * scale)
+        return routing.RegisterTransitCallback(graph_callback)
+    
+    if is_large_matrix(matrix):
+        return register_transit_rows(routing, manager, partial(_transit_row, matrix, scale))
+    
+    values = transit_values(matrix, scale)
+    if hasattr(routing, 'RegisterTransitMatrix'):
+        return routing.RegisterTransitMatrix(values)
+    
+    nodes = routing_index_nodes(routing, manager)
+    def matrix_callback(from_index, to_index):
+        return values[nodes[from_index]][nodes[to_index]]
+    return routing.RegisterTransitCallback(matrix_callback)
+
+def register_demand_vector(routing, manager, demands):
+    """
+    Register per-node demands as a unary transit.
+    
+    Args:
+        routing: OR-Tools RoutingModel
+        manager: OR-Tools RoutingIndexManager
+        demands (list): Integer demand of each node
+    
+    Returns:
+        int: Unary transit callback index
+    """
+    demands = [int(demand) for demand in demands]
+    if hasattr(routing, 'RegisterUnaryTransitVector'):
+        return routing.RegisterUnaryTransitVector(demands)
+    
+    nodes = routing_index_nodes(routing, manager)
+    def demand_callback(from_index):
+        return demands[nodes[from_index]]
+    return routing.RegisterUnaryTransitCallback(demand_callback)
+
+def register_travel_time_matrix(routing, manager, distance_matrix, speed_kmh):
+    """
+    Register travel times in seconds at a constant speed.
+    
+    Times are truncated exactly like int((distance / speed_kmh) * 3600).
+    
+    Args:
+        routing: OR-Tools RoutingModel
+        manager: OR-Tools RoutingIndexManager
+        distance_matrix: (n, n) distances in km, a TiledDistanceMatrix or a KNNDistanceGraph
+        speed_kmh (float): Average speed
+    
+    Returns:
+        int: Transit callback index
+    """
+    if hasattr(distance_matrix, 'neighbors'):
+        nodes = routing_index_nodes(routing, manager)
+        def time_callback(from_index, to_index):
+            return int((distance_matrix.distance(nodes[from_index], nodes[to_index]) / speed_kmh) * 3600)
+        return routing.RegisterTransitCallback(time_callback)
+    
+    if is_large_matrix(distance_matrix):
+        return register_transit_rows(routing, manager, partial(_travel_time_row, distance_matrix, speed_kmh))
+    
+    return register_transit_matrix(routing, manager, np.asarray(distance_matrix, dtype=np.float64) / speed_kmh, 3600)
+
+def time_window_seconds(location, depot_start_time):
+    """
+    Convert a location's time window to seconds after the depot start time.
+    
+    Args:
+        location (dict): Location with 'time_window_start' and 'time_window_end'
+            as "HH:MM" strings or time objects
+        depot_start_time (datetime): Start of the working day
+    
+    Returns:
+        tuple: (start_seconds, end_seconds); windows crossing midnight end on the next day
+    """
+    # Convert string/time to datetime for calculations
+    if isinstance(location['time_window_start'], str):
+        start_time = datetime.strptime(location['time_window_start'], "%H:%M")
+        end_time = datetime.strptime(location['time_window_end'], "%H:%M")
+    else:
+        # Assume it's a time object
+        start_time = datetime.combine(datetime.today(), location['time_window_start'])
+        end_time = datetime.combine(datetime.today(), location['time_window_end'])
+    
+    # Convert time to seconds from depot start time
+    start_seconds = int((start_time - depot_start_time).total_seconds())
+    end_seconds = int((end_time - depot_start_time).total_seconds())
+    
+    # Ensure start_seconds is non-negative
+    start_seconds = max(0, start_seconds)
+    
+    # If end time is before start time (e.g., crosses midnight), add 24 hours
+    if end_seconds < start_seconds:
+        end_seconds += 24 * 60 * 60
+    
+    return start_seconds, end_seconds
+
+def default_time_budget(stop_count):
+    """
+    Search time budget for a problem size.
+    
+    Args:
+        stop_count (int): Number of delivery stops
+    
+    Returns:
+        float: Seconds, TIME_BUDGET_SECONDS_PER_STOP per stop within
+            [MIN_TIME_BUDGET_SECONDS, MAX_TIME_BUDGET_SECONDS]
+    """
+    return min(MAX_TIME_BUDGET_SECONDS, max(MIN_TIME_BUDGET_SECONDS, TIME_BUDGET_SECONDS_PER_STOP * stop_count))
+
+def strategy_name(strategy):
+    """Readable name of a (first solution strategy, metaheuristic) pair, e.g. 'savings+guided_local_search'."""
+    return '+'.join(part.lower() for part in strategy)
+
+def routing_search_parameters(time_limit_seconds=MAX_TIME_BUDGET_SECONDS, strategy=DEFAULT_STRATEGY):
+    """
+    Search parameters used by the route optimizers.
+    
+    Args:
+        time_limit_seconds (float): Search time limit
+        strategy (tuple): Names of the FirstSolutionStrategy and LocalSearchMetaheuristic
+    """
+    first_solution_strategy, local_search_metaheuristic = strategy
+    search_parameters = pywrapcp.DefaultRoutingSearchParameters()
+    search_parameters.first_solution_strategy = (
+        getattr(routing_enums_pb2.FirstSolutionStrategy, first_solution_strategy))
+    
+    # Add metaheuristics for better solutions
+    search_parameters.local_search_metaheuristic = (
+        getattr(routing_enums_pb2.LocalSearchMetaheuristic, local_search_metaheuristic))
+    search_parameters.time_limit.FromMilliseconds(int(time_limit_seconds * 1000))
+    return search_parameters
+
+
+class SolveTrace:
+    """
+    Trace of a routing search that also stops it on a plateau.
+    
+    Registered as an at-solution callback, so it runs whenever the search
+    accepts a solution: every improvement of the objective is recorded with
+    the time since the search started, and once the best objective has not
+    improved for plateau_seconds the search is cancelled and the best
+    solution so far is returned.
+    """
+    def __init__(self, routing, time_budget_seconds, plateau_seconds, strategy=DEFAULT_STRATEGY):
+        """
+        Attach the trace to a routing model.
+        
+        Args:
+            routing: OR-Tools RoutingModel
+            time_budget_seconds (float): Time limit of the search
+            plateau_seconds (float): Time without improvement after which the search stops
+            strategy (tuple): Search strategy, recorded in the trace
+        """
+        self.routing = routing
+        self.strategy = strategy
+        self.time_budget_seconds = time_budget_seconds
+        self.plateau_seconds = plateau_seconds
+        self.improvements = []
+        self.solutions = 0
+        self.elapsed_seconds = None
+        self.stop_reason = None
+        self._started = None
+        self._best = None
+        self._last_improvement = None
+        
+        routing.AddAtSolutionCallback(self._on_solution)
+        if not hasattr(routing, 'CancelSearch'):
+            # Older OR-Tools: stop through a search limit instead
+            self._limit = routing.solver().CustomLimit(lambda: self.stop_reason == 'plateau')
+            routing.AddSearchMonitor(self._limit)
+    
+    def start(self):
+        """Mark the start of the search."""
+        self._started = time.perf_counter()
+    
+    def finish(self, solution):
+        """Record the end of the search and why it stopped."""
+        self.elapsed_seconds = time.perf_counter() - self._started
+        if self.stop_reason is None:
+            if solution is None:
+                self.stop_reason = 'no_solution'
+            elif self.elapsed_seconds >= self.time_budget_seconds * 0.99:
+                self.stop_reason = 'time_limit'
+            else:
+                self.stop_reason = 'completed'
+    
+    def to_dict(self):
+        """JSON-serializable summary of the search."""
+        return {
+            'strategy': strategy_name(self.strategy),
+            'time_budget_ms': round(self.time_budget_seconds * 1000),
+            'plateau_ms': round(self.plateau_seconds * 1000),
+            'elapsed_ms': round(self.elapsed_seconds * 1000, 1) if self.elapsed_seconds is not None else None,
+            'stop_reason': self.stop_reason,
+            'solutions': self.solutions,
+            'objective': self._best,
+            'improvements': self.improvements
+        }
+    
+    def _on_solution(self):
+        now = time.perf_counter()
+        self.solutions += 1
+        objective = self.routing.CostVar().Value()
+        if self._best is None or objective < self._best:
+            self._best = objective
+            self._last_improvement = now
+            self.improvements.append({
+                'elapsed_ms': round((now - self._started) * 1000, 1),
+                'objective': objective
+            })
+        elif self.stop_reason is None and now - self._last_improvement >= self.plateau_seconds:
+            self.stop_reason = 'plateau'
+            if hasattr(self.routing, 'CancelSearch'):
+                self.routing.CancelSearch()
+
+
+class PortfolioTrace:
+    """Trace of a portfolio search: the winning strategy's trace and a summary of all strategies."""
+    def __init__(self, winner_trace, strategies, time_budget_seconds):
+        self.winner_trace = winner_trace
+        self.strategies = strategies
+        self.time_budget_seconds = time_budget_seconds
+    
+    def to_dict(self):
+        """JSON-serializable summary of the search."""
+        trace = dict(self.winner_trace or {
+            'strategy': None,
+            'time_budget_ms': round(self.time_budget_seconds * 1000),
+            'stop_reason': 'no_solution',
+            'objective': None
+        })
+        trace['portfolio'] = self.strategies
+        return trace
+
+
+class DeliveryRoutingModel:
+    """
+    OR-Tools routing model of a single-depot delivery problem.
+    
+    Wraps the index manager and routing model and provides the building
+    blocks the route optimizers share: transit matrix registration, arc
+    costs and dimensions given either one transit for all vehicles or one
+    per vehicle, time windows, capacities and cluster restrictions. Use
+    build_routing_model to create a complete model.
+    """
+    def __init__(self, distance_matrix, vehicle_count):
+        """
+        Create the manager and routing model.
+        
+        With a sparse neighbour graph the solver is only offered neighbour arcs
+        (see restrict_to_neighbor_arcs).
+        
+        Args:
+            distance_matrix: (n, n) distances in km with the depot at node 0,
+                or a KNNDistanceGraph
+            vehicle_count (int): Number of vehicles
+        """
+        self.distance_matrix = distance_matrix
+        self.vehicle_count = vehicle_count
+        self.manager = pywrapcp.RoutingIndexManager(len(distance_matrix), vehicle_count, 0)  # 0 is the depot index
+        self.routing = pywrapcp.RoutingModel(self.manager)
+        restrict_to_neighbor_arcs(self.routing, self.manager, distance_matrix, vehicle_count)
+        
+        # Distance transit in meters, and time transit in seconds of each vehicle
+        self.distance_transit = self.register_matrix(distance_matrix, 1000)
+        self.time_transits = None
+        
+        # Trace of the last search (see solve)
+        self.trace = None
+        
+        # Arguments build_routing_model was called with, to rebuild the model in other processes
+        self.build_arguments = None
+    
+    @property
+    def node_count(self):
+        return len(self.distance_matrix)
+    
+    def register_matrix(self, matrix, scale=1):
+        """Register a node matrix as a transit (see register_transit_matrix) and return its index."""
+        return register_transit_matrix(self.routing, self.manager, matrix, scale)
+    
+    def set_arc_costs(self, transits):
+        """
+        Set the arc cost evaluators.
+        
+        Args:
+            transits: One transit index for all vehicles, or a list with one per vehicle
+        """
+        if isinstance(transits, int) or len(set(transits)) == 1:
+            self.routing.SetArcCostEvaluatorOfAllVehicles(transits if isinstance(transits, int) else transits[0])
+            return
+        for vehicle_id, transit in enumerate(transits):
+            self.routing.SetArcCostEvaluatorOfVehicle(transit, vehicle_id)
+    
+    def add_dimension(self, name, transits, slack, capacity, fix_start_cumul_to_zero):
+        """
+        Add a dimension accumulating transits along each route.
+        
+        Args:
+            name (str): Dimension name
+            transits: One transit index for all vehicles, or a list with one per vehicle
+            slack (int): Maximum slack per node
+            capacity (int): Maximum cumul of each vehicle
+            fix_start_cumul_to_zero (bool): Whether routes start at zero
+        
+        Returns:
+            RoutingDimension: The new dimension
+        """
+        if isinstance(transits, int) or len(set(transits)) == 1:
+            self.routing.AddDimension(transits if isinstance(transits, int) else transits[0],
+                                      slack, capacity, fix_start_cumul_to_zero, name)
+        else:
+            self.routing.AddDimensionWithVehicleTransits(list(transits), slack, capacity,
+                                                         fix_start_cumul_to_zero, name)
+        return self.routing.GetDimensionOrDie(name)
+    
+    def add_time_windows(self, locations, depot_start_time=DEPOT_START_TIME):
+        """
+        Constrain arrival times at the locations that have a time window.
+        
+        Args:
+            locations (list): Delivery locations, location i at node i + 1
+            depot_start_time (str): "HH:MM" start of the working day
+        """
+        if not any(loc.get('time_window_start') for loc in locations):
+            return
+        
+        time_dimension = self.routing.GetDimensionOrDie('Time')
+        start = datetime.strptime(depot_start_time, "%H:%M")
+        
+        # Depot available 24 hours
+        time_dimension.CumulVar(self.manager.NodeToIndex(0)).SetRange(0, MAX_ROUTE_SECONDS)
+        
+        for location_idx, location in enumerate(locations):
+            if not (location.get('time_window_start') and location.get('time_window_end')):
+                continue
+            try:
+                start_seconds, end_seconds = time_window_seconds(location, start)
+                # Convert to routing index (add 1 to skip depot)
+                index = self.manager.NodeToIndex(location_idx + 1)
+                time_dimension.CumulVar(index).SetRange(start_seconds, end_seconds)
+                logger.info(f"Time window for {location['name']}: "
+                            f"{location['time_window_start']}-{location['time_window_end']}")
+            except Exception as e:
+                logger.error(f"Error setting time window for {location['name']}: {e}")
+    
+    def add_capacity(self, demands, vehicle_capacities):
+        """
+        Add a Capacity dimension.
+        
+        Args:
+            demands (list): Integer demand of each node
+            vehicle_capacities (list): Capacity of each vehicle; missing entries
+                get DEFAULT_VEHICLE_CAPACITY
+        """
+        capacities = list(vehicle_capacities)[:self.vehicle_count]
+        capacities += [DEFAULT_VEHICLE_CAPACITY] * (self.vehicle_count - len(capacities))
+        
+        self.routing.AddDimensionWithVehicleCapacity(
+            register_demand_vector(self.routing, self.manager, demands),
+            0,  # null capacity slack
+            capacities,  # vehicle maximum capacities
+            True,  # start cumul to zero
+            'Capacity')
+    
+    def restrict_to_clusters(self, clusters):
+        """
+        Only allow each vehicle to visit the nodes of its cluster.
+        
+        Args:
+            clusters (list): Node indices per vehicle; an empty cluster allows every node
+        """
+        for vehicle_id, vehicle_cluster in enumerate(clusters[:self.vehicle_count]):
+            if not vehicle_cluster:
+                continue
+            allowed = set(vehicle_cluster)
+            for node in range(1, self.node_count):  # Skip depot
+                if node not in allowed:
+                    self.routing.VehicleVar(self.manager.NodeToIndex(node)).RemoveValue(vehicle_id)
+    
+    def solve(self, search_parameters=None, time_budget_ms=None, strategy=DEFAULT_STRATEGY, portfolio=False):
+        """
+        Solve the model within a time budget.
+        
+        The search stops at the time budget, or earlier once the best
+        solution has not improved for PLATEAU_FRACTION of it. The trace of
+        the search is kept in self.trace.
+        
+        Args:
+            search_parameters (optional): OR-Tools search parameters, defaults
+                to routing_search_parameters() with the given strategy; their
+                time limit is replaced by the budget
+            time_budget_ms (float, optional): Caller override of the time budget,
+                which otherwise scales with the number of stops (see default_time_budget)
+            strategy (tuple): Search strategy, see PORTFOLIO_STRATEGIES
+            portfolio (bool): Race several strategies in parallel (see solve_portfolio)
+        
+        Returns:
+            Assignment: The solution, or None if none was found
+        """
+        if time_budget_ms:
+            time_budget = time_budget_ms / 1000
+        else:
+            time_budget = default_time_budget(self.node_count - 1)
+        
+        if portfolio:
+            return self.solve_portfolio(time_budget)
+        
+        if search_parameters is None:
+            search_parameters = routing_search_parameters(time_budget, strategy)
+        else:
+            search_parameters.time_limit.FromMilliseconds(int(time_budget * 1000))
+        
+        self.trace = SolveTrace(self.routing, time_budget, max(PLATEAU_MIN_SECONDS, PLATEAU_FRACTION * time_budget),
+                                strategy)
+        self.trace.start()
+        solution = self.routing.SolveWithParameters(search_parameters)
+        self.trace.finish(solution)
+        
+        logger.info(f"Search stopped ({self.trace.stop_reason}) after {self.trace.elapsed_seconds:.2f}s "
+                    f"of a {time_budget:.2f}s budget")
+        return solution
+    
+    def solve_portfolio(self, time_budget, pool=None, workers=None):
+        """
+        Race several search strategies and keep the best solution.
+        
+        Only as many strategies as there are free workers are raced, so
+        none of them waits for a worker while the deadline runs out: the
+        default strategy and, in turns across searches, the others (see
+        portfolio_strategies); the remaining strategies are reported as
+        skipped. Every raced strategy rebuilds the model in a worker process
+        (OR-Tools models cannot be shared between processes) and searches
+        until the common deadline, or until it reaches a plateau. With a
+        single free worker the default strategy is solved in this process.
+        The winning routes are loaded into this model. self.trace is the
+        winner's trace with the winning strategy and a summary of every
+        strategy.
+        
+        Args:
+            time_budget (float): Seconds until the common deadline
+            pool (ProcessPoolExecutor, optional): Pool to run the strategies
+                in, defaults to the shared pool (see portfolio_pool)
+            workers (int, optional): Processes of pool, defaults to one per
+                strategy; the free processes of the shared pool are reserved
+                for the search
+        
+        Returns:
+            Assignment: The best solution, or None if no strategy found one
+        """
+        shared = pool is None
+        if shared:
+            workers = reserve_portfolio_workers(len(PORTFOLIO_STRATEGIES))
+        else:
+            workers = min(workers or len(PORTFOLIO_STRATEGIES), len(PORTFOLIO_STRATEGIES))
+        
+        try:
+            return self._race_strategies(time_budget, portfolio_strategies(max(1, workers)), workers, pool, shared)
+        finally:
+            if shared:
+                release_portfolio_workers(workers)
+    
+    def _race_strategies(self, time_budget, strategies, workers, pool, shared):
+        """Solve with each strategy until the deadline and keep the best solution (see solve_portfolio)."""
+        skipped = [strategy_name(strategy) for strategy in PORTFOLIO_STRATEGIES if strategy not in strategies]
+        if skipped:
+            logger.info(f"Portfolio races {len(strategies)} of {len(PORTFOLIO_STRATEGIES)} strategies "
+                        f"({workers} free workers), skipping {', '.join(skipped)}")
+        
+        deadline = time.time() + time_budget
+        results = []
+        solution = None
+        if workers <= 1:
+            # No second worker to race against, solve in this process
+            solution = self.solve(time_budget_ms=time_budget * 1000, strategy=strategies[0])
+            results.append({'objective': solution.ObjectiveValue() if solution else None, 'routes': None,
+                            'trace': self.trace.to_dict()})
+        else:
+            if shared:
+                pool = portfolio_pool()
+            try:
+                futures = [pool.submit(_solve_strategy, self.build_arguments, strategy, deadline)
+                           for strategy in strategies]
+            except BrokenProcessPool as e:
+                logger.error(f"Portfolio pool is broken, restarting it: {e}")
+                if shared:
+                    discard_portfolio_pool(pool)
+                futures = []
+            for strategy, future in zip(strategies, futures):
+                try:
+                    results.append(future.result())
+                except BrokenProcessPool as e:
+                    logger.error(f"Portfolio strategy {strategy_name(strategy)} failed: {e}")
+                    if shared:
+                        discard_portfolio_pool(pool)
+                except Exception as e:
+                    logger.error(f"Portfolio strategy {strategy_name(strategy)} failed: {e}")
+        
+        not_started = [result['trace']['strategy'] for result in results
+                       if result['trace']['stop_reason'] == 'not_started']
+        if not_started:
+            logger.warning(f"Portfolio strategies not started before the deadline, all pool workers were busy: "
+                           f"{', '.join(not_started)}")
+        
+        solved = [result for result in results if result['objective'] is not None]
+        summary = [{'strategy': result['trace']['strategy'], 'objective': result['objective'],
+                    'stop_reason': result['trace']['stop_reason'], 'elapsed_ms': result['trace']['elapsed_ms']}
+                   for result in results]
+        summary += [{'strategy': name, 'objective': None, 'stop_reason': 'skipped', 'elapsed_ms': None}
+                    for name in skipped]
+        
+        if not solved:
+            self.trace = PortfolioTrace(None, summary, time_budget)
+            return None
+        
+        winner = min(solved, key=lambda result: result['objective'])
+        self.trace = PortfolioTrace(winner['trace'], summary, time_budget)
+        logger.info(f"Portfolio winner for {self.node_count - 1} stops: {winner['trace']['strategy']} "
+                    f"(objective {winner['objective']}, {len(solved)}/{len(strategies)} strategies solved)")
+        
+        if winner['routes'] is None:
+            return solution
+        return self.routing.ReadAssignmentFromRoutes(winner['routes'], True)
+    
+    def route_indices(self, solution):
+        """Routing indices visited by each vehicle, without the start and end."""
+        routes = []
+        for vehicle_id in range(self.vehicle_count):
+            route = []
+            index = solution.Value(self.routing.NextVar(self.routing.Start(vehicle_id)))
+            while not self.routing.IsEnd(index):
+                route.append(index)
+                index = solution.Value(self.routing.NextVar(index))
+            routes.append(route)
+        return routes
+    
+    def dropped_nodes(self, solution):
+        """Nodes left unvisited by a solution (only possible in sparse mode)."""
+        return find_dropped_nodes(self.routing, self.manager, solution)
+    
+    def dropped_locations(self, solution, locations):
+        """
+        Delivery locations left unvisited by a solution (only possible in sparse mode).
+        
+        Args:
+            solution: Assignment returned by solve
+            locations (list): Delivery locations, location i at node i + 1
+        
+        Returns:
+            list: id, name, latitude and longitude of each dropped location
+        """
+        return [{key: locations[node - 1].get(key) for key in ('id', 'name', 'latitude', 'longitude')}
+                for node in self.dropped_nodes(solution)]
+
+
+def minimize_distance(model):
+    """Default objective: total distance driven."""
+    model.set_arc_costs(model.distance_transit)
+
+def build_routing_model(distance_matrix, vehicle_count, time_matrices=None, speeds_kmh=None,
+                        vehicle_time_classes=None, demands=None, vehicle_capacities=None,
+                        max_distance=None, distance_span_cost=0, locations=None, clusters=None,
+                        objective=minimize_distance):
+    """
+    Build the routing model shared by the route optimizers.
+    
+    Travel times are given per time class (e.g. per vehicle speed or
+    traffic scenario) and every vehicle accumulates the times of its
+    class in the Time dimension. All transits are registered as
+    precomputed matrices.
+    
+    Args:
+        distance_matrix: (n, n) distances in km with the depot at node 0, or a KNNDistanceGraph
+        vehicle_count (int): Number of vehicles
+        time_matrices (list, optional): One (n, n) travel time matrix in hours per time class
+        speeds_kmh (list, optional): Instead of time_matrices, one average speed
+            per time class; times are derived from distance_matrix
+        vehicle_time_classes (list, optional): Time class of each vehicle, class 0 by default
+        demands (list, optional): Integer demand of each node; adds a Capacity dimension
+        vehicle_capacities (list, optional): Capacity of each vehicle
+        max_distance (float, optional): Maximum distance per vehicle in km; adds a Distance dimension
+        distance_span_cost (int): Global span cost coefficient of the Distance dimension
+        locations (list, optional): Delivery locations (location i at node i + 1)
+            whose time windows are applied
+        clusters (list, optional): Nodes each vehicle may visit
+        objective (callable): objective(model) sets the arc costs and adds any
+            objective-specific dimensions; minimizes distance by default. Must be
+            picklable (a module-level function or functools.partial) for portfolio mode
+    
+    Returns:
+        DeliveryRoutingModel: Model ready to solve
+    """
+    model = DeliveryRoutingModel(distance_matrix, vehicle_count)
+    model.build_arguments = {
+        'distance_matrix': distance_matrix, 'vehicle_count': vehicle_count, 'time_matrices': time_matrices,
+        'speeds_kmh': speeds_kmh, 'vehicle_time_classes': vehicle_time_classes, 'demands': demands,
+        'vehicle_capacities': vehicle_capacities, 'max_distance': max_distance,
+        'distance_span_cost': distance_span_cost, 'locations': locations, 'clusters': clusters,
+        'objective': objective
+    }
+    
+    # One time transit per class, shared by the vehicles of that class
+    if time_matrices is not None:
+        class_transits = [model.register_matrix(times, 3600) for times in time_matrices]  # Hours to seconds
+    else:
+        class_transits = [register_travel_time_matrix(model.routing, model.manager, distance_matrix, speed)
+                          for speed in speeds_kmh]
+    model.time_transits = [class_transits[time_class] for time_class in (vehicle_time_classes or [0] * vehicle_count)]
+    
+    objective(model)
+    
+    if max_distance:
+        distance_dimension = model.add_dimension(
+            'Distance',
+            model.distance_transit,
+            0,  # no slack
+            int(max_distance * 1000),  # vehicle maximum travel distance in meters
+            True)  # start cumul to zero
+        if distance_span_cost:
+            distance_dimension.SetGlobalSpanCostCoefficient(distance_span_cost)
+    
+    model.add_dimension(
+        'Time',
+        model.time_transits,
+        MAX_WAITING_SECONDS,  # Allow waiting time at stops
+        MAX_ROUTE_SECONDS,  # Maximum time per vehicle
+        False)  # Don't force start cumul to zero
+    
+    if locations:
+        model.add_time_windows(locations)
+    
+    if demands is not None:
+        model.add_capacity(demands, vehicle_capacities or [])
+    
+    if clusters:
+        model.restrict_to_clusters(clusters)
+    
+    return model
+
+def _transit_row(matrix, scale, node):
+    """Integer transits of one matrix row, truncated like transit_values."""
+    return scaled_transits(np.asarray(matrix[node]), scale)
+
+def _travel_time_row(distance_matrix, speed_kmh, node):
+    """Travel times in seconds of one distance matrix row, truncated like register_travel_time_matrix."""
+    return scaled_transits(np.asarray(distance_matrix[node], dtype=np.float64) / speed_kmh, 3600)
+
+def _solve_strategy(build_arguments, strategy, deadline):
+    """
+    Build the model and solve it with one strategy (runs in a portfolio worker process).
+    
+    Returns:
+        dict: objective (None without a solution), routes as routing indices per vehicle, and the trace
+    """
+    if deadline <= time.time():
+        # Queued in a pool with fewer workers than strategies until the deadline, the model isn't built
+        return {
+            'objective': None,
+            'routes': None,
+            'trace': {'strategy': strategy_name(strategy), 'time_budget_ms': 0, 'plateau_ms': 0, 'elapsed_ms': None,
+                      'stop_reason': 'not_started', 'solutions': 0, 'objective': None, 'improvements': []}
+        }
+    
+    model = build_routing_model(**build_arguments)
+    remaining = deadline - time.time()
+    solution = None
+    if remaining > 0:
+        solution = model.solve(time_budget_ms=remaining * 1000, strategy=strategy)
+    else:
+        model.trace = SolveTrace(model.routing, 0, 0, strategy)
+        model.trace.stop_reason = 'time_limit'
+    
+    return {
+        'objective': solution.ObjectiveValue() if solution else None,
+        'routes': model.route_indices(solution) if solution else None,
+        'trace': model.trace.to_dict()
+    }
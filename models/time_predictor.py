@@ -6,22 +6,74 @@ import pickle
 import os
 from pathlib import Path
 
+from models.model_registry import atomic_dump, model_registry
+
+# Day names accepted for day_of_week (0=Monday, 6=Sunday)
+DAY_INDEX = {"monday": 0, "tuesday": 1, "wednesday": 2, "thursday": 3,
+             "friday": 4, "saturday": 5, "sunday": 6}
+
+# Rows passed to model.predict at once when predicting a matrix
+PREDICT_BLOCK_ROWS = 1 << 18
+
+# Largest (distance interval x time bucket) table used to group matrix predictions
+GROUP_TABLE_LIMIT = 1 << 24
+
+# Distance bins of the travel time lookup table
+LOOKUP_DISTANCE_BINS = 512
+
+# Distance range (km) of the lookup table for models that don't split on distance
+LOOKUP_MAX_DISTANCE_KM = 200.0
+
+# Default limit of each lookup table accuracy metric (relative errors, or minutes)
+LOOKUP_ERROR_LIMITS = {
+    'mean_relative_error': 0.02,
+    'p95_relative_error': 0.05,
+    'max_relative_error': 0.25,
+    'p95_error_minutes': 5.0,
+    'max_error_minutes': 15.0
+}
+
+# Accuracy metric (vs. the model) that gates the lookup table; the mean hides a few trips that are far off
+LOOKUP_ERROR_METRIC = os.getenv('TRAVEL_TIME_LOOKUP_ERROR_METRIC', 'p95_relative_error')
+
+# Largest value of LOOKUP_ERROR_METRIC at which the lookup table answers queries
+LOOKUP_MAX_ERROR = float(os.getenv('TRAVEL_TIME_LOOKUP_MAX_ERROR', LOOKUP_ERROR_LIMITS.get(LOOKUP_ERROR_METRIC, 0)))
+
+# Random queries compared with the model to measure the lookup table's accuracy
+LOOKUP_ACCURACY_SAMPLES = 20000
+
 class TravelTimePredictor:
-    def __init__(self, model_path=None):
+    def __init__(self, model_path=None, lookup_max_error=None, lookup_error_metric=None):
         """
         Initialize the travel time prediction model.
         
         Args:
             model_path (str, optional): Path to saved model file
+            lookup_max_error (float, optional): Largest error of the lookup
+                table at which predict_matrix uses it (defaults to
+                LOOKUP_MAX_ERROR, set with TRAVEL_TIME_LOOKUP_MAX_ERROR, or the
+                metric's default limit when only the metric is given)
+            lookup_error_metric (str, optional): Accuracy metric compared with
+                lookup_max_error, one of LOOKUP_ERROR_LIMITS (defaults to
+                LOOKUP_ERROR_METRIC, set with TRAVEL_TIME_LOOKUP_ERROR_METRIC)
+        
+        Raises:
+            ValueError: If the metric is unknown
         """
         self.model = None
         self.model_path = model_path or 'models/time_prediction_model.pkl'
+        self.lookup_error_metric = lookup_error_metric or LOOKUP_ERROR_METRIC
+        if self.lookup_error_metric not in LOOKUP_ERROR_LIMITS:
+            raise ValueError(f"Unknown lookup table error metric: {self.lookup_error_metric}, "
+                             f"expected one of {', '.join(LOOKUP_ERROR_LIMITS)}")
+        if lookup_max_error is None:
+            lookup_max_error = LOOKUP_ERROR_LIMITS[self.lookup_error_metric] if lookup_error_metric \
+                else LOOKUP_MAX_ERROR
+        self.lookup_max_error = lookup_max_error
         
-        # Try to load existing model
+        # Try to load existing model (deserialized once per process, see models.model_registry)
         try:
-            if os.path.exists(self.model_path):
-                with open(self.model_path, 'rb') as f:
-                    self.model = pickle.load(f)
+            self.model = model_registry.get(self.model_path, load_time_model)
         except Exception as e:
             print(f"Error loading model: {e}")
     
@@ -81,9 +133,11 @@ class TravelTimePredictor:
         self.model.fit(features, time_data)
         
         # Save the model
-        os.makedirs(os.path.dirname(self.model_path), exist_ok=True)
-        with open(self.model_path, 'wb') as f:
-            pickle.dump(self.model, f)
+        atomic_dump(self.model_path, lambda f: pickle.dump(self.model, f))
+        model_registry.store(self.model_path, load_time_model, self.model)
+    
+        # Precompute the lookup table now rather than on the first query
+        model_registry.store(self.model_path, load_time_lookup_table, build_lookup_table(self.model))
     
     def predict(self, distances, time_of_day=None, day_of_week=None):
         """
@@ -97,123 +151,590 @@ class TravelTimePredictor:
         Returns:
             list: Predicted travel times
         """
+        distances = np.asarray(distances, dtype=np.float64)
+        
         if self.model is None:
             # If no model is trained, estimate based on average speed of 30 km/h
-            return [d / 30 for d in distances]
+            return (distances / 30).tolist()
         
         # Prepare features
-        features = np.array(distances).reshape(-1, 1)
+        features = np.column_stack([distances] + _time_features(time_of_day, day_of_week))
         
-        # Add time of day if provided
-        if time_of_day is not None:
-            # Convert time string to hour of day (float)
-            hour_data = []
-            for t in time_of_day:
-                if isinstance(t, str):
-                    parts = t.split(':')
-                    hour_data.append(float(parts[0]) + float(parts[1])/60)
-                elif isinstance(t, datetime.time):
-                    hour_data.append(t.hour + t.minute/60)
-                else:
-                    hour_data.append(12.0)  # Default to noon
+        # Predict travel times
+        predicted_times = self.model.predict(features)
+        
+        # Ensure predictions are reasonable (at least 5 min for any distance)
+        return np.maximum(predicted_times, distances / 60).tolist()
+    
+    def predict_matrix(self, distance_matrix, time_of_day=None, day_of_week=None, dtype=np.float64,
+                       use_lookup=None):
+        """
+        Predict a travel time matrix from a distance matrix.
+        
+        If the model's lookup table is accurate enough (its
+        lookup_error_metric at most lookup_max_error), trips are answered by interpolating in
+        the table. Otherwise features are built once per origin and
+        broadcast over the matrix; for tree ensembles, trips whose distances
+        fall between the same split thresholds and whose origins share a
+        time bucket get the same prediction, so the model is only evaluated
+        once per such group.
+        
+        Args:
+            distance_matrix (array-like): (n, n) distances in km
+            time_of_day (str, time or list, optional): Time of day for all
+                trips, or a list with one per origin (row)
+            day_of_week (str, int, date or list, optional): Day of week for
+                all trips, or a list with one per origin (row)
+            dtype: dtype of the returned matrix (e.g. np.float32)
+            use_lookup (bool, optional): Force (True) or disable (False) the
+                lookup table; by default it is used when accurate enough
+        
+        Returns:
+            ndarray: (n, n) travel times in hours, with a zero diagonal
+        """
+        distance_matrix = np.asarray(distance_matrix, dtype=np.float64)
+        n = len(distance_matrix)
+        
+        # Off-diagonal trips, row by row
+        off_diagonal = ~np.eye(n, dtype=bool)
+        distances = distance_matrix[off_diagonal]
+        origins = np.repeat(np.arange(n), max(n - 1, 0))
+        
+        if self.model is None:
+            # If no model is trained, estimate based on average speed of 30 km/h
+            times = distances / 30
+        else:
+            now = datetime.datetime.now()
+            hours = days = None
+            if time_of_day is not None:
+                hours = _time_values(_origin_values(time_of_day, n, (str, datetime.time), now.strftime("%H:%M")),
+                                     _hour_of_day)
+            if day_of_week is not None:
+                days = _time_values(_origin_values(day_of_week, n, (str, int, datetime.date), now.weekday()),
+                                    _day_of_week)
             
-            # Create sin and cos features
-            hour_sin = np.sin(2 * np.pi * np.array(hour_data) / 24)
-            hour_cos = np.cos(2 * np.pi * np.array(hour_data) / 24)
-            features = np.column_stack((features, hour_sin.reshape(-1, 1), hour_cos.reshape(-1, 1)))
+            origin_features = np.column_stack([np.empty((n, 0))] + _cyclical_features(hours, days))
+            
+            table = self.lookup_table() if use_lookup is not False else None
+            if table is not None and (use_lookup or self._lookup_accurate(table)) \
+                    and table.accepts(hours is not None, days is not None):
+                times = table.interpolate(table.curves(hours, days), distances, origins)
+                
+                # Distances beyond the table's range go to the model
+                outside = np.isnan(times)
+                if outside.any():
+                    times[outside] = self._predict_trips(distances[outside], origins[outside], origin_features)
+            else:
+                times = self._predict_trips(distances, origins, origin_features)
+            
+            # Ensure predictions are reasonable (at least 5 min for any distance)
+            times = np.maximum(times, distances / 60)
         
-        # Add day of week if provided
-        if day_of_week is not None:
-            # Convert day to numeric (0=Monday, 6=Sunday)
-            day_data = []
-            for d in day_of_week:
-                if isinstance(d, int) and 0 <= d <= 6:
-                    day_data.append(d)
-                elif isinstance(d, str):
-                    try:
-                        day_data.append({"monday": 0, "tuesday": 1, "wednesday": 2, 
-                                         "thursday": 3, "friday": 4, "saturday": 5, 
-                                         "sunday": 6}[d.lower()])
-                    except KeyError:
-                        day_data.append(0)  # Default to Monday
-                elif isinstance(d, datetime.date):
-                    day_data.append(d.weekday())
-                else:
-                    day_data.append(0)  # Default to Monday
+        time_matrix = np.zeros((n, n), dtype=dtype)
+        time_matrix[off_diagonal] = times
+        return time_matrix
+    
+    def lookup_table(self, build=True):
+        """
+        Get the lookup table of the current model, building it on first use
+        (cached per model file by the model registry).
+        
+        Args:
+            build (bool): Build the table if this process hasn't yet
+        
+        Returns:
+            TravelTimeLookupTable or None: None if there is no model, the
+                table can't be built, or it isn't built and build is False
+        """
+        if self.model is None:
+            return None
+        try:
+            if not build:
+                return model_registry.peek(self.model_path, load_time_lookup_table)
+            return model_registry.get(self.model_path, load_time_lookup_table)
+        except Exception as e:
+            print(f"Error building travel time lookup table: {e}")
+            return None
+    
+    def lookup_table_report(self):
+        """
+        Describe the lookup table and its accuracy versus the model, without
+        building a table that this process hasn't built yet.
+        
+        Returns:
+            dict or None: Table size, accuracy, threshold and whether it is
+                used; only built=False if the table isn't built yet, None
+                without a model
+        """
+        if self.model is None:
+            return None
+        table = self.lookup_table(build=False)
+        if table is None:
+            return {'built': False}
+        report = table.describe()
+        report['built'] = True
+        report['error_metric'] = self.lookup_error_metric
+        report['max_error_threshold'] = self.lookup_max_error
+        report['used'] = self._lookup_accurate(table)
+        return report
+    
+    def _lookup_accurate(self, table):
+        """Whether the table's error on the configured metric is within the threshold."""
+        return table.error(self.lookup_error_metric) <= self.lookup_max_error
+    
+    def _predict_trips(self, distances, origins, origin_features):
+        """
+        Predict trips whose features are their distance followed by their origin's features.
+        
+        Args:
+            distances (ndarray): (m,) trip distances
+            origins (ndarray): (m,) origin row of each trip
+            origin_features (ndarray): (n, k) time features of each origin
+        
+        Returns:
+            ndarray: (m,) predictions
+        """
+        if not len(distances):
+            return np.zeros(0, dtype=np.float64)
+        
+        thresholds = _distance_thresholds(self.model)
+        
+        if thresholds is not None:
+            if origin_features.shape[1]:
+                time_buckets, origin_bucket = np.unique(origin_features, axis=0, return_inverse=True)
+                origin_bucket = np.ravel(origin_bucket)
+            else:
+                time_buckets, origin_bucket = origin_features[:1], np.zeros(len(origin_features), dtype=np.int64)
             
-            # Create sin and cos features
-            day_sin = np.sin(2 * np.pi * np.array(day_data) / 7)
-            day_cos = np.cos(2 * np.pi * np.array(day_data) / 7)
-            features = np.column_stack((features, day_sin.reshape(-1, 1), day_cos.reshape(-1, 1)))
+            # Trees compare float32 inputs, a trip goes left at a split when distance <= threshold
+            distances = distances.astype(np.float32).astype(np.float64)
+            intervals = _interval_index(thresholds, distances)
+            
+            if isinstance(self.model, RandomForestRegressor):
+                return self._predict_forest_trips(distances, intervals, len(thresholds) + 1,
+                                                  origin_bucket[origins], time_buckets)
+            
+            table_size = (len(thresholds) + 1) * len(time_buckets)
+            
+            if table_size <= GROUP_TABLE_LIMIT:
+                groups = intervals * len(time_buckets) + origin_bucket[origins]
+                
+                # Any trip of a group represents it, all give the same prediction
+                representative = np.full(table_size, -1, dtype=np.int64)
+                representative[groups] = np.arange(len(groups))
+                present = np.flatnonzero(representative >= 0)
+                picks = representative[present]
+                
+                values = np.zeros(table_size, dtype=np.float64)
+                values[present] = self._predict_rows(distances[picks], origin_features[origins[picks]])
+                return values[groups]
         
-        # Predict travel times
-        predicted_times = self.model.predict(features)
+        return self._predict_rows(distances, origin_features[origins])
+    
+    def _predict_forest_trips(self, distances, intervals, interval_count, trip_buckets, time_buckets):
+        """
+        Predict trips with a random forest, one tree at a time.
         
-        # Ensure predictions are reasonable (at least 5 min for any distance)
-        return [max(p, d / 60) for p, d in zip(predicted_times, distances)]
+        A tree's prediction only changes with distance at its own distance
+        thresholds, so each tree is evaluated once per (own distance
+        interval that occurs, time bucket) instead of once per trip or per
+        interval of all trees' thresholds. The per-tree values are summed in
+        estimator order and averaged, exactly like RandomForestRegressor.predict.
+        When those tables would hold more rows than the trips themselves,
+        the trips are predicted directly.
+        
+        Args:
+            distances (ndarray): (m,) trip distances, rounded to float32
+            intervals (ndarray): (m,) interval of each distance between all distance thresholds
+            interval_count (int): Number of such intervals
+            trip_buckets (ndarray): (m,) time bucket of each trip
+            time_buckets (ndarray): (b, k) time features of each bucket
+        
+        Returns:
+            ndarray: (m,) predictions
+        """
+        # Any distance of an interval represents it
+        representative = np.full(interval_count, -1, dtype=np.int64)
+        representative[intervals] = np.arange(len(intervals))
+        present = np.flatnonzero(representative >= 0)
+        representatives = distances[representative[present]]
+        slot = np.full(interval_count, -1, dtype=np.int64)
+        slot[present] = np.arange(len(present))
+        trip_slots = slot[intervals]
+        
+        # Distinct intervals of the representatives within each tree's own thresholds
+        tree_intervals = []
+        for estimator in self.model.estimators_:
+            tree = estimator.tree_
+            tree_thresholds = np.unique(tree.threshold[tree.feature == 0])
+            own = np.searchsorted(tree_thresholds, representatives, side='left')
+            _, first, own_intervals = np.unique(own, return_index=True, return_inverse=True)
+            tree_intervals.append((representatives[first], np.ravel(own_intervals)))
+        
+        # Minute-level departure times can give so many buckets that running every trip is cheaper
+        table_rows = sum(len(tree_distances) for tree_distances, _ in tree_intervals) * len(time_buckets)
+        if table_rows >= len(distances) * len(self.model.estimators_):
+            return self._predict_rows(distances, time_buckets[trip_buckets])
+        
+        # Buckets are processed in chunks so the (interval, bucket) sums stay within GROUP_TABLE_LIMIT
+        predictions = np.empty(len(distances), dtype=np.float64)
+        chunk = max(1, GROUP_TABLE_LIMIT // len(present))
+        for start in range(0, len(time_buckets), chunk):
+            buckets = time_buckets[start:start + chunk]
+            sums = np.zeros((len(present), len(buckets)), dtype=np.float64)
+            for estimator, (tree_distances, own_intervals) in zip(self.model.estimators_, tree_intervals):
+                count = len(tree_distances)
+                rows = np.column_stack((np.repeat(tree_distances, len(buckets)), np.tile(buckets, (count, 1))))
+                values = estimator.predict(rows.astype(np.float32), check_input=False).reshape(count, len(buckets))
+                sums += values[own_intervals]
+            sums /= len(self.model.estimators_)
+            
+            if start == 0 and len(buckets) == len(time_buckets):
+                return sums[trip_slots, trip_buckets]
+            selected = (trip_buckets >= start) & (trip_buckets < start + len(buckets))
+            predictions[selected] = sums[trip_slots[selected], trip_buckets[selected] - start]
+        
+        return predictions
+    
+    def _predict_rows(self, distances, time_features):
+        """Run the model on (distance, time features) rows, in blocks to bound memory."""
+        predictions = np.empty(len(distances), dtype=np.float64)
+        for start in range(0, len(distances), PREDICT_BLOCK_ROWS):
+            stop = start + PREDICT_BLOCK_ROWS
+            features = np.column_stack((distances[start:stop], time_features[start:stop]))
+            predictions[start:stop] = self.model.predict(features)
+        return predictions
 
 
-def predict_travel_time(distance_matrix, time_of_day=None, day_of_week=None):
+class TravelTimeLookupTable:
     """
-    Predict travel times for a distance matrix.
+    Travel time predictions of a model, precomputed over distance bins x
+    hour of day x day of week.
     
-    Args:
-        distance_matrix (list): 2D matrix of distances
-        time_of_day (str or list, optional): Time of day
-        day_of_week (str or list, optional): Day of week
+    Queries interpolate linearly between distance bins and between whole
+    hours (wrapping around midnight); days are looked up exactly. Models
+    trained without time of day or day of week get a single slice for
+    that dimension. Distances beyond the table's range return NaN.
+    """
+    def __init__(self, distances, values, uses_hour, uses_day):
+        """
+        Args:
+            distances (ndarray): (bins,) evenly spaced distances, starting at 0
+            values (ndarray): (days, hours, bins) predicted travel times
+            uses_hour (bool): Whether the model has time of day features
+            uses_day (bool): Whether the model has day of week features
+        """
+        self.distances = distances
+        self.values = values
+        self.uses_hour = uses_hour
+        self.uses_day = uses_day
+        self.accuracy = None
+    
+    @property
+    def max_distance(self):
+        return float(self.distances[-1])
+    
+    def error(self, metric):
+        """Measured value of an accuracy metric, infinite if it wasn't measured."""
+        return self.accuracy.get(metric, float('inf')) if self.accuracy else float('inf')
+    
+    def accepts(self, has_hours, has_days):
+        """Whether queries with/without time of day and day of week match the model's features."""
+        return has_hours == self.uses_hour and has_days == self.uses_day
+    
+    def lookup(self, distances, hours=None, days=None):
+        """
+        Interpolate travel times.
+        
+        Args:
+            distances (ndarray): (m,) distances in km
+            hours (ndarray, optional): (m,) hour of day (float), if the model uses it
+            days (ndarray, optional): (m,) day of week (0=Monday), if the model uses it
+        
+        Returns:
+            ndarray: (m,) travel times in hours, NaN beyond the table's distance range
+        """
+        distances = np.asarray(distances, dtype=np.float64)
+        hours = np.zeros(len(distances)) if hours is None else np.asarray(hours, dtype=np.float64) % 24
+        days = np.zeros(len(distances)) if days is None else np.asarray(days, dtype=np.float64)
         
+        # One curve per distinct (day, hour) instead of one per query
+        _, first, rows = np.unique(days * 24 + hours, return_index=True, return_inverse=True)
+        curves = self.curves(hours[first] if self.uses_hour else None, days[first] if self.uses_day else None)
+        return self.interpolate(curves, distances, np.ravel(rows))
+    
+    def curves(self, hours=None, days=None):
+        """
+        Travel time over the distance bins for given hours and days,
+        interpolated between whole hours.
+        
+        Args:
+            hours (ndarray, optional): (k,) hour of day (float), if the model uses it
+            days (ndarray, optional): (k,) day of week (0=Monday), if the model uses it
+        
+        Returns:
+            ndarray: (k, bins) one curve per (hour, day)
+        """
+        if hours is None and days is None:
+            return self.values[0]
+        count = len(hours) if hours is not None else len(days)
+        
+        day = np.zeros(count, dtype=np.int64) if days is None else np.asarray(days, dtype=np.int64)
+        if hours is None:
+            return self.values[day, 0]
+        
+        hours = np.asarray(hours, dtype=np.float64) % 24
+        hour_low = np.floor(hours).astype(np.int64)
+        hour_weight = (hours - hour_low)[:, None]
+        return self.values[day, hour_low] * (1 - hour_weight) + self.values[day, (hour_low + 1) % 24] * hour_weight
+    
+    def interpolate(self, curves, distances, rows):
+        """
+        Interpolate between distance bins.
+        
+        Args:
+            curves (ndarray): (k, bins) curves from curves()
+            distances (ndarray): (m,) distances in km
+            rows (ndarray): (m,) curve of each distance
+        
+        Returns:
+            ndarray: (m,) travel times in hours, NaN beyond the table's distance range
+        """
+        bins = len(self.distances)
+        position = distances * ((bins - 1) / self.max_distance)
+        low = np.clip(position.astype(np.int64), 0, bins - 2)
+        weight = position - low
+        
+        index = rows * bins + low
+        flat = curves.ravel()
+        times = flat[index] * (1 - weight) + flat[index + 1] * weight
+        times[(distances < 0) | (distances > self.max_distance)] = np.nan
+        return times
+    
+    def measure_accuracy(self, model, samples=LOOKUP_ACCURACY_SAMPLES, seed=0):
+        """
+        Compare the table with the live model on random queries within its range.
+        
+        Args:
+            model: The model the table was built from
+            samples (int): Number of random queries
+            seed (int): Random seed
+        
+        Returns:
+            dict: Mean, 95th percentile and maximum relative error, 95th
+                percentile and maximum absolute error in minutes
+        """
+        rng = np.random.default_rng(seed)
+        distances = rng.uniform(0, self.max_distance, samples)
+        hours = rng.integers(0, 24 * 60, samples) / 60 if self.uses_hour else None
+        days = rng.integers(0, 7, samples) if self.uses_day else None
+        
+        features = np.column_stack([distances] + _cyclical_features(hours, days))
+        expected = model.predict(features)
+        actual = self.lookup(distances, hours, days)
+        
+        error = np.abs(actual - expected)
+        relative_error = error / np.maximum(np.abs(expected), 1e-9)
+        self.accuracy = {
+            'samples': samples,
+            'mean_relative_error': float(relative_error.mean()),
+            'p95_relative_error': float(np.percentile(relative_error, 95)),
+            'max_relative_error': float(relative_error.max()),
+            'p95_error_minutes': float(np.percentile(error, 95) * 60),
+            'max_error_minutes': float(error.max() * 60)
+        }
+        return self.accuracy
+    
+    def describe(self):
+        """Size, range and accuracy of the table."""
+        return {
+            'distance_bins': len(self.distances),
+            'max_distance_km': self.max_distance,
+            'hours': self.values.shape[1],
+            'days': self.values.shape[0],
+            'accuracy': self.accuracy
+        }
+
+
+def load_time_model(path):
+    """Load a pickled travel time model."""
+    with open(path, 'rb') as f:
+        return pickle.load(f)
+
+def build_lookup_table(model, distance_bins=LOOKUP_DISTANCE_BINS):
+    """
+    Precompute a model's predictions over distance bins x hour x day and
+    measure the table's accuracy against the model.
+    
+    Args:
+        model: Fitted travel time model (features: distance, then optional
+            hour sin/cos, then optional day sin/cos)
+        distance_bins (int): Number of evenly spaced distances
+    
     Returns:
-        list: 2D matrix of predicted travel times
+        TravelTimeLookupTable: The table, with its accuracy measured
     """
-    predictor = TravelTimePredictor()
+    n_features = getattr(model, 'n_features_in_', 1)
+    uses_hour = n_features >= 3
+    uses_day = n_features >= 5
     
-    # Flatten distance matrix for prediction
-    distances = []
-    indices = []
-    for i in range(len(distance_matrix)):
-        for j in range(len(distance_matrix[i])):
-            if i != j:  # Skip self-distances
-                distances.append(distance_matrix[i][j])
-                indices.append((i, j))
-    
-    # Prepare time and day inputs
-    times = None
-    days = None
-    
-    if time_of_day is not None:
-        if isinstance(time_of_day, (str, datetime.time)):
-            times = [time_of_day] * len(distances)
-        else:
-            # Expand time_of_day to match distance matrix
-            times = []
-            for i, j in indices:
-                if isinstance(time_of_day, list) and len(time_of_day) > i:
-                    times.append(time_of_day[i])
-                else:
-                    times.append(datetime.datetime.now().strftime("%H:%M"))
+    # Trees are constant beyond their largest split, so the table only needs to reach it
+    thresholds = _distance_thresholds(model)
+    max_distance = float(thresholds[-1]) * 1.05 if thresholds is not None and len(thresholds) \
+        else LOOKUP_MAX_DISTANCE_KM
     
-    if day_of_week is not None:
-        if isinstance(day_of_week, (str, int, datetime.date)):
-            days = [day_of_week] * len(distances)
-        else:
-            # Expand day_of_week to match distance matrix
-            days = []
-            for i, j in indices:
-                if isinstance(day_of_week, list) and len(day_of_week) > i:
-                    days.append(day_of_week[i])
-                else:
-                    days.append(datetime.datetime.now().weekday())
+    distances = np.linspace(0, max_distance, distance_bins)
+    hours = np.arange(24, dtype=np.float64) if uses_hour else None
+    days = np.arange(7, dtype=np.float64) if uses_day else None
     
-    # Predict travel times
-    predicted_times = predictor.predict(distances, times, days)
+    # Grid of (day, hour, distance) in C order, matching values.reshape below
+    day_grid, hour_grid, distance_grid = np.meshgrid(
+        days if uses_day else [0.0], hours if uses_hour else [0.0], distances, indexing='ij')
+    features = np.column_stack([distance_grid.ravel()] + _cyclical_features(
+        hour_grid.ravel() if uses_hour else None, day_grid.ravel() if uses_day else None))
     
-    # Reconstruct time matrix
-    time_matrix = [[0 for _ in range(len(distance_matrix))] for _ in range(len(distance_matrix))]
-    for k, (i, j) in enumerate(indices):
-        time_matrix[i][j] = predicted_times[k]
+    values = model.predict(features).reshape(day_grid.shape)
+    table = TravelTimeLookupTable(distances, values, uses_hour, uses_day)
     
-    # Fill diagonal with zeros
-    for i in range(len(time_matrix)):
-        time_matrix[i][i] = 0
+    accuracy = table.measure_accuracy(model)
+    print(f"Built travel time lookup table ({values.size} entries), relative error mean "
+          f"{accuracy['mean_relative_error']:.4f}, p95 {accuracy['p95_relative_error']:.4f}, "
+          f"max {accuracy['max_relative_error']:.4f}, max {accuracy['max_error_minutes']:.1f} min")
+    return table
+
+def load_time_lookup_table(path):
+    """Build the lookup table for the model saved at path (used with the model registry)."""
+    return build_lookup_table(model_registry.get(path, load_time_model))
+
+def _hour_of_day(value):
+    """Hour of day (float) of a 'HH:MM' string or datetime.time; noon otherwise."""
+    if isinstance(value, str):
+        parts = value.split(':')
+        return float(parts[0]) + float(parts[1])/60
+    if isinstance(value, datetime.time):
+        return value.hour + value.minute/60
+    return 12.0  # Default to noon
+
+def _day_of_week(value):
+    """Day number (0=Monday) of a day index, day name or date; Monday otherwise."""
+    if isinstance(value, int) and 0 <= value <= 6:
+        return value
+    if isinstance(value, str):
+        return DAY_INDEX.get(value.lower(), 0)
+    if isinstance(value, datetime.date):
+        return value.weekday()
+    return 0  # Default to Monday
+
+def _time_values(values, convert):
+    """Convert a list of times or days to numbers, converting each distinct value once."""
+    converted = {}
+    return np.array([converted.get((type(v), v)) if (type(v), v) in converted
+                     else converted.setdefault((type(v), v), convert(v))
+                     for v in values], dtype=np.float64)
+
+def _cyclical_features(hours, days):
+    """
+    Cyclical (sin, cos) feature columns for hours of day and days of week.
+    
+    Args:
+        hours (ndarray or None): Hours of day (float)
+        days (ndarray or None): Days of week (0=Monday)
+    
+    Returns:
+        list: Feature columns (empty for inputs that are None)
+    """
+    columns = []
+    for numbers, period in [(hours, 24), (days, 7)]:
+        if numbers is None:
+            continue
+        angle = 2 * np.pi * np.asarray(numbers, dtype=np.float64) / period
+        columns += [np.sin(angle), np.cos(angle)]
+    return columns
+
+def _time_features(time_of_day, day_of_week):
+    """
+    Cyclical (sin, cos) feature columns for lists of times of day and days of week.
+    
+    Returns:
+        list: Feature columns (empty for inputs that are None)
+    """
+    return _cyclical_features(None if time_of_day is None else _time_values(time_of_day, _hour_of_day),
+                              None if day_of_week is None else _time_values(day_of_week, _day_of_week))
+
+def _origin_values(value, n, scalar_types, default):
+    """Expand a time/day argument to one value per origin: a scalar applies to all,
+    a list gives one per origin, and origins without a value use the default."""
+    if isinstance(value, scalar_types):
+        return [value] * n
+    return [value[i] if isinstance(value, list) and len(value) > i else default for i in range(n)]
+
+def _distance_thresholds(model):
+    """
+    Sorted split thresholds on the distance feature (column 0) of a tree
+    model, or None if the model is not tree based.
+    """
+    estimators = np.ravel(getattr(model, 'estimators_', [model]))
+    thresholds = []
+    for estimator in estimators:
+        tree = getattr(estimator, 'tree_', None)
+        if tree is None:
+            return None
+        thresholds.append(tree.threshold[tree.feature == 0])
+    return np.unique(np.concatenate(thresholds)) if thresholds else None
+
+def _interval_index(thresholds, values):
+    """
+    Same as np.searchsorted(thresholds, values, side='left') for sorted
+    thresholds, but faster for many values: a uniform grid over the
+    threshold range gives each value a guess that is at most a few
+    positions off, which vectorized steps then correct.
+    """
+    k = len(thresholds)
+    if k < 2:
+        return np.searchsorted(thresholds, values, side='left')
+    
+    lo, hi = thresholds[0], thresholds[-1]
+    cells = 2 * k
+    scale = cells / (hi - lo)
+    cell = ((values - lo) * scale).astype(np.int64)
+    np.clip(cell, 0, cells, out=cell)
+    index = np.searchsorted(thresholds, lo + np.arange(cells + 1) / scale, side='left')[cell]
+    
+    # padded[i] is thresholds[i - 1], so thresholds before and after index are padded[index] and padded[index + 1]
+    padded = np.concatenate(([-np.inf], thresholds, [np.inf]))
+    
+    # Step down while the threshold before is not below the value
+    pending = np.flatnonzero(padded[index] >= values)
+    while len(pending):
+        index[pending] -= 1
+        pending = pending[padded[index[pending]] >= values[pending]]
+    
+    # Step up while the threshold at index is below the value
+    pending = np.flatnonzero(padded[index + 1] < values)
+    while len(pending):
+        index[pending] += 1
+        pending = pending[padded[index[pending] + 1] < values[pending]]
+    
+    return index
+
+
+def predict_travel_time(distance_matrix, time_of_day=None, day_of_week=None, dtype=np.float64):
+    """
+    Predict travel times for a distance matrix.
+    
+    Args:
+        distance_matrix (list or ndarray): 2D matrix of distances
+        time_of_day (str or list, optional): Time of day
+        day_of_week (str or list, optional): Day of week
+        dtype: dtype of the predictions (e.g. np.float32)
+        
+    Returns:
+        list or ndarray: 2D matrix of predicted travel times (ndarray if
+            distance_matrix is an ndarray)
+    """
+    predictor = TravelTimePredictor()
+    time_matrix = predictor.predict_matrix(distance_matrix, time_of_day, day_of_week, dtype=dtype)
     
-    return time_matrix
\ No newline at end of file
+    # Nested lists for list input (e.g. JSON responses), arrays for array input
+    return time_matrix if isinstance(distance_matrix, np.ndarray) else time_matrix.tolist()
+    
\ No newline at end of file
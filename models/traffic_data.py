@@ -5,10 +5,21 @@ from datetime import datetime
 import os
 import pickle
 import random
+from functools import partial
 import numpy as np
 from math import radians, sin, cos, sqrt, atan2
 import logging
 
+from utils.distance_matrix import (
+    EARTH_RADIUS_KM,
+    KNNDistanceGraph,
+    coordinate_arrays,
+    haversine_distances,
+    haversine_matrix,
+    haversine_pairwise,
+    knn_distance_graph,
+)
+
 # Set up logging
 logging.basicConfig(level=logging.INFO, 
                     format='%(asctime)s - %(name)s - %(levelname)s - %(message)s')
@@ -19,6 +30,17 @@ traffic_cache = {}
 # Cache expiration time in seconds (5 minutes)
 CACHE_EXPIRATION = 300
 
+# A traffic signal within this distance of either stop adds delay (km)
+SIGNAL_RADIUS_KM = 0.1
+# A congestion point within this distance of either stop affects the segment (km)
+CONGESTION_RADIUS_KM = 0.5
+# Congestion points with d1 + d2 below this multiple of the direct distance lie along the segment
+CONGESTION_DETOUR_FACTOR = 1.2
+# Average speed without traffic (km/h), used to turn distances into travel times
+BASE_SPEED_KMH = 30.0
+# Upper bound on (segments x congestion points) evaluated at once in the batch computation
+BATCH_ELEMENT_BUDGET = 1 << 22
+
 def haversine_distance(lat1, lon1, lat2, lon2):
     """
     Calculate the great-circle distance between two points
@@ -310,7 +332,319 @@ def generate_simulated_traffic_data(bounds):
         'is_simulated': True
     }
 
-def calculate_traffic_factor(coord1, coord2, traffic_data):
+class TrafficFeatureIndex:
+    """
+    Spatial index over the traffic signals and congestion points of one
+    traffic data set.
+    
+    Features are loaded once into haversine BallTrees, so checking a
+    segment only visits the features near its endpoints (or along it)
+    instead of scanning every signal and congestion point. Per-stop
+    lookups are cached, since every stop appears in 2 * (N - 1) segments
+    of a distance matrix.
+    """
+    def __init__(self, traffic_data):
+        """
+        Build the index.
+        
+        Args:
+            traffic_data (dict): Traffic data from get_overpass_traffic_data
+        """
+        signals = traffic_data.get('traffic_signals', [])
+        self.signal_count = len(signals)
+        self._signal_points = _radian_points([s['lat'] for s in signals], [s['lon'] for s in signals])
+        self._signal_tree = _haversine_tree(self._signal_points)
+        
+        point_lats, point_lons, point_levels = [], [], []
+        for area in traffic_data.get('congestion_areas', []):
+            for point in area['coords']:
+                point_lats.append(point['lat'])
+                point_lons.append(point['lon'])
+                point_levels.append(area['congestion_level'])
+        
+        self.congestion_point_count = len(point_levels)
+        self._congestion_points = _radian_points(point_lats, point_lons)
+        self._congestion_levels = np.asarray(point_levels, dtype=np.float64)
+        self._congestion_tree = _haversine_tree(self._congestion_points)
+        self._max_congestion = float(self._congestion_levels.max()) if point_levels else 0.0
+        
+        self._stop_cache = {}
+    
+    def signal_factor(self, coord1, coord2):
+        """Same result as check_traffic_signals, using the index."""
+        if self._signal_tree is None:
+            return 0.0
+        
+        signals1, _ = self._stop_features(coord1['lat'], coord1['lng'])
+        signals2, _ = self._stop_features(coord2['lat'], coord2['lng'])
+        
+        # A signal near both stops is only counted once
+        return _signal_delay(len(signals1 | signals2))
+    
+    def congestion_factor(self, coord1, coord2):
+        """Same result as check_congestion_areas, using the index."""
+        if self._congestion_tree is None:
+            return 0.0
+        
+        lat1, lon1 = coord1['lat'], coord1['lng']
+        lat2, lon2 = coord2['lat'], coord2['lng']
+        _, near1 = self._stop_features(lat1, lon1)
+        _, near2 = self._stop_features(lat2, lon2)
+        max_congestion = max(near1, near2)
+        if max_congestion >= self._max_congestion:
+            return max_congestion
+        
+        # Points along the segment satisfy d1 + d2 < 1.2 * direct, which
+        # implies d1 < 1.2 * direct, so only that ball around stop 1 is searched
+        direct_distance = haversine_distance(lat1, lon1, lat2, lon2)
+        limit = direct_distance * CONGESTION_DETOUR_FACTOR
+        if limit <= 0:
+            return max_congestion
+        
+        candidates = self._query(self._congestion_tree, self._congestion_points, lat1, lon1, limit)
+        candidates = candidates[self._congestion_levels[candidates] > max_congestion]
+        if len(candidates):
+            lats = np.degrees(self._congestion_points[candidates, 0])
+            lons = np.degrees(self._congestion_points[candidates, 1])
+            d1 = haversine_pairwise(lat1, lon1, lats, lons)
+            d2 = haversine_pairwise(lat2, lon2, lats, lons)
+            along = d1 + d2 < limit
+            if along.any():
+                max_congestion = max(max_congestion, float(self._congestion_levels[candidates][along].max()))
+        
+        return max_congestion
+    
+    def factor_matrices(self, lats, lngs, symmetric=False):
+        """
+        Signal and congestion factors for every ordered pair of stops at once.
+        
+        Gives the same values as signal_factor/congestion_factor for each
+        pair. Signal counts come from a sparse stop x signal incidence
+        matrix; congestion along segments is evaluated in blocks of
+        segments x congestion points, visiting points from the highest
+        congestion level down so segments drop out as soon as nothing
+        higher can be found.
+        
+        Args:
+            lats, lngs (ndarray): Stop coordinates in degrees
+            symmetric (bool): Only evaluate i < j and mirror the result
+                (both factors are direction independent)
+        
+        Returns:
+            tuple: (signal_factors, congestion_factors) as (n, n) ndarrays
+                with zeros on the diagonal
+        """
+        from scipy import sparse
+        
+        lats = np.asarray(lats, dtype=np.float64)
+        lngs = np.asarray(lngs, dtype=np.float64)
+        n = len(lats)
+        signal_factors = np.zeros((n, n), dtype=np.float64)
+        congestion_factors = np.zeros((n, n), dtype=np.float64)
+        if n == 0:
+            return signal_factors, congestion_factors
+        
+        # Signals: |S_i union S_j| = |S_i| + |S_j| - |S_i intersect S_j|
+        if self._signal_tree is not None:
+            rows, cols = self._query_batch(self._signal_tree, self._signal_points, lats, lngs, SIGNAL_RADIUS_KM)
+            incidence = sparse.csr_matrix((np.ones(len(rows), dtype=np.int32), (rows, cols)),
+                                          shape=(n, self.signal_count))
+            per_stop = np.asarray(incidence.sum(axis=1)).ravel()
+            shared = (incidence @ incidence.T).toarray()
+            signal_factors = _signal_delay_array(per_stop[:, None] + per_stop[None, :] - shared)
+            np.fill_diagonal(signal_factors, 0.0)
+        
+        if self._congestion_tree is None:
+            return signal_factors, congestion_factors
+        
+        if symmetric:
+            pair_i, pair_j = np.triu_indices(n, 1)
+        else:
+            pair_i, pair_j = np.nonzero(~np.eye(n, dtype=bool))
+        
+        limit = haversine_matrix(lats, lngs)[pair_i, pair_j] * CONGESTION_DETOUR_FACTOR
+        best = self._segment_congestion(lats, lngs, pair_i, pair_j, limit)
+        
+        congestion_factors[pair_i, pair_j] = best
+        if symmetric:
+            congestion_factors[pair_j, pair_i] = best
+        
+        return signal_factors, congestion_factors
+    
+    def factor_pairs(self, lats, lngs, pair_i, pair_j):
+        """
+        Signal and congestion factors for selected ordered pairs of stops.
+        
+        Same values as factor_matrices, but only for the given segments
+        (e.g. the arcs of a KNNDistanceGraph), so memory is linear in the
+        number of segments instead of quadratic in the number of stops.
+        
+        Args:
+            lats, lngs (ndarray): Stop coordinates in degrees
+            pair_i, pair_j (ndarray): Start and end stop of each segment
+        
+        Returns:
+            tuple: (signal_factors, congestion_factors) as arrays with one
+                value per segment
+        """
+        from scipy import sparse
+        
+        lats = np.asarray(lats, dtype=np.float64)
+        lngs = np.asarray(lngs, dtype=np.float64)
+        pair_i = np.asarray(pair_i, dtype=np.int64)
+        pair_j = np.asarray(pair_j, dtype=np.int64)
+        n = len(lats)
+        signal_factors = np.zeros(len(pair_i), dtype=np.float64)
+        congestion_factors = np.zeros(len(pair_i), dtype=np.float64)
+        if not len(pair_i):
+            return signal_factors, congestion_factors
+        
+        # Signals: |S_i union S_j| = |S_i| + |S_j| - |S_i intersect S_j|, per segment
+        if self._signal_tree is not None:
+            rows, cols = self._query_batch(self._signal_tree, self._signal_points, lats, lngs, SIGNAL_RADIUS_KM)
+            incidence = sparse.csr_matrix((np.ones(len(rows), dtype=np.int32), (rows, cols)),
+                                          shape=(n, self.signal_count))
+            per_stop = np.asarray(incidence.sum(axis=1)).ravel()
+            shared = np.asarray(incidence[pair_i].multiply(incidence[pair_j]).sum(axis=1)).ravel()
+            signal_factors = _signal_delay_array(per_stop[pair_i] + per_stop[pair_j] - shared)
+            signal_factors[pair_i == pair_j] = 0.0
+        
+        if self._congestion_tree is None:
+            return signal_factors, congestion_factors
+        
+        limit = haversine_pairwise(lats[pair_i], lngs[pair_i], lats[pair_j], lngs[pair_j]) * CONGESTION_DETOUR_FACTOR
+        congestion_factors = self._segment_congestion(lats, lngs, pair_i, pair_j, limit)
+        congestion_factors[pair_i == pair_j] = 0.0
+        
+        return signal_factors, congestion_factors
+    
+    def _segment_congestion(self, lats, lngs, pair_i, pair_j, limit):
+        """
+        Highest congestion level near either end of each segment or along it.
+        
+        Args:
+            lats, lngs (ndarray): Stop coordinates in degrees
+            pair_i, pair_j (ndarray): Start and end stop of each segment
+            limit (ndarray): Direct distance of each segment times CONGESTION_DETOUR_FACTOR
+        
+        Returns:
+            ndarray: Congestion level of each segment
+        """
+        # Congestion near either endpoint
+        rows, cols = self._query_batch(self._congestion_tree, self._congestion_points, lats, lngs, CONGESTION_RADIUS_KM)
+        near = np.zeros(len(lats), dtype=np.float64)
+        np.maximum.at(near, rows, self._congestion_levels[cols])
+        best = np.maximum(near[pair_i], near[pair_j])
+        
+        # Congestion points along each segment, highest level first
+        order = np.argsort(-self._congestion_levels, kind='stable')
+        point_lats = np.degrees(self._congestion_points[order, 0])
+        point_lons = np.degrees(self._congestion_points[order, 1])
+        levels = self._congestion_levels[order]
+        
+        start = 0
+        while start < len(order):
+            active = np.flatnonzero((best < levels[start]) & (limit > 0))
+            if not len(active):
+                break
+            
+            stop = min(start + max(1, BATCH_ELEMENT_BUDGET // len(active)), len(order))
+            to_points = haversine_distances(lats, lngs, point_lats[start:stop], point_lons[start:stop])
+            along = (to_points[pair_i[active]] + to_points[pair_j[active]]) < limit[active, None]
+            
+            hit = along.any(axis=1)
+            # Levels are sorted descending, so the first hit in a row is the highest
+            found = levels[start:stop][along[hit].argmax(axis=1)]
+            best[active[hit]] = np.maximum(best[active[hit]], found)
+            start = stop
+        
+        return best
+    
+    def _stop_features(self, lat, lng):
+        """
+        Get the features near a single stop.
+        
+        Returns:
+            tuple: (frozenset of signal indices within SIGNAL_RADIUS_KM,
+                    highest congestion level within CONGESTION_RADIUS_KM)
+        """
+        key = (lat, lng)
+        cached = self._stop_cache.get(key)
+        if cached is not None:
+            return cached
+        
+        signals = frozenset()
+        if self._signal_tree is not None:
+            signals = frozenset(self._query(self._signal_tree, self._signal_points, lat, lng,
+                                               SIGNAL_RADIUS_KM).tolist())
+        
+        congestion = 0.0
+        if self._congestion_tree is not None:
+            nearby = self._query(self._congestion_tree, self._congestion_points, lat, lng, CONGESTION_RADIUS_KM)
+            if len(nearby):
+                congestion = float(self._congestion_levels[nearby].max())
+        
+        self._stop_cache[key] = (signals, congestion)
+        return signals, congestion
+    
+    def _query(self, tree, points, lat, lng, radius_km):
+        """Indices of the features within radius_km of a point (exact, strict comparison)."""
+        # Query slightly wider than the radius and filter exactly, so rounding
+        # in the tree's distance never drops a feature right at the edge
+        candidates = tree.query_radius(np.radians([[lat, lng]]), r=radius_km / EARTH_RADIUS_KM * (1 + 1e-9))[0]
+        if not len(candidates):
+            return candidates
+        distances = haversine_pairwise(lat, lng, np.degrees(points[candidates, 0]), np.degrees(points[candidates, 1]))
+        return candidates[distances < radius_km]
+    
+    
+    def _query_batch(self, tree, points, lats, lngs, radius_km):
+        """
+        Vectorized _query for many stops.
+        
+        Returns:
+            tuple: (stop indices, feature indices) of all pairs within radius_km
+        """
+        query = np.radians(np.column_stack([lats, lngs]))
+        candidates = tree.query_radius(query, r=radius_km / EARTH_RADIUS_KM * (1 + 1e-9))
+        
+        counts = np.fromiter((len(c) for c in candidates), dtype=np.int64, count=len(candidates))
+        if not counts.sum():
+            return np.zeros(0, dtype=np.int64), np.zeros(0, dtype=np.int64)
+        
+        rows = np.repeat(np.arange(len(lats)), counts)
+        cols = np.concatenate(candidates).astype(np.int64)
+        distances = haversine_pairwise(lats[rows], lngs[rows],
+                                       np.degrees(points[cols, 0]), np.degrees(points[cols, 1]))
+        within = distances < radius_km
+        return rows[within], cols[within]
+
+
+def _radian_points(lats, lons):
+    """(n, 2) array of [lat, lon] in radians, the layout BallTree's haversine metric expects."""
+    return np.radians(np.column_stack([np.asarray(lats, dtype=np.float64), np.asarray(lons, dtype=np.float64)]))
+
+def _haversine_tree(points):
+    """BallTree over radian [lat, lon] points, or None if there are no points."""
+    if not len(points):
+        return None
+    from sklearn.neighbors import BallTree
+    
+    return BallTree(points, metric='haversine')
+
+def build_traffic_index(traffic_data):
+    """
+    Build a spatial index for a traffic data set.
+    
+    Args:
+        traffic_data (dict): Traffic data from get_overpass_traffic_data
+    
+    Returns:
+        TrafficFeatureIndex: Index to pass to calculate_traffic_factor
+    """
+    return TrafficFeatureIndex(traffic_data)
+
+def calculate_traffic_factor(coord1, coord2, traffic_data, index=None, time_factor=None):
     """
     Calculate a traffic factor to adjust travel time between two points.
     
@@ -318,6 +652,9 @@ def calculate_traffic_factor(coord1, coord2, traffic_data):
         coord1 (dict): Dictionary with 'lat' and 'lng' keys for point 1
         coord2 (dict): Dictionary with 'lat' and 'lng' keys for point 2
         traffic_data (dict): Traffic data from get_overpass_traffic_data
+        index (TrafficFeatureIndex, optional): Spatial index built from
+            traffic_data; without it every feature is scanned
+        time_factor (float, optional): Precomputed get_time_of_day_factor()
         
     Returns:
         float: Traffic factor (1.0 means no traffic, >1.0 means traffic slows travel)
@@ -325,14 +662,19 @@ def calculate_traffic_factor(coord1, coord2, traffic_data):
     # Default factor with no traffic
     base_factor = 1.0
     
-    # Check for nearby traffic signals
-    signal_factor = check_traffic_signals(coord1, coord2, traffic_data.get('traffic_signals', []))
+    if index is not None:
+        signal_factor = index.signal_factor(coord1, coord2)
+        congestion_factor = index.congestion_factor(coord1, coord2)
+    else:
+        # Check for nearby traffic signals
+        signal_factor = check_traffic_signals(coord1, coord2, traffic_data.get('traffic_signals', []))
     
-    # Check for congestion areas
-    congestion_factor = check_congestion_areas(coord1, coord2, traffic_data.get('congestion_areas', []))
+        # Check for congestion areas
+        congestion_factor = check_congestion_areas(coord1, coord2, traffic_data.get('congestion_areas', []))
     
     # Add time-of-day factor
-    time_factor = get_time_of_day_factor()
+    if time_factor is None:
+        time_factor = get_time_of_day_factor()
     
     # Combine factors - we want traffic to slow things down by at most 2-3x
     # Use a weighted combination that prevents extreme values
@@ -371,9 +713,13 @@ def check_traffic_signals(coord1, coord2, traffic_signals):
         d2 = haversine_distance(lat2, lon2, signal['lat'], signal['lon'])
         
         # If the signal is close to either point (within 100m), count it
-        if d1 < 0.1 or d2 < 0.1:  # 0.1 km = 100m
+        if d1 < SIGNAL_RADIUS_KM or d2 < SIGNAL_RADIUS_KM:
             signal_count += 1
     
+    return _signal_delay(signal_count)
+
+def _signal_delay(signal_count):
+    """Map the number of traffic signals near a segment to a delay factor."""
     # More signals = more delay
     if signal_count == 0:
         return 0.0
@@ -383,6 +729,12 @@ def check_traffic_signals(coord1, coord2, traffic_signals):
         # Multiple signals cause more delay, but with diminishing returns
         return min(0.5, signal_count * 0.15)  # Cap at 50% delay
 
+def _signal_delay_array(signal_counts):
+    """Vectorized _signal_delay over an array of signal counts."""
+    signal_counts = np.asarray(signal_counts)
+    return np.where(signal_counts == 0, 0.0,
+                    np.where(signal_counts == 1, 0.2, np.minimum(0.5, signal_counts * 0.15)))
+
 def check_congestion_areas(coord1, coord2, congestion_areas):
     """
     Check if the route passes through congestion areas.
@@ -412,27 +764,34 @@ def check_congestion_areas(coord1, coord2, congestion_areas):
             d2 = haversine_distance(lat2, lon2, point['lat'], point['lon'])
             
             # If point is close to either endpoint or close to the route
-            if d1 < 0.5 or d2 < 0.5 or (d1 + d2) < (direct_distance * 1.2):
+            if (d1 < CONGESTION_RADIUS_KM or d2 < CONGESTION_RADIUS_KM
+                    or (d1 + d2) < (direct_distance * CONGESTION_DETOUR_FACTOR)):
                 max_congestion = max(max_congestion, area['congestion_level'])
     
     return max_congestion
 
-def get_time_of_day_factor():
+def get_time_of_day_factor(now=None):
     """
     Calculate traffic factor based on time of day.
     
+    Args:
+        now (datetime, optional): Time to evaluate, defaults to the current time
+    
     Returns:
         float: Time-of-day traffic factor
     """
+    if now is None:
+        now = datetime.now()
+    
     # Get current hour
-    current_hour = datetime.now().hour
+    current_hour = now.hour
     
     # Define rush hours
     morning_rush = (7, 8, 9)
     evening_rush = (16, 17, 18)
     
     # Weekend or weekday
-    is_weekend = datetime.now().weekday() >= 5
+    is_weekend = now.weekday() >= 5
     
     if is_weekend:
         # Weekend traffic patterns
@@ -451,22 +810,133 @@ def get_time_of_day_factor():
         else:
             return 0.0  # Light traffic at other times
             
-def apply_traffic_to_distance_matrix(distance_matrix, coordinates, bounds=None):
+def calculate_traffic_matrix(distance_matrix, coordinates, traffic_data, index=None, symmetric=False,
+                             time_factor=None):
+    """
+    Calculate traffic factors and travel times for all pairs of stops in one pass.
+    
+    Vectorized equivalent of calling calculate_traffic_factor for every
+    ordered pair: signal proximity, congestion proximity and the
+    time-of-day factor are evaluated as array operations, and the
+    time-of-day factor is computed once.
+    
+    Args:
+        distance_matrix: (n, n) distances in kilometers (list or ndarray);
+            see calculate_traffic_graph for sparse graphs and tiled matrices
+        coordinates (list): List of coordinate dictionaries with 'lat' and 'lng' keys
+        traffic_data (dict): Traffic data from get_overpass_traffic_data
+        index (TrafficFeatureIndex, optional): Prebuilt index for traffic_data
+        symmetric (bool): Evaluate each unordered pair once and mirror the
+            traffic factors (travel times still use both directions of
+            distance_matrix)
+        time_factor (float, optional): Precomputed get_time_of_day_factor()
+    
+    Returns:
+        tuple: (travel_time_matrix, traffic_factors) as (n, n) ndarrays,
+            travel times in hours
+    
+    Raises:
+        ValueError: If distance_matrix is a TiledDistanceMatrix
+    """
+    if hasattr(distance_matrix, 'iter_rows'):
+        raise ValueError("calculate_traffic_matrix builds (n, n) matrices, use calculate_traffic_graph "
+                         "for a TiledDistanceMatrix")
+    
+    lats, lngs = coordinate_arrays(coordinates)
+    
+    if index is None:
+        index = build_traffic_index(traffic_data)
+    if time_factor is None:
+        time_factor = get_time_of_day_factor()
+    
+    signal_factor, congestion_factor = index.factor_matrices(lats, lngs, symmetric=symmetric)
+    
+    # Same weighting and bounds as calculate_traffic_factor
+    traffic_factors = 1.0 + (signal_factor * 0.2) + (congestion_factor * 0.6) + (time_factor * 0.2)
+    traffic_factors = np.clip(traffic_factors, 1.0, 3.0)
+    np.fill_diagonal(traffic_factors, 1.0)
+    
+    # Assuming average speed without traffic is 30 km/h, this gives time in hours
+    travel_time_matrix = _dense_distances(distance_matrix) / BASE_SPEED_KMH * traffic_factors
+    np.fill_diagonal(travel_time_matrix, 0.0)
+    
+    return travel_time_matrix, traffic_factors
+
+def calculate_traffic_graph(graph, coordinates, traffic_data, index=None, time_factor=None):
+    """
+    Calculate traffic factors and travel times for the arcs of a sparse graph.
+    
+    Sparse counterpart of calculate_traffic_matrix: only the arcs stored in
+    a KNNDistanceGraph are evaluated, so memory stays O(N*k). Arcs that are
+    not stored are computed on access with calculate_traffic_factor.
+    
+    Args:
+        graph (KNNDistanceGraph): Sparse distance graph in kilometers
+        coordinates (list): List of coordinate dictionaries with 'lat' and 'lng' keys
+        traffic_data (dict): Traffic data from get_overpass_traffic_data
+        index (TrafficFeatureIndex, optional): Prebuilt index for traffic_data
+        time_factor (float, optional): Precomputed get_time_of_day_factor()
+    
+    Returns:
+        tuple: (travel_time_graph, traffic_factor_graph) as KNNDistanceGraphs
+            over the arcs of graph, travel times in hours
+    """
+    from scipy.sparse import csr_matrix
+    
+    lats, lngs = coordinate_arrays(coordinates)
+    
+    if index is None:
+        index = build_traffic_index(traffic_data)
+    if time_factor is None:
+        time_factor = get_time_of_day_factor()
+    
+    csr = graph.csr
+    pair_i = np.repeat(np.arange(len(lats), dtype=np.int64), np.diff(csr.indptr))
+    pair_j = csr.indices.astype(np.int64)
+    signal_factor, congestion_factor = index.factor_pairs(lats, lngs, pair_i, pair_j)
+    
+    # Same weighting and bounds as calculate_traffic_factor
+    traffic_factors = 1.0 + (signal_factor * 0.2) + (congestion_factor * 0.6) + (time_factor * 0.2)
+    traffic_factors = np.clip(traffic_factors, 1.0, 3.0)
+    travel_times = np.asarray(csr.data, dtype=np.float64) / BASE_SPEED_KMH * traffic_factors
+    
+    def arc_graph(values, value_kind):
+        values_csr = csr_matrix((values, csr.indices.copy(), csr.indptr.copy()), shape=csr.shape)
+        return KNNDistanceGraph(lats, lngs, values_csr,
+                                fallback=partial(_off_graph_traffic, value_kind, index, time_factor, lats, lngs))
+    
+    return arc_graph(travel_times, 'travel_time'), arc_graph(traffic_factors, 'traffic_factor')
+
+def _off_graph_traffic(value_kind, index, time_factor, lats, lngs, i, j):
+    """Travel time (hours) or traffic factor of an arc that is not stored in a traffic graph."""
+    coord1 = {'lat': lats[i], 'lng': lngs[i]}
+    coord2 = {'lat': lats[j], 'lng': lngs[j]}
+    factor = calculate_traffic_factor(coord1, coord2, {}, index=index, time_factor=time_factor)
+    if value_kind == 'traffic_factor':
+        return factor
+    return haversine_distance(lats[i], lngs[i], lats[j], lngs[j]) / BASE_SPEED_KMH * factor
+
+def _dense_distances(distance_matrix):
+    """In-memory distance matrix as a dense float64 ndarray."""
+    return np.asarray(distance_matrix, dtype=np.float64)
+
+def apply_traffic_to_distance_matrix(distance_matrix, coordinates, bounds=None, symmetric=False):
     """
     Apply traffic factors to a distance matrix.
     
     Args:
-        distance_matrix (list): Original distance matrix
+        distance_matrix (list): Original distance matrix, a TiledDistanceMatrix or a KNNDistanceGraph
         coordinates (list): List of coordinate dictionaries with 'lat' and 'lng' keys
         bounds (tuple, optional): Bounding box (min_lat, min_lon, max_lat, max_lon)
+        symmetric (bool): Evaluate traffic factors once per unordered pair
         
     Returns:
-        tuple: (travel_time_matrix, traffic_factors)
+        tuple: (travel_time_matrix, traffic_factors, traffic_data), the
+            matrices as (n, n) ndarrays, or KNNDistanceGraphs over the same
+            arcs when distance_matrix is a KNNDistanceGraph (over a nearest
+            neighbour graph of the coordinates for a TiledDistanceMatrix,
+            which is too large to hold dense traffic matrices)
     """
-    n = len(distance_matrix)
-    travel_time_matrix = [[0 for _ in range(n)] for _ in range(n)]
-    traffic_factors = [[1.0 for _ in range(n)] for _ in range(n)]
-    
     # Calculate bounds if not provided
     if bounds is None:
         min_lat = min(coord['lat'] for coord in coordinates)
@@ -481,20 +951,14 @@ def apply_traffic_to_distance_matrix(distance_matrix, coordinates, bounds=None):
     # Get traffic data for the area
     traffic_data = get_overpass_traffic_data(bounds)
     
-    # Apply traffic factors to each segment
-    for i in range(n):
-        for j in range(n):
-            if i != j:
-                # Get traffic factor for this segment
-                traffic_factor = calculate_traffic_factor(coordinates[i], coordinates[j], traffic_data)
-                traffic_factors[i][j] = traffic_factor
-                
-                # Apply to distance to get travel time
-                # Assuming average speed without traffic is 30 km/h
-                # This gives time in hours
-                base_time = distance_matrix[i][j] / 30.0
-                travel_time_matrix[i][j] = base_time * traffic_factor
-            else:
-                travel_time_matrix[i][j] = 0.0
+    # Apply traffic factors to all segments at once; a sparse graph only gets its own arcs
+    if hasattr(distance_matrix, 'neighbors'):
+        travel_time_matrix, traffic_factors = calculate_traffic_graph(distance_matrix, coordinates, traffic_data)
+    elif hasattr(distance_matrix, 'iter_rows'):
+        travel_time_matrix, traffic_factors = calculate_traffic_graph(knn_distance_graph(coordinates), coordinates,
+                                                                      traffic_data)
+    else:
+        travel_time_matrix, traffic_factors = calculate_traffic_matrix(distance_matrix, coordinates, traffic_data,
+                                                                       symmetric=symmetric)
     
     return travel_time_matrix, traffic_factors, traffic_data
\ No newline at end of file
@@ -1,5 +1,3 @@
-from ortools.constraint_solver import routing_enums_pb2
-from ortools.constraint_solver import pywrapcp
 from datetime import datetime, timedelta
 import math
 import json
@@ -7,15 +5,21 @@ import logging
 
 # Import custom modules
 from models.traffic_data import apply_traffic_to_distance_matrix
+from models.routing_model import build_routing_model, default_time_budget
 
 # Set up logging
 logging.basicConfig(level=logging.INFO, 
                     format='%(asctime)s - %(name)s - %(levelname)s - %(message)s')
 logger = logging.getLogger(__name__)
 
+def minimize_travel_time(model):
+    """Objective: total travel time with traffic."""
+    model.set_arc_costs(model.time_transits)
+
 # Update traffic_optimizer.py to properly handle vehicle_data
 
-def optimize_routes_with_traffic(depot, locations, distance_matrix, vehicle_count=1, max_distance=None, clusters=None, vehicle_data=None):
+def optimize_routes_with_traffic(depot, locations, distance_matrix, vehicle_count=1, max_distance=None, clusters=None, vehicle_data=None,
+                                 time_budget_ms=None, solve_trace=None, portfolio=False):
     """
     Optimize delivery routes using Google OR-Tools with real-time traffic data.
     Enhanced to properly handle multiple vehicles with different vehicle types.
@@ -23,11 +27,20 @@ def optimize_routes_with_traffic(depot, locations, distance_matrix, vehicle_coun
     Args:
         depot (dict): Depot location
         locations (list): List of delivery locations
-        distance_matrix (list): 2D matrix of distances
+        distance_matrix (list): 2D matrix of distances, or a KNNDistanceGraph
+            to only consider nearest-neighbour arcs
         vehicle_count (int): Number of vehicles
         max_distance (float, optional): Maximum distance per vehicle
         clusters (list, optional): List of location clusters by vehicle
         vehicle_data (list, optional): Data about each vehicle
+        time_budget_ms (float, optional): Solver time budget, scaled with the
+            number of locations by default; a fallback to regular routing
+            only gets what is left of it
+        solve_trace (dict, optional): Filled with the solver's trace (budget,
+            stop reason and timestamped improving solutions) and the
+            dropped_locations the routes leave out in sparse mode
+        portfolio (bool): Race several search strategies in parallel processes
+            and keep the best result; the trace reports the winning strategy
         
     Returns:
         tuple: (Optimized routes, Traffic info)
@@ -56,161 +69,38 @@ def optimize_routes_with_traffic(depot, locations, distance_matrix, vehicle_coun
     # Check if using pre-assigned clusters
     using_clusters = clusters is not None and len(clusters) == vehicle_count
     
-    # Create the routing index manager
-    manager = pywrapcp.RoutingIndexManager(len(travel_time_matrix), 
-                                          vehicle_count, 
-                                          0)  # 0 is the depot index
-    
-    # Create Routing Model
-    routing = pywrapcp.RoutingModel(manager)
-    
-    # Create and register transit callbacks
-    def distance_callback(from_index, to_index):
-        """Returns the distance between the two nodes."""
-        # Convert from routing variable Index to distance matrix NodeIndex
-        from_node = manager.IndexToNode(from_index)
-        to_node = manager.IndexToNode(to_index)
-        return int(distance_matrix[from_node][to_node] * 1000)  # Convert to meters
-    
-    def time_callback(from_index, to_index):
-        """Returns the travel time between the two nodes with traffic."""
-        # Convert from routing variable Index to time matrix NodeIndex
-        from_node = manager.IndexToNode(from_index)
-        to_node = manager.IndexToNode(to_index)
-        # Convert to seconds (travel_time_matrix is in hours)
-        return int(travel_time_matrix[from_node][to_node] * 3600)
-    
-    distance_callback_index = routing.RegisterTransitCallback(distance_callback)
-    time_callback_index = routing.RegisterTransitCallback(time_callback)
-    
-    # Define cost based on time (primary) and distance (secondary)
-    routing.SetArcCostEvaluatorOfAllVehicles(time_callback_index)
-    
-    # Add Distance constraint
-    if max_distance:
-        max_distance_meters = int(max_distance * 1000)  # Convert to meters
-        dimension_name = 'Distance'
-        routing.AddDimension(
-            distance_callback_index,
-            0,  # no slack
-            max_distance_meters,  # vehicle maximum travel distance
-            True,  # start cumul to zero
-            dimension_name)
-        distance_dimension = routing.GetDimensionOrDie(dimension_name)
-        distance_dimension.SetGlobalSpanCostCoefficient(100)
-    
-    # Add Time dimension
-    time_dimension_name = 'Time'
-    routing.AddDimension(
-        time_callback_index,
-        60 * 60,  # Allow waiting time of up to 60 minutes
-        24 * 60 * 60,  # Maximum time per vehicle (24 hours in seconds)
-        False,  # Don't force start cumul to zero
-        time_dimension_name)
-    
-    time_dimension = routing.GetDimensionOrDie(time_dimension_name)
-    
-    # Add time window constraints if present
-    depot_start_time = datetime.strptime("8:00", "%H:%M")  # 8:00 AM start
-    has_time_windows = any(loc.get('time_window_start') for loc in locations)
-    
-    if has_time_windows:
-        print("Setting up time window constraints")
-        
-        # Set time window for depot
-        index = manager.NodeToIndex(0)
-        time_dimension.CumulVar(index).SetRange(0, 24 * 60 * 60)  # Depot available 24 hours
-        
-        # Add time window for each location
-        for location_idx, location in enumerate(locations):
-            # Convert to routing index (add 1 to skip depot)
-            routing_idx = location_idx + 1
-            
-            if location.get('time_window_start') and location.get('time_window_end'):
-                try:
-                    # Convert string/time to datetime for calculations
-                    if isinstance(location['time_window_start'], str):
-                        start_time = datetime.strptime(location['time_window_start'], "%H:%M")
-                        end_time = datetime.strptime(location['time_window_end'], "%H:%M")
-                    else:
-                        # Assume it's a time object
-                        start_time = datetime.combine(datetime.today(), location['time_window_start'])
-                        end_time = datetime.combine(datetime.today(), location['time_window_end'])
-                    
-                    # Convert time to seconds from depot start time
-                    start_seconds = int((start_time - depot_start_time).total_seconds())
-                    end_seconds = int((end_time - depot_start_time).total_seconds())
-                    
-                    # Ensure start_seconds is non-negative
-                    start_seconds = max(0, start_seconds)
-                    
-                    # If end time is before start time (e.g., crosses midnight), add 24 hours
-                    if end_seconds < start_seconds:
-                        end_seconds += 24 * 60 * 60
-                    
-                    # Set time window for this location
-                    index = manager.NodeToIndex(routing_idx)
-                    time_dimension.CumulVar(index).SetRange(start_seconds, end_seconds)
-                    print(f"Time window for {location['name']}: {start_time.strftime('%H:%M')}-{end_time.strftime('%H:%M')}")
-                except Exception as e:
-                    print(f"Error setting time window for {location['name']}: {e}")
-    
-    # Add vehicle capacity constraints
-    def demand_callback(from_index):
-        """Returns the demand of the node."""
-        # The depot has no demand (0)
-        from_node = manager.IndexToNode(from_index)
-        return 1 if from_node > 0 else 0  # Each location has demand of 1 (simplification)
-    
-    demand_callback_index = routing.RegisterUnaryTransitCallback(demand_callback)
-    
-    # Get capacities for vehicles
+    # Get capacities for vehicles (missing ones get the default capacity)
     vehicle_capacities = [vd.get('capacity', 100) for vd in vehicle_data]
-    if len(vehicle_capacities) < vehicle_count:
-        # Fill with default capacity
-        vehicle_capacities.extend([100] * (vehicle_count - len(vehicle_capacities)))
-    
-    routing.AddDimensionWithVehicleCapacity(
-        demand_callback_index,
-        0,  # null capacity slack
-        vehicle_capacities,  # vehicle maximum capacities
-        True,  # start cumul to zero
-        'Capacity')
     
-    # Apply clustering constraints if provided
-    if using_clusters:
-        # For each vehicle, only allow it to visit nodes in its cluster
-        for vehicle_id in range(vehicle_count):
-            # Get this vehicle's cluster
-            vehicle_cluster = clusters[vehicle_id]
-            
-            # For all nodes
-            for node_idx in range(len(distance_matrix)):
-                # Skip depot
-                if node_idx == 0:
-                    continue
-                    
-                # If this node is not in this vehicle's cluster, disallow it
-                if (node_idx not in vehicle_cluster) and vehicle_cluster:
-                    index = manager.NodeToIndex(node_idx)
-                    routing.VehicleVar(index).RemoveValue(vehicle_id)
-    
-    # Setting first solution heuristic
-    search_parameters = pywrapcp.DefaultRoutingSearchParameters()
-    search_parameters.first_solution_strategy = (
-        routing_enums_pb2.FirstSolutionStrategy.PATH_CHEAPEST_ARC)
-    
-    # Add metaheuristics for better solutions
-    search_parameters.local_search_metaheuristic = (
-        routing_enums_pb2.LocalSearchMetaheuristic.GUIDED_LOCAL_SEARCH)
-    search_parameters.time_limit.seconds = 30  # Increase time limit for better solutions
+    # Build the model with travel times including traffic as the arc cost
+    model = build_routing_model(
+        distance_matrix, vehicle_count,
+        time_matrices=[travel_time_matrix],
+        demands=[0] + [1] * (len(travel_time_matrix) - 1),  # Each location has demand of 1 (simplification)
+        vehicle_capacities=vehicle_capacities,
+        max_distance=max_distance,
+        distance_span_cost=100,
+        locations=locations,
+        clusters=clusters if using_clusters else None,
+        objective=minimize_travel_time)
+    routing, manager = model.routing, model.manager
     
-    # Solve the problem
-    solution = routing.SolveWithParameters(search_parameters)
+    # Solve the problem; the time budget covers a fallback to regular routing too
+    deadline = datetime.now() + timedelta(
+        seconds=time_budget_ms / 1000 if time_budget_ms else default_time_budget(len(locations)))
+    solution = model.solve(time_budget_ms=time_budget_ms, portfolio=portfolio)
+    if solve_trace is not None:
+        solve_trace.update(model.trace.to_dict())
     
     # Extract solution
     if solution:
         print("Solution found!")
+        dropped = model.dropped_locations(solution, locations)
+        if dropped:
+            print(f"Warning: {len(dropped)} locations could not be reached over neighbour arcs: "
+                  f"{[loc['id'] for loc in dropped]}")
+        if solve_trace is not None:
+            solve_trace['dropped_locations'] = dropped
         routes = []
         for vehicle_id in range(vehicle_count):
             # Get vehicle data
@@ -270,7 +160,7 @@ def optimize_routes_with_traffic(depot, locations, distance_matrix, vehicle_coun
                         
                         # Add distance and time between previous and current stops
                         prev_node = manager.IndexToNode(previous_index)
-                        distance = distance_matrix[prev_node][node_index]
+                        distance = float(distance_matrix[prev_node][node_index])
                         route_distance += distance
                         
                         # Add time with traffic consideration
@@ -290,7 +180,7 @@ def optimize_routes_with_traffic(depot, locations, distance_matrix, vehicle_coun
             
             # Add final leg back to depot
             last_node = manager.IndexToNode(previous_index)
-            distance = distance_matrix[last_node][0]  # 0 is depot index
+            distance = float(distance_matrix[last_node][0])  # 0 is depot index
             route_distance += distance
             
             time = travel_time_matrix[last_node][0]
@@ -326,6 +216,8 @@ def optimize_routes_with_traffic(depot, locations, distance_matrix, vehicle_coun
     # If no solution found, fall back to the regular optimize_routes function
     print("No solution found with traffic optimization. Falling back to regular routing.")
     from models.route_optimizer import optimize_routes
+    # At least a millisecond, a budget of 0 would fall back to the default budget
+    remaining_ms = max(1, (deadline - datetime.now()).total_seconds() * 1000)
     routes = optimize_routes(
         depot=depot,
         locations=locations,
@@ -333,7 +225,10 @@ def optimize_routes_with_traffic(depot, locations, distance_matrix, vehicle_coun
         vehicle_count=vehicle_count,
         max_distance=max_distance,
         clusters=clusters,
-        vehicle_data=vehicle_data
+        vehicle_data=vehicle_data,
+        time_budget_ms=remaining_ms,
+        solve_trace=solve_trace,
+        portfolio=portfolio
     )
     
     # Add traffic information
@@ -0,0 +1,102 @@
+import numpy as np
+import pandas as pd
+import pytest
+from sklearn.ensemble import GradientBoostingRegressor
+
+from models.compiled_gbr import PARITY_TOLERANCE, CompiledGradientBoosting, compile_gradient_boosting
+
+
+def fit_model(n_features=6, rows=400, seed=0, feature_names=None, **params):
+    rng = np.random.default_rng(seed)
+    X = rng.normal(size=(rows, n_features)) * rng.uniform(1, 50, n_features)
+    X[:, 0] = rng.integers(0, 2, rows)  # A one-hot style column with a single threshold
+    y = X[:, 1] * 0.3 + np.sin(X[:, 2] / 10) + X[:, 0] * 2 + rng.normal(scale=0.1, size=rows)
+    if feature_names is not None:
+        X = pd.DataFrame(X, columns=feature_names)
+    model = GradientBoostingRegressor(random_state=seed, **params).fit(X, y)
+    return model, np.asarray(X, dtype=np.float64)
+
+
+def sklearn_predict(model, X):
+    if hasattr(model, 'feature_names_in_'):
+        return model.predict(pd.DataFrame(X, columns=model.feature_names_in_))
+    return model.predict(X)
+
+
+def threshold_edge_rows(model, rows=300, seed=0):
+    """Rows whose values sit exactly on, just below and just above the split thresholds."""
+    rng = np.random.default_rng(seed)
+    n_features = model.n_features_in_
+    thresholds = [[] for _ in range(n_features)]
+    for estimator in model.estimators_[:, 0]:
+        tree = estimator.tree_
+        for feature, threshold in zip(tree.feature, tree.threshold):
+            if feature >= 0:
+                thresholds[feature].append(threshold)
+    
+    X = np.zeros((rows, n_features), dtype=np.float64)
+    for k, values in enumerate(thresholds):
+        if not values:
+            continue
+        picked = rng.choice(np.asarray(values), rows).astype(np.float32)
+        shift = rng.integers(-1, 2, rows)
+        picked = np.where(shift < 0, np.nextafter(picked, np.float32(-np.inf)), picked)
+        picked = np.where(shift > 0, np.nextafter(picked, np.float32(np.inf)), picked)
+        X[:, k] = picked
+    return X
+
+
+@pytest.mark.parametrize('params', [
+    {},
+    {'max_depth': 5, 'n_estimators': 50, 'learning_rate': 0.2},
+    {'max_depth': 6, 'min_samples_leaf': 40},  # Leaves above the bottom level
+    {'init': 'zero', 'n_estimators': 30},
+])
+def test_matches_sklearn_on_random_rows(params):
+    model, X = fit_model(**params)
+    compiled = CompiledGradientBoosting.from_sklearn(model)
+    
+    rows = np.random.default_rng(1).normal(size=(1000, X.shape[1])) * X.std(axis=0) + X.mean(axis=0)
+    np.testing.assert_allclose(compiled.predict(rows), sklearn_predict(model, rows), rtol=0, atol=PARITY_TOLERANCE)
+
+
+@pytest.mark.parametrize('params', [{}, {'max_depth': 6, 'min_samples_leaf': 40}])
+def test_matches_sklearn_on_threshold_edges(params):
+    model, _ = fit_model(**params)
+    compiled = CompiledGradientBoosting.from_sklearn(model)
+    
+    rows = threshold_edge_rows(model)
+    np.testing.assert_allclose(compiled.predict(rows), sklearn_predict(model, rows), rtol=0, atol=PARITY_TOLERANCE)
+
+
+def test_matches_sklearn_with_feature_names_and_single_row():
+    names = ['vehicle_van', 'distance', 'traffic_factor', 'load_weight', 'temperature', 'elevation']
+    model, X = fit_model(feature_names=names)
+    compiled = compile_gradient_boosting(model, X)
+    
+    assert compiled is not None
+    assert compiled.feature_names == names
+    assert compiled.predict(X[0]).shape == (1,)
+    np.testing.assert_allclose(compiled.predict(X), sklearn_predict(model, X), rtol=0, atol=PARITY_TOLERANCE)
+
+
+def test_batches_larger_than_a_traversal_block():
+    model, X = fit_model(n_estimators=20)
+    compiled = CompiledGradientBoosting.from_sklearn(model)
+    
+    rows = np.tile(X, (10, 1))
+    np.testing.assert_allclose(compiled.predict(rows), sklearn_predict(model, rows), rtol=0, atol=PARITY_TOLERANCE)
+
+
+def test_unsupported_models_are_not_compiled():
+    from sklearn.ensemble import RandomForestRegressor
+    from sklearn.linear_model import LinearRegression
+    
+    rng = np.random.default_rng(0)
+    X, y = rng.normal(size=(100, 3)), rng.normal(size=100)
+    assert compile_gradient_boosting(LinearRegression().fit(X, y)) is None
+    assert compile_gradient_boosting(RandomForestRegressor(n_estimators=5).fit(X, y)) is None
+    
+    deep, _ = fit_model(max_depth=None, max_leaf_nodes=None, n_estimators=3, rows=3000)
+    assert deep.estimators_[0, 0].tree_.max_depth > 12
+    assert compile_gradient_boosting(deep) is None
@@ -0,0 +1,57 @@
+import numpy as np
+import pytest
+
+from utils.distance_matrix import (
+    haversine_distance,
+    haversine_distances,
+    haversine_matrix,
+    haversine_pairwise,
+    knn_distance_graph,
+)
+
+
+def random_points(count, seed=0):
+    rng = np.random.default_rng(seed)
+    lats = rng.uniform(-89, 89, count)
+    lngs = rng.uniform(-180, 180, count)
+    # Identical, antipodal and date-line crossing points
+    lats[:4] = [10, 10, 45, -45]
+    lngs[:4] = [20, 20, 179.9, -0.1]
+    return lats, lngs
+
+
+def scalar_matrix(lats1, lngs1, lats2, lngs2):
+    return np.array([[haversine_distance(a, b, c, d) for c, d in zip(lats2, lngs2)] for a, b in zip(lats1, lngs1)])
+
+
+def test_vectorized_distances_match_the_scalar_formula():
+    lats, lngs = random_points(40)
+    other_lats, other_lngs = random_points(25, seed=1)
+    expected = scalar_matrix(lats, lngs, other_lats, other_lngs)
+    
+    np.testing.assert_allclose(haversine_distances(lats, lngs, other_lats, other_lngs), expected, rtol=1e-12, atol=1e-9)
+    np.testing.assert_allclose(haversine_pairwise(lats[:25], lngs[:25], other_lats, other_lngs),
+                               np.diag(expected[:25]), rtol=1e-12, atol=1e-9)
+
+
+@pytest.mark.parametrize('block_size', [1, 7, 1024])
+def test_matrix_matches_the_scalar_formula(block_size):
+    lats, lngs = random_points(30)
+    expected = scalar_matrix(lats, lngs, lats, lngs)
+    
+    matrix = haversine_matrix(lats, lngs, block_size=block_size)
+    np.testing.assert_allclose(matrix, expected, rtol=1e-12, atol=1e-9)
+    assert np.array_equal(matrix, matrix.T)
+    assert not np.diag(matrix).any()
+    
+    np.testing.assert_allclose(haversine_matrix(lats, lngs, dtype=np.float32, block_size=block_size), expected,
+                               rtol=1e-6, atol=1e-3)
+
+
+def test_neighbor_graph_distances_match_the_scalar_formula():
+    lats, lngs = random_points(50)
+    graph = knn_distance_graph([{'lat': lat, 'lng': lng} for lat, lng in zip(lats, lngs)], k=5)
+    
+    for i in range(len(graph)):
+        for j in list(graph.neighbors(i)) + [(i + 17) % len(graph)]:
+            assert graph[i][j] == pytest.approx(haversine_distance(lats[i], lngs[i], lats[j], lngs[j]), abs=1e-9)
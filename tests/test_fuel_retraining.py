@@ -0,0 +1,110 @@
+import pytest
+
+from models.fuel_consumption_model import INCREMENTAL_ESTIMATORS, FuelConsumptionPredictor
+from models.fuel_data_collector import (
+    MIN_TRAINING_RECORDS,
+    TRAINING_FEATURES,
+    FuelDataCollector,
+    load_training_state,
+)
+
+
+def synthetic_records(count, seed, **overrides):
+    samples = FuelConsumptionPredictor.__new__(FuelConsumptionPredictor).generate_synthetic_training_data(count, seed)
+    records = []
+    for row in samples.to_dict('records'):
+        record = {feature: row[feature] for feature in TRAINING_FEATURES}
+        record.update(predicted_fuel=row['fuel_consumption'], actual_fuel=row['fuel_consumption'], **overrides)
+        records.append(record)
+    return records
+
+
+@pytest.fixture
+def collector(tmp_path):
+    collector = FuelDataCollector(None, model_path=str(tmp_path / 'fuel_model.pkl'))
+    collector.training_data_path = str(tmp_path / 'fuel_training_data.db')
+    collector.legacy_training_data_path = str(tmp_path / 'fuel_training_data.csv')
+    return collector
+
+
+def append(collector, records):
+    for record in records:
+        collector._append_training_record(record)
+
+
+def last_run(collector):
+    return load_training_state(collector.model_path)['runs'][-1]
+
+
+def test_first_run_needs_enough_records(collector):
+    append(collector, synthetic_records(MIN_TRAINING_RECORDS - 1, seed=0))
+    assert not collector.retrain_model()
+    
+    append(collector, synthetic_records(1, seed=1))
+    assert collector.retrain_model()
+    assert last_run(collector)['mode'] == 'full'
+    assert last_run(collector)['reason'] == 'no trained model'
+
+
+def test_small_batches_accumulate_before_a_warm_start(collector):
+    append(collector, synthetic_records(200, seed=0))
+    assert collector.retrain_model()
+    first_id = load_training_state(collector.model_path)['last_record_id']
+    
+    # A single new trip does not add trees, and stays pending
+    append(collector, synthetic_records(1, seed=1))
+    assert not collector.retrain_model()
+    assert load_training_state(collector.model_path)['last_record_id'] == first_id
+    
+    append(collector, synthetic_records(MIN_TRAINING_RECORDS - 1, seed=2))
+    assert collector.retrain_model()
+    run = last_run(collector)
+    assert run['mode'] == 'incremental'
+    assert run['records'] == MIN_TRAINING_RECORDS
+    assert run['trees'] == 100 + INCREMENTAL_ESTIMATORS
+    assert load_training_state(collector.model_path)['last_record_id'] == first_id + MIN_TRAINING_RECORDS
+
+
+def test_forced_update_does_not_wait(collector):
+    append(collector, synthetic_records(200, seed=0))
+    assert collector.retrain_model()
+    
+    append(collector, synthetic_records(1, seed=1))
+    assert collector.retrain_model(force=True)
+    assert last_run(collector)['mode'] == 'incremental'
+
+
+def test_unseen_category_and_drift_trigger_a_full_refit(collector):
+    append(collector, synthetic_records(200, seed=0, road_type='urban'))
+    assert collector.retrain_model()
+    
+    append(collector, synthetic_records(MIN_TRAINING_RECORDS, seed=1, road_type='highway'))
+    assert collector.retrain_model()
+    run = last_run(collector)
+    assert run['mode'] == 'full'
+    assert run['reason'].startswith('unseen road_type')
+    
+    # Establish a reference error, then records whose fuel is far off the model
+    append(collector, synthetic_records(MIN_TRAINING_RECORDS, seed=2, road_type='urban'))
+    assert collector.retrain_model()
+    assert last_run(collector)['mode'] == 'incremental'
+    
+    drifted = synthetic_records(MIN_TRAINING_RECORDS, seed=3, road_type='urban')
+    for record in drifted:
+        record['actual_fuel'] *= 3
+    append(collector, drifted)
+    assert collector.retrain_model()
+    run = last_run(collector)
+    assert run['mode'] == 'full'
+    assert run['reason'].startswith('drift')
+
+
+def test_requested_full_refit(collector):
+    append(collector, synthetic_records(200, seed=0))
+    assert collector.retrain_model()
+    
+    append(collector, synthetic_records(MIN_TRAINING_RECORDS, seed=1))
+    assert collector.retrain_model(full_refit=True)
+    run = last_run(collector)
+    assert run['mode'] == 'full' and run['reason'] == 'requested'
+    assert run['records'] == 200 + MIN_TRAINING_RECORDS
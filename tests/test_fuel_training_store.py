@@ -0,0 +1,108 @@
+import sqlite3
+
+import numpy as np
+import pandas as pd
+import pytest
+
+import models.fuel_training_store as fuel_training_store
+from models.fuel_data_collector import FuelDataCollector
+from models.fuel_training_store import FuelTrainingStore, get_training_store
+
+
+def random_records(count, seed=0):
+    rng = np.random.default_rng(seed)
+    records = []
+    for k in range(count):
+        predicted = float(rng.uniform(2, 20))
+        actual = float(rng.choice([0.0, predicted, predicted * rng.uniform(0.7, 1.3)], p=[0.05, 0.1, 0.85]))
+        records.append({
+            'route_id': k,
+            'vehicle_id': int(rng.integers(1, 5)),
+            'predicted_fuel': predicted,
+            'actual_fuel': actual,
+            # Some records only have predicted and actual fuel
+            'prediction_error': actual - predicted if k % 3 else None,
+            'distance': float(rng.uniform(1, 100)),
+            'vehicle_type': str(rng.choice(['van', 'truck', 'car'])),
+            'road_type': str(rng.choice(['urban', 'highway', 'mixed'])),
+            'date_recorded': f"2024-01-01 00:{k // 60:02d}:{k % 60:02d}"
+        })
+    return records
+
+
+def recomputed_accuracy(df):
+    """Accuracy metrics computed from all records, as analyze_prediction_accuracy did before the aggregates."""
+    error = df['prediction_error'].fillna(df['actual_fuel'] - df['predicted_fuel'])
+    error_percent = np.where(df['actual_fuel'] > 0, error / df['actual_fuel'] * 100, 0)
+    df = df.assign(prediction_error=error, error_percent=np.abs(error_percent))
+    recent = df.sort_values('date_recorded', ascending=False).head(10)
+    return {
+        'record_count': len(df),
+        'mean_absolute_error': df['prediction_error'].abs().mean(),
+        'mean_error_percent': df['error_percent'].mean(),
+        'overestimation_rate': (df['prediction_error'] > 0).mean() * 100,
+        'underestimation_rate': (df['prediction_error'] < 0).mean() * 100,
+        'by_vehicle_type': {value: (len(group), 100 - group['error_percent'].mean())
+                            for value, group in df.groupby('vehicle_type')},
+        'by_road_type': {value: (len(group), 100 - group['error_percent'].mean())
+                         for value, group in df.groupby('road_type')},
+        'recent_accuracy': 100 - recent['error_percent'].mean()
+    }
+
+
+def assert_matches_recomputation(metrics, expected):
+    assert metrics['record_count'] == expected['record_count']
+    for key in ['mean_absolute_error', 'mean_error_percent', 'overestimation_rate', 'underestimation_rate']:
+        assert metrics[key] == pytest.approx(expected[key])
+    for key in ['by_vehicle_type', 'by_road_type']:
+        assert set(metrics[key]) == set(expected[key])
+        for value, (count, accuracy) in expected[key].items():
+            assert metrics[key][value]['count'] == count
+            assert metrics[key][value]['accuracy'] == pytest.approx(accuracy)
+    assert metrics['recent_trend']['count'] == 10
+    assert metrics['recent_trend']['accuracy'] == pytest.approx(expected['recent_accuracy'])
+
+
+@pytest.fixture
+def collector(tmp_path):
+    collector = FuelDataCollector(None, model_path=str(tmp_path / 'fuel_model.pkl'))
+    collector.training_data_path = str(tmp_path / 'fuel_training_data.db')
+    collector.legacy_training_data_path = str(tmp_path / 'fuel_training_data.csv')
+    return collector
+
+
+def test_appended_aggregates_match_full_recomputation(collector):
+    for record in random_records(37):
+        collector._append_training_record(record)
+    
+    df = collector._load_training_data()
+    assert_matches_recomputation(collector.analyze_prediction_accuracy(), recomputed_accuracy(df))
+
+
+def test_imported_aggregates_match_full_recomputation(collector):
+    pd.DataFrame(random_records(25, seed=1)).to_csv(collector.legacy_training_data_path, index=False)
+    collector._append_training_record(dict(random_records(1, seed=2)[0], date_recorded='2024-01-02 00:00:00'))
+    
+    df = collector._load_training_data()
+    assert len(df) == 26
+    assert_matches_recomputation(collector.analyze_prediction_accuracy(), recomputed_accuracy(df))
+
+
+def test_empty_store_reports_no_data(collector):
+    metrics = collector.analyze_prediction_accuracy()
+    assert metrics['no_data'] and metrics['record_count'] == 0
+
+
+def test_store_is_shared_and_reads_skip_the_write_lock(collector, monkeypatch):
+    assert collector._training_store() is get_training_store(collector.training_data_path,
+                                                             collector.legacy_training_data_path)
+    collector._append_training_record(random_records(1)[0])
+    
+    # Another worker holds the write lock; a store that was never used in this process can still read
+    monkeypatch.setattr(fuel_training_store, 'BUSY_TIMEOUT_SECONDS', 0.1)
+    with sqlite3.connect(collector.training_data_path) as writer:
+        writer.execute("BEGIN IMMEDIATE")
+        fresh = FuelTrainingStore(collector.training_data_path)
+        assert fresh.accuracy_aggregates()['all']['']['count'] == 1
+        assert fresh.count() == 1
+        writer.execute("ROLLBACK")
@@ -0,0 +1,81 @@
+import numpy as np
+import pytest
+
+import utils.location_matrix as location_matrix
+from utils.distance_matrix import haversine_matrix
+from utils.location_matrix import LocationDistanceMatrix
+
+
+def random_locations(count, seed=0, first_id=1):
+    rng = np.random.default_rng(seed)
+    return [(first_id + k, float(lat), float(lng))
+            for k, (lat, lng) in enumerate(zip(rng.uniform(40.5, 41, count), rng.uniform(-74.2, -73.7, count)))]
+
+
+def expected_matrix(locations):
+    return haversine_matrix(np.array([lat for _, lat, _ in locations]), np.array([lng for _, _, lng in locations]))
+
+
+@pytest.fixture
+def no_disk_cache(monkeypatch):
+    # load() goes through the on-disk distance matrix cache, which tests must not write to
+    monkeypatch.setattr(location_matrix, 'get_cached_distance_matrix',
+                        lambda coordinates, dtype=None: haversine_matrix(
+                            np.array([c['lat'] for c in coordinates]), np.array([c['lng'] for c in coordinates])))
+
+
+def test_upsert_and_remove_match_a_full_recomputation(no_disk_cache):
+    maintained = LocationDistanceMatrix(initial_capacity=4)
+    locations = random_locations(30)
+    maintained.load(locations[:10])
+    
+    maintained.upsert(locations[10:])
+    np.testing.assert_allclose(maintained.matrix_for(locations), expected_matrix(locations), rtol=0, atol=1e-9)
+    
+    # Move one location, remove a few from the middle and the end
+    moved = (locations[3][0], locations[3][1] + 0.05, locations[3][2] - 0.05)
+    maintained.upsert([moved])
+    maintained.remove([locations[5][0], locations[12][0], locations[-1][0]])
+    remaining = [moved if loc[0] == moved[0] else loc for loc in locations
+                 if loc[0] not in (locations[5][0], locations[12][0], locations[-1][0])]
+    
+    assert len(maintained) == len(remaining)
+    assert locations[5][0] not in maintained
+    np.testing.assert_allclose(maintained.matrix_for(remaining), expected_matrix(remaining), rtol=0, atol=1e-9)
+    
+    # matrix_for follows the requested order and patches in unknown locations
+    subset = [remaining[7], remaining[0]] + random_locations(2, seed=1, first_id=100)
+    np.testing.assert_allclose(maintained.matrix_for(subset), expected_matrix(subset), rtol=0, atol=1e-9)
+
+
+def test_growth_is_gradual(no_disk_cache):
+    maintained = LocationDistanceMatrix(initial_capacity=1000)
+    maintained.load(random_locations(1000))
+    maintained.upsert(random_locations(1, seed=1, first_id=5000))
+    
+    assert len(maintained._lats) == 1250
+
+
+def test_too_large_matrix_is_not_maintained(monkeypatch, no_disk_cache):
+    monkeypatch.setattr(location_matrix, 'TILED_MATRIX_THRESHOLD', 20)
+    monkeypatch.setattr(location_matrix, 'calculate_distance_matrix',
+                        lambda coordinates: haversine_matrix(
+                            np.array([c['lat'] for c in coordinates]), np.array([c['lng'] for c in coordinates])))
+    
+    maintained = LocationDistanceMatrix(initial_capacity=4)
+    maintained.load(random_locations(25))
+    assert maintained.loaded and maintained.too_large
+    
+    maintained.upsert(random_locations(5, seed=1, first_id=100))
+    maintained.remove([1, 2])
+    assert len(maintained) == 0
+    assert maintained._matrix.size == 0
+    
+    subset = random_locations(5, seed=2)
+    np.testing.assert_allclose(maintained.matrix_for(subset), expected_matrix(subset), rtol=0, atol=1e-9)
+    
+    # Inserts that cross the threshold drop a maintained matrix
+    maintained = LocationDistanceMatrix(initial_capacity=4)
+    maintained.load(random_locations(15))
+    maintained.upsert(random_locations(10, seed=3, first_id=100))
+    assert maintained.too_large and len(maintained) == 0
@@ -0,0 +1,48 @@
+import numpy as np
+
+from models.model_registry import ModelRegistry, model_registry
+from models.time_predictor import TravelTimePredictor, load_time_lookup_table
+
+
+def read_text(path):
+    with open(path) as f:
+        return f.read()
+
+
+def test_peek_never_loads(tmp_path):
+    path = str(tmp_path / 'model.txt')
+    with open(path, 'w') as f:
+        f.write('first')
+    registry = ModelRegistry()
+    
+    assert registry.peek(path, read_text) is None
+    assert registry.stats['misses'] == 0
+    
+    assert registry.get(path, read_text) == 'first'
+    assert registry.peek(path, read_text) == 'first'
+    
+    # A changed file is only reloaded by get()
+    with open(path, 'w') as f:
+        f.write('second, longer')
+    assert registry.peek(path, read_text) is None
+    assert registry.stats['misses'] == 1
+
+
+def test_lookup_report_does_not_build_the_table(tmp_path):
+    model_path = str(tmp_path / 'time_prediction_model.pkl')
+    assert TravelTimePredictor(model_path=model_path).lookup_table_report() is None
+    
+    rng = np.random.default_rng(0)
+    distances = rng.uniform(1, 50, 40)
+    TravelTimePredictor(model_path=model_path).train(list(distances), list(distances * 2 + rng.normal(0, 1, 40)))
+    
+    # Another process: the model is loaded on demand, the table only when a prediction needs it
+    model_registry.invalidate(model_path)
+    predictor = TravelTimePredictor(model_path=model_path)
+    assert predictor.lookup_table_report() == {'built': False}
+    assert model_registry.peek(model_path, load_time_lookup_table) is None
+    
+    assert predictor.lookup_table() is not None
+    report = predictor.lookup_table_report()
+    assert report['built'] and 'used' in report
+    model_registry.invalidate(model_path)
@@ -0,0 +1,88 @@
+import time
+from concurrent.futures import ProcessPoolExecutor
+
+import numpy as np
+import pytest
+
+import models.routing_model as routing_model
+from models.routing_model import (
+    DEFAULT_STRATEGY,
+    PORTFOLIO_STRATEGIES,
+    _solve_strategy,
+    build_routing_model,
+    portfolio_strategies,
+    strategy_name,
+)
+from utils.distance_matrix import haversine_matrix
+
+
+def small_model(n=8, vehicle_count=2):
+    rng = np.random.default_rng(0)
+    lats = rng.uniform(40.6, 40.9, n + 1)
+    lngs = rng.uniform(-74.1, -73.8, n + 1)
+    return build_routing_model(haversine_matrix(lats, lngs), vehicle_count, speeds_kmh=[40],
+                               demands=[0] + [1] * n, vehicle_capacities=[n] * vehicle_count)
+
+
+@pytest.fixture
+def workers(monkeypatch):
+    # Searches reserve processes of the shared pool; start each test with all of them free
+    monkeypatch.setattr(routing_model, '_portfolio_busy', 0)
+    monkeypatch.setattr(routing_model, '_portfolio_rotation', 0)
+    
+    def set_workers(count):
+        monkeypatch.setattr(routing_model, 'PORTFOLIO_WORKERS', count)
+    return set_workers
+
+
+def test_strategies_rotate_on_fewer_workers(workers):
+    assert portfolio_strategies(len(PORTFOLIO_STRATEGIES)) == PORTFOLIO_STRATEGIES
+    
+    raced = set()
+    for _ in range(len(PORTFOLIO_STRATEGIES) - 1):
+        strategies = portfolio_strategies(2)
+        assert len(strategies) == 2 and strategies[0] == DEFAULT_STRATEGY
+        raced.update(strategies)
+    assert raced == set(PORTFOLIO_STRATEGIES)
+
+
+def test_workers_are_reserved_per_search(workers):
+    workers(3)
+    assert routing_model.reserve_portfolio_workers(2) == 2
+    assert routing_model.reserve_portfolio_workers(len(PORTFOLIO_STRATEGIES)) == 1
+    assert routing_model.reserve_portfolio_workers(1) == 0
+    routing_model.release_portfolio_workers(3)
+    assert routing_model.reserve_portfolio_workers(len(PORTFOLIO_STRATEGIES)) == 3
+
+
+def test_single_worker_solves_in_process_and_reports_skipped(workers):
+    workers(1)
+    model = small_model()
+    
+    solution = model.solve_portfolio(1)
+    assert solution is not None
+    trace = model.trace.to_dict()
+    assert trace['strategy'] == strategy_name(DEFAULT_STRATEGY)
+    
+    summary = {result['strategy']: result['stop_reason'] for result in trace['portfolio']}
+    assert set(summary) == {strategy_name(strategy) for strategy in PORTFOLIO_STRATEGIES}
+    assert [name for name, stop_reason in summary.items() if stop_reason == 'skipped'] == \
+        [strategy_name(strategy) for strategy in PORTFOLIO_STRATEGIES[1:]]
+    assert routing_model._portfolio_busy == 0
+
+
+def test_raced_strategies_are_not_queued(workers):
+    model = small_model()
+    with ProcessPoolExecutor(max_workers=2) as pool:
+        solution = model.solve_portfolio(1, pool=pool, workers=2)
+    
+    assert solution is not None
+    stop_reasons = [result['stop_reason'] for result in model.trace.to_dict()['portfolio']]
+    assert 'not_started' not in stop_reasons
+    assert stop_reasons.count('skipped') == len(PORTFOLIO_STRATEGIES) - 2
+
+
+def test_strategy_past_its_deadline_is_not_started():
+    result = _solve_strategy(small_model().build_arguments, DEFAULT_STRATEGY, time.time() - 1)
+    assert result['objective'] is None
+    assert result['trace']['stop_reason'] == 'not_started'
@@ -3,10 +3,25 @@ import json
 import time
 import numpy as np
 import os
+import hashlib
 from math import radians, sin, cos, sqrt, atan2
 import networkx as nx
 from queue import PriorityQueue
 
+# Earth's radius in kilometers
+EARTH_RADIUS_KM = 6371
+
+# Above this many points the matrix is built into a memory-mapped file
+# (see utils.tiled_matrix) instead of a dense in-memory ndarray
+TILED_MATRIX_THRESHOLD = 20000
+
+# Above this many points routing uses a sparse k-nearest-neighbour graph
+# (see knn_distance_graph) and the solver is only offered neighbour arcs
+SPARSE_ROUTING_THRESHOLD = 2000
+
+# Default number of neighbours per point in sparse mode
+DEFAULT_NEIGHBOR_COUNT = 16
+
 def haversine_distance(lat1, lon1, lat2, lon2):
     """
     Calculate the great-circle distance between two points
@@ -31,65 +46,368 @@ def haversine_distance(lat1, lon1, lat2, lon2):
     
     return radius * c
 
-def calculate_distance_matrix(coordinates, use_osrm=False, osrm_server=None):
+def coordinate_arrays(coordinates):
+    """
+    Split a list of coordinate dicts into latitude and longitude arrays.
+    
+    Args:
+        coordinates (list): List of dicts with 'lat' and 'lng' keys
+        
+    Returns:
+        tuple: (latitudes, longitudes) as float64 ndarrays in degrees
+    """
+    n = len(coordinates)
+    lats = np.fromiter((c['lat'] for c in coordinates), dtype=np.float64, count=n)
+    lngs = np.fromiter((c['lng'] for c in coordinates), dtype=np.float64, count=n)
+    return lats, lngs
+
+def coordinate_fingerprint(lats, lngs):
+    """
+    Content hash of an ordered coordinate set.
+    
+    Args:
+        lats, lngs: Arrays of coordinates in degrees
+        
+    Returns:
+        str: Hex digest that changes whenever any coordinate or their order changes
+    """
+    digest = hashlib.sha1()
+    digest.update(np.ascontiguousarray(lats, dtype=np.float64).tobytes())
+    digest.update(np.ascontiguousarray(lngs, dtype=np.float64).tobytes())
+    return digest.hexdigest()
+
+def haversine_pairwise(lats1, lngs1, lats2, lngs2):
+    """
+    Element-wise haversine distances between two broadcastable sets of points.
+    
+    Args:
+        lats1, lngs1: Coordinates of the first points in degrees
+        lats2, lngs2: Coordinates of the second points in degrees
+        
+    Returns:
+        ndarray: Distances in kilometers, with the broadcast shape of the inputs
+    """
+    lat1 = np.radians(np.asarray(lats1, dtype=np.float64))
+    lon1 = np.radians(np.asarray(lngs1, dtype=np.float64))
+    lat2 = np.radians(np.asarray(lats2, dtype=np.float64))
+    lon2 = np.radians(np.asarray(lngs2, dtype=np.float64))
+    
+    # Same formula as haversine_distance
+    a = np.sin((lat2 - lat1) / 2) ** 2 + np.cos(lat1) * np.cos(lat2) * np.sin((lon2 - lon1) / 2) ** 2
+    c = 2 * np.arcsin(np.sqrt(np.clip(a, 0.0, 1.0)))
+    
+    return EARTH_RADIUS_KM * c
+
+def haversine_distances(lats1, lngs1, lats2, lngs2):
+    """
+    Vectorized haversine distances between two sets of points.
+    
+    Args:
+        lats1, lngs1: Arrays of shape (m,) with the source coordinates in degrees
+        lats2, lngs2: Arrays of shape (n,) with the destination coordinates in degrees
+        
+    Returns:
+        ndarray: (m, n) matrix of distances in kilometers
+    """
+    return haversine_pairwise(np.asarray(lats1)[:, None], np.asarray(lngs1)[:, None],
+                              np.asarray(lats2)[None, :], np.asarray(lngs2)[None, :])
+
+def haversine_matrix(lats, lngs, dtype=np.float64, block_size=1024):
+    """
+    Build a symmetric haversine distance matrix.
+    
+    Rows are processed in blocks and each block is only computed against
+    the columns to its right, so roughly half of the pairs are evaluated
+    and the other half is filled in by mirroring.
+    
+    Args:
+        lats, lngs: Arrays of shape (n,) with coordinates in degrees
+        dtype: Output dtype (np.float64 or np.float32)
+        block_size (int): Number of rows computed per block
+        
+    Returns:
+        ndarray: (n, n) matrix of distances in kilometers
+    """
+    lats = np.asarray(lats, dtype=np.float64)
+    lngs = np.asarray(lngs, dtype=np.float64)
+    n = len(lats)
+    matrix = np.zeros((n, n), dtype=dtype)
+    
+    for start in range(0, n, block_size):
+        stop = min(start + block_size, n)
+        block = haversine_distances(lats[start:stop], lngs[start:stop], lats[start:], lngs[start:])
+        matrix[start:stop, start:] = block
+        matrix[start:, start:stop] = block.T
+    
+    np.fill_diagonal(matrix, 0)
+    return matrix
+
+class KNNDistanceGraph:
+    """
+    Sparse k-nearest-neighbour distance graph stored in CSR form.
+    
+    Only the distances between each point and its k nearest neighbours
+    (made symmetric), plus every arc to and from the depot (node 0), are
+    stored, so memory is O(N*k) instead of O(N^2). The graph can be indexed
+    like a dense matrix (graph[i][j] or graph[i, j]); distances for arcs
+    that are not stored fall back to the haversine formula. Graphs of other
+    arc values over the same arcs (e.g. travel times) pass their own
+    fallback.
+    """
+    def __init__(self, lats, lngs, csr, fallback=None):
+        """
+        Args:
+            lats, lngs: Arrays of shape (n,) with coordinates in degrees
+            csr (scipy.sparse.csr_matrix): (n, n) neighbour distances in kilometers
+            fallback (callable, optional): fallback(i, j) gives the value of
+                an arc that is not stored, haversine distance by default.
+                Must be picklable for portfolio mode
+        """
+        self.lats = lats
+        self.lngs = lngs
+        self.csr = csr
+        self.csr.sort_indices()
+        self.fallback = fallback
+    
+    @property
+    def shape(self):
+        return self.csr.shape
+    
+    def __len__(self):
+        return self.csr.shape[0]
+    
+    def __getitem__(self, key):
+        if isinstance(key, tuple):
+            return self.distance(*key)
+        return _KNNGraphRow(self, key)
+    
+    def neighbors(self, i):
+        """Return the indices of the nodes directly reachable from node i."""
+        return self.csr.indices[self.csr.indptr[i]:self.csr.indptr[i + 1]]
+    
+    def distance(self, i, j):
+        """Distance in kilometers between nodes i and j."""
+        if i == j:
+            return 0.0
+        start, stop = self.csr.indptr[i], self.csr.indptr[i + 1]
+        position = start + np.searchsorted(self.csr.indices[start:stop], j)
+        if position < stop and self.csr.indices[position] == j:
+            return float(self.csr.data[position])
+        if self.fallback is not None:
+            return self.fallback(i, j)
+        return haversine_distance(self.lats[i], self.lngs[i], self.lats[j], self.lngs[j])
+    
+    def tolist(self):
+        """Materialise the graph as a dense nested list (only sensible for small graphs)."""
+        n = len(self)
+        return [[self.distance(i, j) for j in range(n)] for i in range(n)]
+
+class _KNNGraphRow:
+    """Row view returned by KNNDistanceGraph[i] so graph[i][j] works like a dense matrix."""
+    def __init__(self, graph, i):
+        self.graph = graph
+        self.i = i
+    
+    def __getitem__(self, j):
+        return self.graph.distance(self.i, j)
+    
+    def __len__(self):
+        return len(self.graph)
+
+def knn_distance_graph(coordinates, k=DEFAULT_NEIGHBOR_COUNT, depot_index=0):
+    """
+    Build a sparse k-nearest-neighbour distance graph.
+    
+    Neighbours are found with a KD-tree on an equirectangular projection of
+    the coordinates (km), then exact haversine distances are computed for
+    the selected pairs only.
+    
+    Args:
+        coordinates (list): List of dicts with 'lat' and 'lng' keys
+        k (int): Number of neighbours per point
+        depot_index (int, optional): Node connected to every other node, None to disable
+        
+    Returns:
+        KNNDistanceGraph: Sparse distance graph
+    """
+    from scipy.sparse import csr_matrix
+    from sklearn.neighbors import KDTree
+    
+    lats, lngs = coordinate_arrays(coordinates)
+    n = len(lats)
+    k = min(k, n - 1)
+    
+    rows = np.empty(0, dtype=np.int64)
+    cols = np.empty(0, dtype=np.int64)
+    
+    if k > 0:
+        # Project to a local plane in km, like the clustering module does
+        lat_scale = 111.0
+        lng_scale = 111.0 * np.cos(np.radians(np.mean(lats)))
+        projected = np.column_stack((lats * lat_scale, lngs * lng_scale))
+        
+        _, neighbours = KDTree(projected).query(projected, k=k + 1)
+        rows = np.repeat(np.arange(n, dtype=np.int64), k + 1)
+        cols = neighbours.ravel().astype(np.int64)
+    
+    if depot_index is not None and n > 1:
+        others = np.arange(n, dtype=np.int64)
+        rows = np.concatenate((rows, np.full(n, depot_index, dtype=np.int64)))
+        cols = np.concatenate((cols, others))
+    
+    # Make the graph symmetric, drop self-loops and duplicates
+    rows, cols = np.concatenate((rows, cols)), np.concatenate((cols, rows))
+    keep = rows != cols
+    keys = np.unique(rows[keep] * n + cols[keep])
+    rows, cols = keys // n, keys % n
+    
+    data = haversine_pairwise(lats[rows], lngs[rows], lats[cols], lngs[cols])
+    csr = csr_matrix((data, (rows, cols)), shape=(n, n))
+    
+    return KNNDistanceGraph(lats, lngs, csr)
+
+def calculate_distance_matrix(coordinates, use_osrm=False, osrm_server=None, dtype=None, sparse_k=None):
     """
     Calculate a distance matrix between all points.
+    
+    Args:
+        coordinates (list): List of dicts with 'lat' and 'lng' keys
+        use_osrm (bool): Fetch road distances from an OSRM server
+        osrm_server (str, optional): URL of the OSRM server
+        dtype: Output dtype (np.float64 or np.float32), defaults to float64
+            for in-memory matrices and float32 for tiled ones
+        sparse_k (int, optional): If set, return a KNNDistanceGraph with this
+            many neighbours per point instead of a dense matrix
+        
+    Returns:
+        ndarray: (n, n) matrix of distances in kilometers, a TiledDistanceMatrix
+        for more than TILED_MATRIX_THRESHOLD points, or a KNNDistanceGraph in
+        sparse mode
     """
     n = len(coordinates)
-    distance_matrix = [[0 for _ in range(n)] for _ in range(n)]
     
     # Print debug information
     print(f"Calculating distances between {n} points")
     print(f"First coordinate: {coordinates[0] if coordinates else 'None'}")
     
+    # Sparse mode keeps only the nearest-neighbour arcs
+    if sparse_k:
+        return knn_distance_graph(coordinates, k=sparse_k)
+    
+    # Road distances from OSRM when a server is configured
+    if use_osrm and osrm_server:
+        try:
+            return osrm_distance_matrix(coordinates, osrm_server).astype(np.float64 if dtype is None else dtype, copy=False)
+        except Exception as e:
+            print(f"OSRM distance matrix failed, falling back to haversine: {e}")
+    
+    # Very large stop sets go to a disk-backed matrix so memory stays bounded
+    if n > TILED_MATRIX_THRESHOLD:
+        from utils.tiled_matrix import TiledDistanceMatrix
+        return TiledDistanceMatrix.build(coordinates, dtype=np.float32 if dtype is None else dtype)
+    
     # Fall back to direct haversine distances
-    for i in range(n):
-        for j in range(n):
-            if i == j:
-                distance_matrix[i][j] = 0
-            else:
-                lat1 = coordinates[i]['lat']
-                lng1 = coordinates[i]['lng']
-                lat2 = coordinates[j]['lat']
-                lng2 = coordinates[j]['lng']
-                
-                distance_matrix[i][j] = haversine_distance(lat1, lng1, lat2, lng2)
+    lats, lngs = coordinate_arrays(coordinates)
+    return haversine_matrix(lats, lngs, dtype=np.float64 if dtype is None else dtype)
+
+
+def _osrm_session(pool_size, retries, backoff):
+    """HTTP session with a connection pool and retry/backoff for OSRM requests."""
+    from requests.adapters import HTTPAdapter
+    from urllib3.util.retry import Retry
     
-    return distance_matrix
+    retry = Retry(
+        total=retries,
+        backoff_factor=backoff,
+        status_forcelist=(429, 500, 502, 503, 504),
+        allowed_methods=frozenset(['GET'])
+    )
+    adapter = HTTPAdapter(pool_connections=pool_size, pool_maxsize=pool_size, max_retries=retry)
+    
+    session = requests.Session()
+    session.mount('http://', adapter)
+    session.mount('https://', adapter)
+    return session
 
+def _osrm_table_block(session, osrm_server, coordinates, sources, destinations, timeout):
+    """
+    Fetch one source x destination block of the OSRM table.
+    
+    Returns:
+        ndarray: (len(sources), len(destinations)) distances in meters (NaN if unreachable)
+    """
+    # Send the union of source and destination points once and index into it
+    points = list(dict.fromkeys(list(sources) + list(destinations)))
+    position = {p: i for i, p in enumerate(points)}
+    
+    coords_str = ";".join([f"{coordinates[p]['lng']},{coordinates[p]['lat']}" for p in points])
+    source_str = ";".join(str(position[p]) for p in sources)
+    destination_str = ";".join(str(position[p]) for p in destinations)
+    url = (f"{osrm_server}/table/v1/driving/{coords_str}"
+           f"?annotations=distance&sources={source_str}&destinations={destination_str}")
+    
+    response = session.get(url, timeout=timeout)
+    
+    if response.status_code == 200:
+        data = response.json()
+        if 'distances' in data:
+            return np.array(data['distances'], dtype=np.float64)
+    
+    raise Exception(f"OSRM request failed with status {response.status_code}")
 
-def osrm_distance_matrix(coordinates, osrm_server):
+def osrm_distance_matrix(coordinates, osrm_server, block_size=100, max_workers=8, retries=3, backoff=0.5, timeout=30):
     """
     Calculate a distance matrix using OSRM.
     
+    The matrix is split into source/destination blocks so each request stays
+    below OSRM's URL and table size limits. Blocks are fetched concurrently
+    over a pooled HTTP session with retry and exponential backoff, then
+    assembled into a single matrix.
+    
     Args:
         coordinates (list): List of dicts with 'lat' and 'lng' keys
         osrm_server (str): URL of OSRM server
+        block_size (int): Maximum number of sources (and destinations) per request
+        max_workers (int): Number of concurrent requests
+        retries (int): Retries per request on connection errors and 429/5xx responses
+        backoff (float): Backoff factor between retries, in seconds
+        timeout (float): Timeout per request, in seconds
         
     Returns:
-        list: 2D matrix of distances in kilometers
+        ndarray: (n, n) matrix of distances in kilometers
     """
-    # Prepare coordinates for OSRM request
-    coords_str = ";".join([f"{c['lng']},{c['lat']}" for c in coordinates])
+    from concurrent.futures import ThreadPoolExecutor
     
-    # Build the URL for the OSRM request
-    url = f"{osrm_server}/table/v1/driving/{coords_str}?annotations=distance"
+    n = len(coordinates)
+    distance_matrix = np.zeros((n, n), dtype=np.float64)
+    blocks = [list(range(i, min(i + block_size, n))) for i in range(0, n, block_size)]
+    tasks = [(sources, destinations) for sources in blocks for destinations in blocks]
     
-    # Make the request
-    response = requests.get(url)
+    session = _osrm_session(max_workers, retries, backoff)
+    try:
+        with ThreadPoolExecutor(max_workers=max_workers) as executor:
+            futures = [
+                (sources, destinations,
+                 executor.submit(_osrm_table_block, session, osrm_server, coordinates, sources, destinations, timeout))
+                for sources, destinations in tasks
+            ]
+            # If any block fails, the exception propagates so callers can fall back to haversine
+            for sources, destinations, future in futures:
+                distance_matrix[sources[0]:sources[-1] + 1, destinations[0]:destinations[-1] + 1] = future.result()
+    finally:
+        session.close()
     
-    if response.status_code == 200:
-        data = response.json()
-        
-        if 'distances' in data:
-            # OSRM returns distances in meters, convert to kilometers
-            distances = data['distances']
-            n = len(distances)
-            
-            return [[distances[i][j] / 1000 for j in range(n)] for i in range(n)]
+    # OSRM returns null for unreachable pairs, use the straight-line distance there
+    unreachable = np.isnan(distance_matrix)
     
-    # If OSRM request fails, throw an exception to fallback to haversine
-    raise Exception(f"OSRM request failed with status {response.status_code}")
+    # OSRM returns distances in meters, convert to kilometers
+    distance_matrix /= 1000
+    
+    if unreachable.any():
+        lats, lngs = coordinate_arrays(coordinates)
+        distance_matrix[unreachable] = haversine_matrix(lats, lngs)[unreachable]
+    
+    return distance_matrix
 
 def dijkstra_shortest_path(graph, start, end):
     """
@@ -125,7 +443,9 @@ def dijkstra_shortest_path(graph, start, end):
             continue
         
         # Check all neighbors
-        for neighbor, weight in graph[current_node].items():
+        for neighbor, attributes in graph[current_node].items():
+            # networkx adjacency maps neighbours to edge attribute dicts
+            weight = attributes.get('weight', 1) if isinstance(attributes, dict) else attributes
             distance = current_distance + weight
             
             # If we found a better path, update
@@ -153,6 +473,9 @@ def build_road_network(coordinates, distance_threshold=10.0):
     """
     Build a simple road network using coordinates.
     
+    Candidate edges are found with a KD-tree radius query on projected
+    coordinates instead of comparing every pair of nodes.
+    
     Args:
         coordinates (list): List of dicts with 'lat' and 'lng' keys
         distance_threshold (float): Maximum distance to consider for direct connections
@@ -160,6 +483,8 @@ def build_road_network(coordinates, distance_threshold=10.0):
     Returns:
         networkx.Graph: Graph representation of the road network
     """
+    rows, cols, weights = _road_network_edges(coordinates, distance_threshold)
+    
     # Create an empty graph
     G = nx.Graph()
     
@@ -167,87 +492,138 @@ def build_road_network(coordinates, distance_threshold=10.0):
     for i in range(len(coordinates)):
         G.add_node(i, pos=(coordinates[i]['lng'], coordinates[i]['lat']))
     
-    # Add edges (connect nodes within threshold distance)
-    for i in range(len(coordinates)):
-        for j in range(i + 1, len(coordinates)):
-            lat1 = coordinates[i]['lat']
-            lng1 = coordinates[i]['lng']
-            lat2 = coordinates[j]['lat']
-            lng2 = coordinates[j]['lng']
-            
-            distance = haversine_distance(lat1, lng1, lat2, lng2)
-            
-            if distance <= distance_threshold:
-                G.add_edge(i, j, weight=distance)
+    G.add_weighted_edges_from(zip(rows.tolist(), cols.tolist(), weights.tolist()))
+    
+    return G
+
+def _project_coordinates(lats, lngs):
+    """Equirectangular projection to a local plane in km."""
+    lat_scale = 111.0
+    lng_scale = 111.0 * np.cos(np.radians(np.mean(lats))) if len(lats) else lat_scale
+    return np.column_stack((lats * lat_scale, lngs * lng_scale))
+
+def _road_network_edges(coordinates, distance_threshold=10.0):
+    """
+    Edges of the simple road network as arrays.
+    
+    Nodes within distance_threshold km are connected. Disconnected
+    components are then chained together through their closest pair of
+    nodes, like the original all-pairs implementation.
+    
+    Returns:
+        tuple: (rows, cols, weights) with i < j for every edge
+    """
+    from scipy.sparse import csr_matrix
+    from scipy.sparse.csgraph import connected_components
+    from sklearn.neighbors import KDTree
+    
+    lats, lngs = coordinate_arrays(coordinates)
+    n = len(lats)
+    if n < 2:
+        empty = np.empty(0, dtype=np.int64)
+        return empty, empty, np.empty(0)
+    
+    projected = _project_coordinates(lats, lngs)
+    tree = KDTree(projected)
+    
+    # The projection is only approximate, so search a slightly larger radius
+    # and apply the exact haversine threshold afterwards
+    neighbours = tree.query_radius(projected, r=distance_threshold * 1.05)
+    counts = np.fromiter((len(nb) for nb in neighbours), dtype=np.int64, count=n)
+    rows = np.repeat(np.arange(n, dtype=np.int64), counts)
+    cols = np.concatenate(neighbours).astype(np.int64)
+    
+    keep = rows < cols
+    rows, cols = rows[keep], cols[keep]
+    weights = haversine_pairwise(lats[rows], lngs[rows], lats[cols], lngs[cols])
+    keep = weights <= distance_threshold
+    rows, cols, weights = rows[keep], cols[keep], weights[keep]
     
     # Ensure the graph is connected
-    if not nx.is_connected(G):
-        components = list(nx.connected_components(G))
+    adjacency = csr_matrix((np.ones(len(rows)), (rows, cols)), shape=(n, n))
+    n_components, labels = connected_components(adjacency, directed=False)
+    
+    if n_components > 1:
+        components = [np.flatnonzero(labels == c) for c in range(n_components)]
+        extra_rows, extra_cols, extra_weights = [], [], []
         
-        # Connect the largest components
-        for i in range(len(components) - 1):
-            comp1 = list(components[i])
-            comp2 = list(components[i + 1])
-            
-            # Find the closest pair between components
-            min_dist = float('inf')
-            best_pair = None
-            
-            for n1 in comp1:
-                for n2 in comp2:
-                    lat1 = coordinates[n1]['lat']
-                    lng1 = coordinates[n1]['lng']
-                    lat2 = coordinates[n2]['lat']
-                    lng2 = coordinates[n2]['lng']
-                    
-                    dist = haversine_distance(lat1, lng1, lat2, lng2)
-                    
-                    if dist < min_dist:
-                        min_dist = dist
-                        best_pair = (n1, n2)
-            
-            # Add the best edge
-            if best_pair:
-                G.add_edge(best_pair[0], best_pair[1], weight=min_dist)
+        # Connect consecutive components through their closest pair
+        for i in range(n_components - 1):
+            comp1, comp2 = components[i], components[i + 1]
+            _, nearest = KDTree(projected[comp2]).query(projected[comp1], k=1)
+            candidates = comp2[nearest[:, 0]]
+            distances = haversine_pairwise(lats[comp1], lngs[comp1], lats[candidates], lngs[candidates])
+            best = int(np.argmin(distances))
+            n1, n2 = int(comp1[best]), int(candidates[best])
+            extra_rows.append(min(n1, n2))
+            extra_cols.append(max(n1, n2))
+            extra_weights.append(distances[best])
+        
+        rows = np.concatenate((rows, extra_rows))
+        cols = np.concatenate((cols, extra_cols))
+        weights = np.concatenate((weights, extra_weights))
     
-    return G
+    return rows, cols, weights
+
+# Graph shared with the worker processes of network_distance_matrix
+_worker_graph = None
+
+def _init_network_worker(graph):
+    global _worker_graph
+    _worker_graph = graph
 
-def network_distance_matrix(coordinates):
+def _network_rows(sources):
+    """Single-source shortest paths for a block of source nodes (runs in a worker)."""
+    from scipy.sparse.csgraph import dijkstra
+    return sources, dijkstra(_worker_graph, directed=False, indices=sources)
+
+def network_distance_matrix(coordinates, road_factor=1.3, workers=None, rows_per_task=64):
     """
     Calculate distance matrix using a simple road network.
     
+    Runs one single-source Dijkstra per node over a sparse graph, filling
+    a whole row at a time. For larger inputs the rows are computed in a
+    process pool.
+    
     Args:
         coordinates (list): List of dicts with 'lat' and 'lng' keys
+        road_factor (float): Multiplier to account for road curvature
+        workers (int, optional): Number of worker processes (1 disables the pool)
+        rows_per_task (int): Source rows computed per pool task
         
     Returns:
-        list: 2D matrix of distances in kilometers
+        ndarray: (n, n) matrix of distances in kilometers
     """
-    # Build road network
-    G = build_road_network(coordinates)
+    from scipy.sparse import csr_matrix
+    from scipy.sparse.csgraph import dijkstra
     
-    # Calculate all pairs shortest paths
     n = len(coordinates)
-    distance_matrix = [[0 for _ in range(n)] for _ in range(n)]
+    rows, cols, weights = _road_network_edges(coordinates)
+    graph = csr_matrix((weights, (rows, cols)), shape=(n, n))
     
-    for i in range(n):
-        for j in range(i + 1, n):
-            # Find shortest path
-            path, distance = dijkstra_shortest_path(G, i, j)
-            
-            if path:
-                # Multiply by a factor to account for road curvature
-                road_factor = 1.3
-                distance_matrix[i][j] = distance * road_factor
-                distance_matrix[j][i] = distance * road_factor
-            else:
-                # Fallback to haversine if no path found
-                lat1 = coordinates[i]['lat']
-                lng1 = coordinates[i]['lng']
-                lat2 = coordinates[j]['lat']
-                lng2 = coordinates[j]['lng']
-                
-                direct_distance = haversine_distance(lat1, lng1, lat2, lng2)
-                distance_matrix[i][j] = direct_distance * 1.3  # Apply same factor
-                distance_matrix[j][i] = direct_distance * 1.3
-    
-    return distance_matrix
\ No newline at end of file
+    sources = np.arange(n)
+    workers = workers or os.cpu_count() or 1
+    
+    if workers > 1 and n >= 4 * rows_per_task:
+        from concurrent.futures import ProcessPoolExecutor
+        
+        distance_matrix = np.empty((n, n), dtype=np.float64)
+        blocks = [sources[i:i + rows_per_task] for i in range(0, n, rows_per_task)]
+        with ProcessPoolExecutor(max_workers=workers, initializer=_init_network_worker,
+                                 initargs=(graph,)) as executor:
+            for block, block_rows in executor.map(_network_rows, blocks):
+                distance_matrix[block] = block_rows
+    else:
+        distance_matrix = dijkstra(graph, directed=False, indices=sources)
+    
+    # Fallback to haversine if no path found
+    unreachable = np.isinf(distance_matrix)
+    if unreachable.any():
+        lats, lngs = coordinate_arrays(coordinates)
+        direct = haversine_matrix(lats, lngs)
+        distance_matrix[unreachable] = direct[unreachable]
+    
+    # Multiply by a factor to account for road curvature
+    distance_matrix *= road_factor
+    
+    return distance_matrix
@@ -0,0 +1,280 @@
+import logging
+import threading
+
+import numpy as np
+from sqlalchemy import event
+from sqlalchemy.orm import Session, object_session
+
+from utils.distance_matrix import TILED_MATRIX_THRESHOLD, calculate_distance_matrix, haversine_distances
+from utils.matrix_cache import get_cached_distance_matrix
+
+logger = logging.getLogger(__name__)
+
+# Key under Session.info where uncommitted location changes are collected
+PENDING_CHANGES_KEY = 'location_matrix_changes'
+
+# Factor the backing matrix grows by when full; its memory grows with the square
+LOCATION_MATRIX_GROWTH = 1.25
+
+# Smallest number of rows/columns added when the backing matrix grows
+LOCATION_MATRIX_MIN_GROWTH = 64
+
+
+class LocationDistanceMatrix:
+    """
+    A distance matrix over the Location table that is kept up to date
+    incrementally.
+    
+    Adding a location computes one new row/column (O(N)), removing one
+    moves the last row/column into its slot (O(N)). The backing array
+    grows by LOCATION_MATRIX_GROWTH (memory by its square), so inserts are
+    amortised O(N) as well. Optimizers get the submatrix for the locations
+    they use with matrix_for(). Above TILED_MATRIX_THRESHOLD locations no
+    matrix is maintained and matrix_for() computes the requested one.
+    """
+    def __init__(self, dtype=np.float64, initial_capacity=64):
+        """
+        Initialize an empty maintained matrix.
+        
+        Args:
+            dtype: Storage dtype of the matrix
+            initial_capacity (int): Number of rows/columns allocated up front
+        """
+        self.dtype = dtype
+        self.loaded = False
+        self.too_large = False
+        self._lock = threading.RLock()
+        self._size = 0
+        self._ids = []
+        self._positions = {}  # location id -> row index
+        self._lats = np.zeros(initial_capacity, dtype=np.float64)
+        self._lngs = np.zeros(initial_capacity, dtype=np.float64)
+        self._matrix = np.zeros((initial_capacity, initial_capacity), dtype=dtype)
+    
+    def __len__(self):
+        return self._size
+    
+    def __contains__(self, location_id):
+        return location_id in self._positions
+    
+    def load(self, locations):
+        """
+        Replace the contents with a full set of locations.
+        
+        The initial matrix goes through the distance matrix cache, so a
+        restarted worker does not pay the full O(N^2) cost again. Above
+        TILED_MATRIX_THRESHOLD locations nothing is kept in memory, but the
+        matrix is still marked as loaded so callers don't retry, and
+        upsert() and remove() do nothing.
+        
+        Args:
+            locations (list): (id, latitude, longitude) tuples
+        """
+        locations = list(locations)
+        if len(locations) > TILED_MATRIX_THRESHOLD:
+            with self._lock:
+                self._drop(len(locations))
+                self.loaded = True
+            return
+        
+        coordinates = [{'lat': lat, 'lng': lng} for _, lat, lng in locations]
+        matrix = get_cached_distance_matrix(coordinates, dtype=self.dtype) if coordinates else None
+        
+        with self._lock:
+            self.too_large = False
+            self._size = 0
+            self._ids = []
+            self._positions = {}
+            self._reserve(len(locations))
+            for location_id, lat, lng in locations:
+                self._positions[location_id] = self._size
+                self._ids.append(location_id)
+                self._lats[self._size] = lat
+                self._lngs[self._size] = lng
+                self._size += 1
+            if matrix is not None:
+                self._matrix[:self._size, :self._size] = matrix
+            self.loaded = True
+    
+    def upsert(self, locations):
+        """
+        Add new locations or move existing ones, computing only their rows and columns.
+        
+        Does nothing while the matrix is too large to maintain; the matrix
+        is dropped once inserts take it above TILED_MATRIX_THRESHOLD.
+        
+        Args:
+            locations (list): (id, latitude, longitude) tuples
+        """
+        with self._lock:
+            if self.too_large:
+                return
+            locations = list(locations)
+            added = len({location_id for location_id, _, _ in locations} - self._positions.keys())
+            if self._size + added > TILED_MATRIX_THRESHOLD:
+                self._drop(self._size + added)
+                return
+            
+            changed = []
+            for location_id, lat, lng in locations:
+                position = self._positions.get(location_id)
+                if position is None:
+                    self._reserve(self._size + 1)
+                    position = self._size
+                    self._positions[location_id] = position
+                    self._ids.append(location_id)
+                    self._size += 1
+                elif self._lats[position] == lat and self._lngs[position] == lng:
+                    continue
+                self._lats[position] = lat
+                self._lngs[position] = lng
+                changed.append(position)
+            
+            if not changed:
+                return
+            
+            n = self._size
+            changed = np.array(changed, dtype=np.int64)
+            rows = haversine_distances(self._lats[changed], self._lngs[changed],
+                                       self._lats[:n], self._lngs[:n])
+            self._matrix[changed, :n] = rows
+            self._matrix[:n, changed] = rows.T
+            self._matrix[changed, changed] = 0
+    
+    def remove(self, location_ids):
+        """
+        Drop locations by moving the last row/column into each freed slot.
+        
+        Args:
+            location_ids (list): IDs of the locations to remove
+        """
+        with self._lock:
+            if self.too_large:
+                return
+            for location_id in location_ids:
+                position = self._positions.pop(location_id, None)
+                if position is None:
+                    continue
+                
+                last = self._size - 1
+                if position != last:
+                    moved_id = self._ids[last]
+                    self._ids[position] = moved_id
+                    self._positions[moved_id] = position
+                    self._lats[position] = self._lats[last]
+                    self._lngs[position] = self._lngs[last]
+                    self._matrix[position, :last] = self._matrix[last, :last]
+                    self._matrix[:last, position] = self._matrix[:last, last]
+                    self._matrix[position, position] = 0
+                
+                self._ids.pop()
+                self._size -= 1
+    
+    def matrix_for(self, locations):
+        """
+        Get the distance matrix for an ordered list of locations.
+        
+        Locations that are missing or whose coordinates changed (e.g. written
+        by another worker process) are patched in incrementally first.
+        
+        Args:
+            locations (list): (id, latitude, longitude) tuples, in matrix order
+        
+        Returns:
+            ndarray: (n, n) matrix of distances in kilometers
+        """
+        locations = list(locations)
+        
+        # Very large sets are not kept in memory, see utils.tiled_matrix
+        if len(locations) > TILED_MATRIX_THRESHOLD or self.too_large:
+            return calculate_distance_matrix([{'lat': lat, 'lng': lng} for _, lat, lng in locations])
+        
+        with self._lock:
+            self.upsert(locations)
+            if self.too_large:
+                return calculate_distance_matrix([{'lat': lat, 'lng': lng} for _, lat, lng in locations])
+            order = np.array([self._positions[location_id] for location_id, _, _ in locations], dtype=np.int64)
+            return self._matrix[np.ix_(order, order)]
+    
+    def _reserve(self, capacity):
+        """Grow the backing arrays (by LOCATION_MATRIX_GROWTH) to hold at least `capacity` locations."""
+        current = len(self._lats)
+        if capacity <= current:
+            return
+        
+        # Growing the side by 25% costs about 56% more memory, doubling it would quadruple it
+        new_capacity = max(capacity, int(current * LOCATION_MATRIX_GROWTH), current + LOCATION_MATRIX_MIN_GROWTH)
+        new_capacity = min(new_capacity, max(capacity, TILED_MATRIX_THRESHOLD))
+        n = self._size
+        
+        lats = np.zeros(new_capacity, dtype=np.float64)
+        lngs = np.zeros(new_capacity, dtype=np.float64)
+        matrix = np.zeros((new_capacity, new_capacity), dtype=self.dtype)
+        lats[:n] = self._lats[:n]
+        lngs[:n] = self._lngs[:n]
+        matrix[:n, :n] = self._matrix[:n, :n]
+        
+        self._lats, self._lngs, self._matrix = lats, lngs, matrix
+    
+    def _drop(self, count):
+        """Stop maintaining a matrix that would exceed TILED_MATRIX_THRESHOLD locations and free it."""
+        logger.info(f"Not keeping a distance matrix for {count} locations in memory")
+        self.too_large = True
+        self._size = 0
+        self._ids = []
+        self._positions = {}
+        self._lats = np.zeros(0, dtype=np.float64)
+        self._lngs = np.zeros(0, dtype=np.float64)
+        self._matrix = np.zeros((0, 0), dtype=self.dtype)
+
+
+# Process-wide maintained matrix for the Location table
+location_distance_matrix = LocationDistanceMatrix()
+
+def register_location_listeners(location_model, maintained=None):
+    """
+    Keep a maintained matrix in sync with a Location model.
+    
+    Inserts, updates and deletes are collected while the session flushes
+    and only applied once the transaction commits, so rolled back changes
+    never reach the matrix.
+    
+    Args:
+        location_model: SQLAlchemy model with id, latitude and longitude columns
+        maintained (LocationDistanceMatrix, optional): Matrix to keep in sync,
+            defaults to the process-wide instance
+    """
+    if maintained is None:
+        maintained = location_distance_matrix
+    
+    def record_upsert(mapper, connection, target):
+        session = object_session(target)
+        if session is not None:
+            changes = session.info.setdefault(PENDING_CHANGES_KEY, {'upserts': [], 'deletes': []})
+            changes['upserts'].append((target.id, target.latitude, target.longitude))
+    
+    def record_delete(mapper, connection, target):
+        session = object_session(target)
+        if session is not None:
+            changes = session.info.setdefault(PENDING_CHANGES_KEY, {'upserts': [], 'deletes': []})
+            changes['deletes'].append(target.id)
+    
+    def apply_changes(session):
+        changes = session.info.pop(PENDING_CHANGES_KEY, None)
+        if not changes:
+            return
+        try:
+            deleted = set(changes['deletes'])
+            maintained.remove(changes['deletes'])
+            maintained.upsert([loc for loc in changes['upserts'] if loc[0] not in deleted])
+        except Exception as e:
+            logger.error(f"Error updating maintained distance matrix: {e}")
+    
+    def discard_changes(session):
+        session.info.pop(PENDING_CHANGES_KEY, None)
+    
+    event.listen(location_model, 'after_insert', record_upsert)
+    event.listen(location_model, 'after_update', record_upsert)
+    event.listen(location_model, 'after_delete', record_delete)
+    event.listen(Session, 'after_commit', apply_changes)
+    event.listen(Session, 'after_rollback', discard_changes)
@@ -0,0 +1,233 @@
+import os
+import logging
+import threading
+from collections import OrderedDict
+
+import numpy as np
+
+from utils.distance_matrix import (
+    TILED_MATRIX_THRESHOLD,
+    calculate_distance_matrix,
+    coordinate_arrays,
+    coordinate_fingerprint,
+    haversine_distances,
+    haversine_matrix,
+)
+
+logger = logging.getLogger(__name__)
+
+# Directory where cached matrices are stored
+MATRIX_CACHE_DIR = 'data/cache/distance_matrix'
+
+# Name of the file recording the most recently stored fingerprint
+LATEST_ENTRY_FILE = 'latest'
+
+
+class DistanceMatrixCache:
+    """
+    Content-addressed cache for haversine distance matrices.
+    
+    Matrices are keyed by a hash of the ordered coordinate list and stored
+    on disk as uncompressed .npz files (coordinates + matrix), with a small
+    in-process LRU in front. On a miss, rows and columns for coordinates
+    that also appear in a cached matrix are copied over and only the
+    new/changed locations are computed.
+    """
+    def __init__(self, cache_dir=MATRIX_CACHE_DIR, max_memory_entries=8, max_disk_entries=32):
+        """
+        Initialize the cache.
+        
+        Args:
+            cache_dir (str): Directory for the on-disk entries
+            max_memory_entries (int): Size of the in-process LRU
+            max_disk_entries (int): Number of entries kept on disk
+        """
+        self.cache_dir = cache_dir
+        self.max_memory_entries = max_memory_entries
+        self.max_disk_entries = max_disk_entries
+        self._entries = OrderedDict()  # fingerprint -> (lats, lngs, matrix)
+        self._lock = threading.Lock()
+        self.stats = {'memory_hits': 0, 'disk_hits': 0, 'partial_hits': 0, 'misses': 0}
+    
+    def get(self, coordinates, dtype=None):
+        """
+        Get the distance matrix for a list of coordinates.
+        
+        Args:
+            coordinates (list): List of dicts with 'lat' and 'lng' keys
+            dtype: Output dtype, defaults to float64 (float32 for tiled matrices)
+        
+        Returns:
+            ndarray: Read-only (n, n) matrix of distances in kilometers
+        """
+        # Very large sets go straight to the tiled, disk-backed store
+        if len(coordinates) > TILED_MATRIX_THRESHOLD:
+            return calculate_distance_matrix(coordinates, dtype=dtype)
+        
+        if dtype is None:
+            dtype = np.float64
+        
+        lats, lngs = coordinate_arrays(coordinates)
+        key = f"{coordinate_fingerprint(lats, lngs)}_{np.dtype(dtype).name}"
+        
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None:
+                self._entries.move_to_end(key)
+                self.stats['memory_hits'] += 1
+                return entry[2]
+        
+        entry = self._load(key)
+        if entry is not None:
+            self.stats['disk_hits'] += 1
+        else:
+            matrix = self._compute(lats, lngs, dtype)
+            entry = (lats, lngs, matrix)
+            self._store(key, entry)
+        
+        with self._lock:
+            self._entries[key] = entry
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_memory_entries:
+                self._entries.popitem(last=False)
+        
+        return entry[2]
+    
+    def clear(self):
+        """Drop all in-memory entries (disk entries are left in place)."""
+        with self._lock:
+            self._entries.clear()
+    
+    def _compute(self, lats, lngs, dtype):
+        """Build a matrix, reusing rows and columns from the closest cached entry."""
+        base = self._find_base(lats, lngs)
+        if base is None:
+            self.stats['misses'] += 1
+            return _read_only(haversine_matrix(lats, lngs, dtype=dtype))
+        
+        base_lats, base_lngs, base_matrix = base
+        base_index = {}
+        for i, point in enumerate(zip(base_lats.tolist(), base_lngs.tolist())):
+            base_index.setdefault(point, i)
+        
+        n = len(lats)
+        old_positions = np.full(n, -1, dtype=np.int64)
+        for i, point in enumerate(zip(lats.tolist(), lngs.tolist())):
+            old_positions[i] = base_index.get(point, -1)
+        
+        reused = np.flatnonzero(old_positions >= 0)
+        changed = np.flatnonzero(old_positions < 0)
+        
+        matrix = np.zeros((n, n), dtype=dtype)
+        matrix[np.ix_(reused, reused)] = base_matrix[np.ix_(old_positions[reused], old_positions[reused])]
+        
+        if len(changed):
+            rows = haversine_distances(lats[changed], lngs[changed], lats, lngs)
+            matrix[changed, :] = rows
+            matrix[:, changed] = rows.T
+            matrix[changed, changed] = 0
+        
+        self.stats['partial_hits'] += 1
+        logger.info(f"Distance matrix cache: reused {len(reused)} locations, computed {len(changed)}")
+        return _read_only(matrix)
+    
+    def _find_base(self, lats, lngs):
+        """Pick the cached entry sharing the most coordinates with the request."""
+        wanted = set(zip(lats.tolist(), lngs.tolist()))
+        
+        with self._lock:
+            candidates = list(reversed(self._entries.values()))
+        
+        if not candidates:
+            latest = self._load_latest()
+            if latest is not None:
+                candidates = [latest]
+        
+        best, best_overlap = None, 0
+        for candidate in candidates:
+            overlap = len(wanted.intersection(zip(candidate[0].tolist(), candidate[1].tolist())))
+            if overlap > best_overlap:
+                best, best_overlap = candidate, overlap
+        
+        # Not worth it if less than half of the locations can be reused
+        if best is None or best_overlap * 2 < len(lats):
+            return None
+        return best
+    
+    def _path(self, key):
+        return os.path.join(self.cache_dir, f"{key}.npz")
+    
+    def _load(self, key):
+        """Load an entry from disk, or return None."""
+        path = self._path(key)
+        if not os.path.exists(path):
+            return None
+        try:
+            with np.load(path) as data:
+                return data['lats'], data['lngs'], _read_only(data['matrix'])
+        except Exception as e:
+            logger.warning(f"Error reading cached distance matrix {path}: {e}")
+            return None
+    
+    def _load_latest(self):
+        """Load the most recently stored entry, used as a reuse base after a restart."""
+        try:
+            with open(os.path.join(self.cache_dir, LATEST_ENTRY_FILE)) as f:
+                return self._load(f.read().strip())
+        except OSError:
+            return None
+    
+    def _store(self, key, entry):
+        """Write an entry to disk atomically and prune old entries."""
+        try:
+            os.makedirs(self.cache_dir, exist_ok=True)
+            path = self._path(key)
+            tmp_path = f"{path}.{os.getpid()}.{threading.get_ident()}.tmp"
+            with open(tmp_path, 'wb') as f:
+                np.savez(f, lats=entry[0], lngs=entry[1], matrix=entry[2])
+            os.replace(tmp_path, path)
+            
+            latest_path = os.path.join(self.cache_dir, LATEST_ENTRY_FILE)
+            with open(f"{latest_path}.{os.getpid()}.tmp", 'w') as f:
+                f.write(key)
+            os.replace(f"{latest_path}.{os.getpid()}.tmp", latest_path)
+            
+            self._prune()
+        except Exception as e:
+            logger.warning(f"Error writing distance matrix cache: {e}")
+    
+    def _prune(self):
+        """Remove the oldest disk entries beyond max_disk_entries."""
+        files = [os.path.join(self.cache_dir, name) for name in os.listdir(self.cache_dir)
+                 if name.endswith('.npz')]
+        if len(files) <= self.max_disk_entries:
+            return
+        files.sort(key=os.path.getmtime)
+        for path in files[:len(files) - self.max_disk_entries]:
+            try:
+                os.remove(path)
+            except OSError:
+                pass
+
+
+def _read_only(matrix):
+    """Mark a cached matrix read-only so callers can't corrupt shared entries."""
+    matrix.setflags(write=False)
+    return matrix
+
+
+# Process-wide cache instance
+distance_matrix_cache = DistanceMatrixCache()
+
+def get_cached_distance_matrix(coordinates, dtype=None):
+    """
+    Get a distance matrix through the process-wide cache.
+    
+    Args:
+        coordinates (list): List of dicts with 'lat' and 'lng' keys
+        dtype: Output dtype, defaults to float64 (float32 for tiled matrices)
+    
+    Returns:
+        ndarray: Read-only (n, n) matrix of distances in kilometers
+    """
+    return distance_matrix_cache.get(coordinates, dtype=dtype)
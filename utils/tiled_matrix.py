@@ -0,0 +1,221 @@
+import os
+import logging
+from concurrent.futures import ThreadPoolExecutor
+
+import numpy as np
+
+from utils.distance_matrix import (
+    TILED_MATRIX_THRESHOLD,
+    coordinate_arrays,
+    coordinate_fingerprint,
+    haversine_distances,
+)
+
+logger = logging.getLogger(__name__)
+
+# Directory where memory-mapped matrices are written
+TILED_MATRIX_DIR = 'data/distance_matrices'
+
+# Default edge length of a square tile (rows x columns computed per task)
+DEFAULT_TILE_SIZE = 1024
+
+# Number of matrix files kept in TILED_MATRIX_DIR, least recently used ones are removed
+TILED_MATRIX_MAX_FILES = 4
+
+
+class TiledDistanceMatrix:
+    """
+    A disk-backed distance matrix for very large stop sets.
+    
+    The matrix is stored as a .npy file and opened with np.memmap, so rows
+    are paged in from disk on access instead of being held in RAM. It
+    behaves like the ndarray returned by calculate_distance_matrix for the
+    operations the optimizers use: len(), matrix[i][j], matrix[i, j] and
+    row slicing.
+    """
+    def __init__(self, path):
+        """
+        Open an existing tiled matrix read-only.
+        
+        Args:
+            path (str): Path to the .npy file written by build()
+        """
+        self.path = path
+        self._data = np.load(path, mmap_mode='r')
+    
+    @classmethod
+    def build(cls, coordinates, path=None, dtype=np.float32, tile_size=DEFAULT_TILE_SIZE, workers=None):
+        """
+        Compute a haversine distance matrix tile by tile into a memory-mapped file.
+        
+        With the default fingerprinted path an existing file for the same
+        coordinates and dtype is reused instead of being rebuilt, and after
+        a build only the TILED_MATRIX_MAX_FILES most recently used files are
+        kept. Only tiles on or above the diagonal are computed; each one is also
+        written to its mirrored position. Tiles are processed in a thread
+        pool (NumPy releases the GIL inside the trig kernels), and peak
+        memory is bounded by workers * tile_size^2 regardless of the number
+        of stops.
+        
+        Args:
+            coordinates (list): List of dicts with 'lat' and 'lng' keys
+            path (str, optional): Output file, defaults to a fingerprinted
+                name under TILED_MATRIX_DIR
+            dtype: Storage dtype (float32 halves the disk footprint)
+            tile_size (int): Edge length of each square tile
+            workers (int, optional): Number of worker threads
+        
+        Returns:
+            TiledDistanceMatrix: Read-only accessor for the new matrix
+        """
+        lats, lngs = coordinate_arrays(coordinates)
+        n = len(lats)
+        
+        fingerprinted = path is None
+        if fingerprinted:
+            os.makedirs(TILED_MATRIX_DIR, exist_ok=True)
+            name = f"haversine_{coordinate_fingerprint(lats, lngs)[:16]}_{np.dtype(dtype).name}.npy"
+            path = os.path.join(TILED_MATRIX_DIR, name)
+            existing = cls._reuse(path, n, dtype)
+            if existing is not None:
+                return existing
+        else:
+            os.makedirs(os.path.dirname(path) or '.', exist_ok=True)
+        
+        # Write to a temporary file and swap it in so readers never see a partial matrix
+        tmp_path = f"{path}.{os.getpid()}.tmp"
+        out = np.lib.format.open_memmap(tmp_path, mode='w+', dtype=dtype, shape=(n, n))
+        
+        starts = list(range(0, n, tile_size))
+        
+        def compute_tile(row_start, col_start):
+            row_stop = min(row_start + tile_size, n)
+            col_stop = min(col_start + tile_size, n)
+            tile = haversine_distances(lats[row_start:row_stop], lngs[row_start:row_stop],
+                                       lats[col_start:col_stop], lngs[col_start:col_stop])
+            out[row_start:row_stop, col_start:col_stop] = tile
+            if row_start != col_start:
+                out[col_start:col_stop, row_start:row_stop] = tile.T
+        
+        logger.info(f"Building tiled distance matrix for {n} points ({len(starts)} tile rows) at {path}")
+        
+        with ThreadPoolExecutor(max_workers=workers or os.cpu_count()) as executor:
+            futures = [executor.submit(compute_tile, r, c)
+                       for i, r in enumerate(starts) for c in starts[i:]]
+            for future in futures:
+                future.result()
+        
+        # Zero the diagonal explicitly, haversine can leave tiny rounding residues
+        for start in starts:
+            stop = min(start + tile_size, n)
+            block = out[start:stop, start:stop]
+            np.fill_diagonal(block, 0)
+        
+        out.flush()
+        del out
+        os.replace(tmp_path, path)
+        
+        if fingerprinted:
+            prune_tiled_matrices(keep=path, directory=os.path.dirname(path))
+        
+        return cls(path)
+    
+    @classmethod
+    def _reuse(cls, path, n, dtype):
+        """Open an existing matrix file if it has the expected shape and dtype, or return None."""
+        if not os.path.exists(path):
+            return None
+        try:
+            matrix = cls(path)
+        except (OSError, ValueError) as e:
+            logger.warning(f"Ignoring unreadable tiled distance matrix {path}: {e}")
+            return None
+        if matrix.shape != (n, n) or matrix.dtype != np.dtype(dtype):
+            return None
+        
+        # Mark the file as recently used so pruning keeps it
+        os.utime(path)
+        logger.info(f"Reusing tiled distance matrix for {n} points at {path}")
+        return matrix
+    
+    @property
+    def shape(self):
+        return self._data.shape
+    
+    @property
+    def dtype(self):
+        return self._data.dtype
+    
+    def __len__(self):
+        return self._data.shape[0]
+    
+    def __getitem__(self, key):
+        return self._data[key]
+    
+    def __reduce__(self):
+        # Pickle by path (e.g. for portfolio worker processes) instead of copying the mapped data
+        return type(self), (self.path,)
+    
+    def row(self, i):
+        """Return row i as an in-memory ndarray."""
+        return np.array(self._data[i])
+    
+    def iter_rows(self, block_size=DEFAULT_TILE_SIZE):
+        """
+        Iterate over the matrix in row blocks.
+        
+        Yields:
+            tuple: (start_row, ndarray block of shape (rows, n))
+        """
+        n = len(self)
+        for start in range(0, n, block_size):
+            yield start, np.array(self._data[start:min(start + block_size, n)])
+    
+    def tolist(self):
+        """
+        Materialise the full matrix as nested lists.
+        
+        Raises:
+            MemoryError: The matrix is above TILED_MATRIX_THRESHOLD points,
+                use row() or iter_rows() instead
+        """
+        if len(self) > TILED_MATRIX_THRESHOLD:
+            raise MemoryError(f"Refusing to materialise a {len(self)}x{len(self)} tiled distance matrix")
+        return self._data.tolist()
+    
+    def delete(self):
+        """Close the memory map and remove the backing file."""
+        self._data = None
+        if os.path.exists(self.path):
+            os.remove(self.path)
+
+
+
+def prune_tiled_matrices(keep=None, max_files=TILED_MATRIX_MAX_FILES, directory=TILED_MATRIX_DIR):
+    """
+    Remove the least recently used matrix files beyond max_files.
+    
+    Files that are still memory-mapped by a reader stay readable until they
+    are closed; unlinking only removes the directory entry.
+    
+    Args:
+        keep (str, optional): Path that is never removed (the matrix just built)
+        max_files (int): Number of files to keep
+        directory (str): Directory holding the matrix files
+    """
+    try:
+        paths = [os.path.join(directory, name) for name in os.listdir(directory) if name.endswith('.npy')]
+    except OSError:
+        return
+    if len(paths) <= max_files:
+        return
+    
+    paths.sort(key=os.path.getmtime, reverse=True)
+    for path in paths[max_files:]:
+        if keep is not None and os.path.abspath(path) == os.path.abspath(keep):
+            continue
+        try:
+            os.remove(path)
+            logger.info(f"Removed least recently used tiled distance matrix {path}")
+        except OSError:
+            pass